@@ -0,0 +1,97 @@
+"""
+Benchmark running App Insights queries over the shared HttpTransport against connecting
+and requesting an access token for every query (the previous behaviour).
+
+Runs offline against a local stand-in for the App Insights query API.
+
+Usage:
+    python end_to_end_tests/benchmark_app_insights_transport.py --queries 50 --token-latency 0.05
+"""
+
+import argparse
+import sys
+import time
+
+from common.app_insights import APPINSIGHTS_SCOPE, QueryProcessor
+from common.transport import HttpTransport
+from local.app_insights_server import FakeAppInsightsServer
+from local.token_credential import FakeTokenCredential
+
+
+def run_benchmark(
+    server: FakeAppInsightsServer,
+    query_count: int,
+    token_latency_seconds: float,
+    share_transport: bool,
+):
+    token_credential = FakeTokenCredential(latency_seconds=token_latency_seconds)
+    shared_transport = HttpTransport(token_credential, APPINSIGHTS_SCOPE)
+    connection_count_before = server.connection_count
+
+    start = time.perf_counter()
+    for _ in range(query_count):
+        transport = (
+            shared_transport
+            if share_transport
+            else HttpTransport(token_credential, APPINSIGHTS_SCOPE)
+        )
+        query_processor = QueryProcessor(
+            app_id="benchmark", transport=transport, endpoint=server.endpoint
+        )
+        _, error_message = query_processor.run_query(
+            "requests | summarize count() by bin(timestamp, 10s)", "PT1H"
+        )
+        if error_message:
+            raise Exception(f"Query failed: {error_message}")
+        if not share_transport:
+            transport.close()
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"{'shared transport' if share_transport else 'per-query connection':<22}"
+        + f" {elapsed:8.3f}s"
+        + f"  connections: {server.connection_count - connection_count_before:4}"
+        + f"  token requests: {token_credential.token_request_count:4}"
+    )
+    if share_transport:
+        stats = shared_transport.stats
+        print(f"network calls saved: {stats.network_calls_saved} ({stats})")
+    shared_transport.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument(
+        "--rows", type=int, default=360, help="Rows in each query result"
+    )
+    parser.add_argument(
+        "--token-latency",
+        type=float,
+        default=0.05,
+        help="Simulated time (seconds) to get an access token",
+    )
+    parser.add_argument(
+        "--query-latency",
+        type=float,
+        default=0.0,
+        help="Simulated time (seconds) for App Insights to run a query",
+    )
+    args = parser.parse_args()
+
+    with FakeAppInsightsServer(latency_seconds=args.query_latency) as server:
+        server.add_result(
+            "requests",
+            ["timestamp", "count_"],
+            [
+                [f"2024-01-01T00:{i // 6:02}:{i % 6 * 10:02}Z", i]
+                for i in range(args.rows)
+            ],
+        )
+        run_benchmark(server, args.queries, args.token_latency, share_transport=False)
+        run_benchmark(server, args.queries, args.token_latency, share_transport=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
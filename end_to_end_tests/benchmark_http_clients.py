@@ -0,0 +1,144 @@
+"""
+Benchmark the maximum request rate per CPU core of the HTTP client backends for the scenario users
+(HTTP_CLIENT=requests or HTTP_CLIENT=fast).
+
+Runs Locust users with no wait time against a local simulator stand-in (local/simulator.py) in a separate process
+and divides the number of requests by the CPU time used by the Locust process, so the result doesn't depend on
+how fast the stand-in can respond.
+
+Usage:
+    python end_to_end_tests/benchmark_http_clients.py --users 50 --duration 10
+"""
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import gevent
+from locust import constant, task
+from locust.env import Environment
+
+from common.users import HTTP_CLIENTS, encode_json, get_http_user_class, post_json
+
+# the same body as the chat requests in scenario_prioritization.py
+chat_body = encode_json(
+    {
+        "messages": [
+            {"role": "user", "content": "Lorem ipsum dolor sit amet?"},
+        ],
+        "model": "gpt-35-turbo",
+        "max_tokens": 200,
+    }
+)
+
+
+def create_user_class(http_client: str, host: str):
+    class BenchmarkUser(get_http_user_class(http_client)):
+        wait_time = constant(0)
+
+        @task
+        def make_chat_request(self):
+            post_json(
+                self.client,
+                "/openai/deployments/gpt-35-turbo/chat/completions?api-version=2023-05-15",
+                chat_body,
+                {"api-key": "benchmark"},
+            )
+
+    BenchmarkUser.host = host
+    return BenchmarkUser
+
+
+def get_free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_simulator(port: int) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, "-m", "local.simulator", "--port", str(port)],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    # wait for the server to be listening
+    process.stdout.readline()
+    return process
+
+
+def run_benchmark(
+    http_client: str, host: str, user_count: int, duration: float, warm_up: float
+):
+    """
+    Returns (requests per second, CPU utilisation of the Locust process, requests per CPU second, failures)
+    """
+    environment = Environment(user_classes=[create_user_class(http_client, host)])
+    counts = {"requests": 0, "failures": 0}
+
+    def on_request(exception, **kwargs):
+        counts["requests"] += 1
+        if exception:
+            counts["failures"] += 1
+
+    environment.events.request.add_listener(on_request)
+    runner = environment.create_local_runner()
+    runner.start(user_count, spawn_rate=user_count)
+    gevent.sleep(warm_up)
+
+    counts["requests"] = counts["failures"] = 0
+    start_time = time.perf_counter()
+    start_cpu_time = time.process_time()
+    gevent.sleep(duration)
+    request_count = counts["requests"]
+    cpu_time = time.process_time() - start_cpu_time
+    elapsed = time.perf_counter() - start_time
+
+    runner.quit()
+    return (
+        request_count / elapsed,
+        cpu_time / elapsed,
+        request_count / cpu_time,
+        counts["failures"],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--warm-up", type=float, default=2)
+    parser.add_argument(
+        "--http-client",
+        choices=list(HTTP_CLIENTS),
+        action="append",
+        help="HTTP client backend(s) to benchmark (defaults to all)",
+    )
+    args = parser.parse_args()
+
+    port = get_free_port()
+    simulator = start_simulator(port)
+    try:
+        for http_client in args.http_client or HTTP_CLIENTS:
+            rps, cpu_utilisation, rps_per_core, failures = run_benchmark(
+                http_client,
+                f"http://127.0.0.1:{port}",
+                args.users,
+                args.duration,
+                args.warm_up,
+            )
+            print(
+                f"{http_client:10} {rps:8,.0f} requests/s at {cpu_utilisation:4.0%} CPU "
+                + f"-> max {rps_per_core:8,.0f} requests/s per core ({failures} failures)"
+            )
+    finally:
+        simulator.terminate()
+        simulator.wait()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
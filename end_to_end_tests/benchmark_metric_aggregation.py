@@ -0,0 +1,98 @@
+"""
+Benchmark the CPU cost of recording the request metrics for each Locust request event,
+with and without local aggregation of the request result counter, and the request rate that leaves for a worker.
+The request latency histogram is recorded directly in both cases.
+
+Uses an in-memory OpenTelemetry metric reader so no App Insights resource is needed.
+
+Usage:
+    python end_to_end_tests/benchmark_metric_aggregation.py --requests 200000
+"""
+
+import argparse
+import random
+import sys
+import time
+
+from opentelemetry.sdk.metrics import MeterProvider
+from opentelemetry.sdk.metrics.export import InMemoryMetricReader
+
+from common.metric_aggregation import CounterAggregator
+
+STATUS_CODES = [("200", "OK"), ("429", "Too Many Requests"), ("500", "Server Error")]
+
+
+def run_benchmark(request_count: int, aggregate: bool, flush_every: int) -> float:
+    """
+    Returns the time taken per request event (in seconds)
+    """
+    reader = InMemoryMetricReader()
+    meter = MeterProvider(metric_readers=[reader]).get_meter(__name__)
+    request_latency = meter.create_histogram(
+        "locust.request_latency", "Request latency", "s"
+    )
+    request_result = CounterAggregator(
+        meter.create_counter("locust.request_result", "Request Response", "count"),
+        attribute_names=("status_code", "priority", "request_type", "reason"),
+        enabled=aggregate,
+    )
+
+    # generate the events up front so that only the metric recording is timed
+    events = [
+        (
+            random.lognormvariate(5, 0.5),  # response time in ms
+            random.choice(STATUS_CODES),
+            random.choice(["low", "high"]),
+        )
+        for _ in range(request_count)
+    ]
+
+    start = time.perf_counter()
+    for index, (response_time, (status_code, reason), priority) in enumerate(events):
+        # the same work as report_request_metric and make_request in the prioritization scenario
+        request_latency.record(response_time / 1000)
+        request_result.add(1, (status_code, priority, "chat", reason))
+        if aggregate and index % flush_every == 0:
+            request_result.flush()
+    request_result.flush()
+    elapsed = time.perf_counter() - start
+
+    # check that nothing was lost in aggregation
+    data = reader.get_metrics_data()
+    for resource_metrics in data.resource_metrics:
+        for scope_metrics in resource_metrics.scope_metrics:
+            for metric in scope_metrics.metrics:
+                if metric.name == "locust.request_latency":
+                    count = sum(point.count for point in metric.data.data_points)
+                else:
+                    count = sum(point.value for point in metric.data.data_points)
+                if count != request_count:
+                    raise Exception(
+                        f"{metric.name}: expected {request_count} measurements, got {count}"
+                    )
+    return elapsed / request_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200000)
+    parser.add_argument(
+        "--flush-every",
+        type=int,
+        default=10000,
+        help="Number of requests between flushes (e.g. 5s at 2000 RPS)",
+    )
+    args = parser.parse_args()
+
+    for aggregate in [False, True]:
+        time_per_request = run_benchmark(args.requests, aggregate, args.flush_every)
+        print(
+            f"{'aggregated' if aggregate else 'per-request'}: "
+            + f"{time_per_request * 1e6:6.2f}us of metric recording per request, "
+            + f"max {1 / time_per_request:10,.0f} requests/s per core (metrics only)"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,257 @@
+"""
+Measure how accurately the gateway estimates the tokens of a request (the consumed-tokens variable in
+prioritization-token-calculating.xml, mirrored by common/token_estimation.py) against a real tokenizer.
+
+Replays each prompt in a payload corpus (the PAYLOAD_CORPUS_FILE format, see common/payload_corpus.py) as a completions,
+chat and embeddings request, counts its prompt tokens with tiktoken the way the OpenAI API does, and reports the
+distribution of the estimation error for each request type. Underestimates let more tokens through than the deployment
+can serve (so the backend returns 429s), and overestimates leave PTU throughput unused.
+
+Needs tiktoken, which isn't in requirements.txt, so install it with `pip install tiktoken`.
+
+Usage:
+    python end_to_end_tests/benchmark_token_estimation.py --corpus prompts.jsonl
+    python end_to_end_tests/benchmark_token_estimation.py --corpus prompts.jsonl --encoding o200k_base --max-tokens 0 --worst 5
+"""
+
+import argparse
+import math
+import sys
+
+from tabulate import tabulate
+
+from common.config import payload_corpus_file
+from common.payload_corpus import OPERATIONS, PayloadCorpus
+from common.token_estimation import estimate_policy_tokens, estimate_prompt_tokens
+
+# used if neither --corpus nor PAYLOAD_CORPUS_FILE is set: a mix of prose, code, data and non-English text
+DEFAULT_RECORDS = [
+    {"prompt": "Lorem ipsum dolor sit amet?"},
+    {
+        "prompt": "Summarise the following support ticket in one sentence: the customer reports that since the "
+        + "upgrade to version 4.2 the export job fails every night with a timeout after 30 minutes, "
+        + "although it used to complete in under 10 minutes."
+    },
+    {
+        "prompt": "def fibonacci(n):\n    a, b = 0, 1\n    for _ in range(n):\n        a, b = b, a + b\n    return a\n\n"
+        + "# Explain what this function returns for n = 10 and how to make it handle negative n."
+    },
+    {
+        "prompt": '{"orders": [{"id": 1042, "sku": "AB-7731", "qty": 3, "price": 19.99}, '
+        + '{"id": 1043, "sku": "ZX-0012", "qty": 1, "price": 249.0}]} Total the order values.'
+    },
+    {"prompt": "東京から大阪までの新幹線の所要時間と料金を教えてください。"},
+    {
+        "prompt": "Wie viele Einwohner hat die Stadt München, und welche Sehenswürdigkeiten sollte man besuchen?"
+    },
+    {
+        "messages": [
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": "What is the capital of France?"},
+            {"role": "assistant", "content": "The capital of France is Paris."},
+            {"role": "user", "content": "And what is its population?"},
+        ]
+    },
+]
+# model names to send in the request bodies (the gateway counts "embedding" models as embeddings requests)
+MODELS = {
+    "completions": "gpt-35-turbo",
+    "chat": "gpt-35-turbo",
+    "embeddings": "text-embedding-ada-002",
+}
+# tokens that the OpenAI API adds around each chat message and to prime the reply
+# (https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb)
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_NAME = 1
+TOKENS_PER_REPLY = 3
+
+
+def _import_tiktoken():
+    # tiktoken is only needed for this benchmark, so it isn't in requirements.txt
+    try:
+        import tiktoken
+
+        return tiktoken
+    except ImportError as e:
+        raise ImportError(
+            "Measuring the token estimation accuracy requires tiktoken (pip install tiktoken)"
+        ) from e
+
+
+def _get_text(value) -> str:
+    # chat message content is a string or a list of content parts
+    if isinstance(value, list):
+        return "".join(part.get("text") or "" for part in value)
+    return value or ""
+
+
+def count_prompt_tokens(encoding, operation: str, body: dict) -> int:
+    """
+    Count the prompt tokens of a request body with a tiktoken encoding
+    (special tokens such as <|endoftext|> in the prompt are counted as the text the API sees)
+    """
+    if operation != "chat":
+        prompt = body["input"] if operation == "embeddings" else body["prompt"]
+        return len(encoding.encode(prompt, disallowed_special=()))
+
+    tokens = TOKENS_PER_REPLY
+    for message in body["messages"]:
+        tokens += TOKENS_PER_MESSAGE
+        for key, value in message.items():
+            tokens += len(encoding.encode(_get_text(value), disallowed_special=()))
+            if key == "name":
+                tokens += TOKENS_PER_NAME
+    return tokens
+
+
+def percentile(values: list[float], percent: float) -> float:
+    if not values:
+        return math.nan
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def measure(encoding, corpus: PayloadCorpus, operation: str, max_tokens: int) -> list:
+    """
+    Returns (body, estimated prompt tokens, actual prompt tokens, estimated tokens, actual tokens) for each request,
+    where the tokens counted against the deployment's limit include the completion tokens reserved by max_tokens
+    """
+    results = []
+    for body in corpus.iter_bodies(operation, MODELS[operation], max_tokens):
+        estimated_prompt_tokens = estimate_prompt_tokens(body)
+        actual_prompt_tokens = count_prompt_tokens(encoding, operation, body)
+        estimated_tokens = estimate_policy_tokens(operation, body)
+        # the reserved completion tokens are known exactly, so only the prompt is estimated
+        completion_tokens = estimated_tokens - estimated_prompt_tokens
+        results.append(
+            (
+                body,
+                estimated_prompt_tokens,
+                actual_prompt_tokens,
+                estimated_tokens,
+                actual_prompt_tokens + completion_tokens,
+            )
+        )
+    return results
+
+
+def _error_percent(estimated: int, actual: int) -> float:
+    return (estimated - actual) / actual * 100 if actual else math.nan
+
+
+def summarize(operation: str, results: list) -> list:
+    prompt_errors = [
+        _error_percent(estimated, actual) for _, estimated, actual, _, _ in results
+    ]
+    estimated_total = sum(result[3] for result in results)
+    actual_total = sum(result[4] for result in results)
+    return [
+        operation,
+        len(results),
+        sum(result[2] for result in results) / len(results),
+        percentile(prompt_errors, 5),
+        percentile(prompt_errors, 50),
+        percentile(prompt_errors, 95),
+        sum(abs(error) for error in prompt_errors) / len(prompt_errors),
+        sum(error < 0 for error in prompt_errors) / len(prompt_errors) * 100,
+        _error_percent(estimated_total, actual_total),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--corpus",
+        default=payload_corpus_file,
+        help="JSONL file of prompts (defaults to PAYLOAD_CORPUS_FILE, or a few built-in prompts)",
+    )
+    parser.add_argument(
+        "--encoding",
+        default="cl100k_base",
+        help="tiktoken encoding of the deployed models, e.g. cl100k_base (gpt-35-turbo, gpt-4) or o200k_base (gpt-4o)",
+    )
+    parser.add_argument(
+        "--max-tokens",
+        type=int,
+        default=100,
+        help="max_tokens to send in completions and chat requests (0 to omit it)",
+    )
+    parser.add_argument(
+        "--operations",
+        default=",".join(OPERATIONS),
+        help="Comma-separated request types to measure",
+    )
+    parser.add_argument(
+        "--worst",
+        type=int,
+        default=0,
+        help="Also show the requests with the largest prompt estimation errors for each request type",
+    )
+    args = parser.parse_args()
+
+    encoding = _import_tiktoken().get_encoding(args.encoding)
+    corpus = (
+        PayloadCorpus.load(args.corpus)
+        if args.corpus
+        else PayloadCorpus(DEFAULT_RECORDS)
+    )
+    print(
+        f"Replaying {len(corpus)} prompts (encoding: {args.encoding}, max_tokens: {args.max_tokens})\n"
+    )
+
+    rows = []
+    worst = []
+    for operation in args.operations.split(","):
+        results = measure(encoding, corpus, operation, args.max_tokens)
+        rows.append(summarize(operation, results))
+        results.sort(key=lambda result: -abs(_error_percent(result[1], result[2])))
+        for body, estimated, actual, _, _ in results[: args.worst]:
+            text = _get_text(body.get("input") or body.get("prompt")) or " | ".join(
+                _get_text(message.get("content")) for message in body["messages"]
+            )
+            worst.append(
+                [
+                    operation,
+                    estimated,
+                    actual,
+                    _error_percent(estimated, actual),
+                    text[:60],
+                ]
+            )
+
+    print("Prompt token estimation error, (estimated - actual) / actual:")
+    print(
+        tabulate(
+            rows,
+            [
+                "Request type",
+                "Requests",
+                "Mean prompt tokens",
+                "p5 %",
+                "p50 %",
+                "p95 %",
+                "Mean abs %",
+                "Underestimated %",
+                "Total tokens %",
+            ],
+            floatfmt=".1f",
+        )
+    )
+    print(
+        "\nTotal tokens % is the error in the tokens counted against the deployment's limit over all requests,"
+        + " including the completion tokens reserved by max_tokens"
+    )
+    if worst:
+        print("\nLargest prompt estimation errors:")
+        print(
+            tabulate(
+                worst,
+                ["Request type", "Estimated", "Actual", "Error %", "Prompt"],
+                floatfmt=".1f",
+            )
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
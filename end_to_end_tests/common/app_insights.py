@@ -2,73 +2,24 @@ import base64
 import io
 import logging
 import time
-import requests
+from concurrent.futures import ThreadPoolExecutor
 import urllib.parse
 
 import asciichartpy as asciichart
 
 from azure.core.credentials import TokenCredential
-from dataclasses import dataclass
 from gzip import GzipFile
 from tabulate import tabulate
-from typing import Any
 
+from .charts import fit_series_to_terminal
+from .polling import PollingStrategy
+from .query_cache import QueryCache
+from .table import GroupDefinition, Table
 from .terminal import get_link
+from .transport import HttpTransport, get_shared_transport
 
 APPINSIGHTS_ENDPOINT = "https://api.applicationinsights.io/v1/apps"
-
-
-@dataclass
-class GroupDefinition:
-    id_column: str
-    group_column: str
-    value_column: str
-    missing_value: Any = None
-
-
-@dataclass
-class Table:
-    columns: list[str]
-    rows: list[list[Any]]
-
-    def group_by(
-        self,
-        id_column: str,
-        group_column: str,
-        value_column: str,
-        missing_value: Any = None,
-    ) -> "Table":
-
-        # assume rows are sorted on id_column
-
-        group_column_index = self.columns.index(group_column)
-        distinct_group_column_values = sorted(
-            list(set(row[group_column_index] for row in self.rows))
-        )
-
-        new_columns = [id_column] + [
-            f"{value_column}_{name}" for name in distinct_group_column_values
-        ]
-
-        id_column_index = self.columns.index(id_column)
-        value_column_index = self.columns.index(value_column)
-
-        # Produce a new table where each row has the id_column and a column for each distinct value in group_column with the value of value_column
-        rows = []
-        current_row = None
-        for row in self.rows:
-            if current_row is None or current_row[0] != row[id_column_index]:
-                if current_row is not None:
-                    rows.append(current_row)
-                # start new row
-                current_row = [row[id_column_index]] + (
-                    [missing_value] * len(distinct_group_column_values)
-                )
-            group = row[group_column_index]
-            value = row[value_column_index]
-            current_row[distinct_group_column_values.index(group) + 1] = value
-
-        return Table(rows=rows, columns=new_columns)
+APPINSIGHTS_SCOPE = "https://api.applicationinsights.io/.default"
 
 
 def parse_app_id_from_connection_string(connection_string):
@@ -121,11 +72,15 @@ class QueryProcessor:
     def __init__(
         self,
         app_id: str,
-        token_credential: TokenCredential,
+        token_credential: TokenCredential | None = None,
         tenant_id: str | None = None,
         subscription_id: str | None = None,
         resource_group_name: str | None = None,
         app_insights_name: str | None = None,
+        cache: QueryCache | None = None,
+        cache_only: bool = False,
+        transport: HttpTransport | None = None,
+        endpoint: str = APPINSIGHTS_ENDPOINT,
     ) -> None:
         """
         Constructor
@@ -133,21 +88,37 @@ class QueryProcessor:
         Parameters:
             app_id (str): Application ID (can be found in platform.json)
             api_key (str): API Key
-            token_credential (TokenCredential): TokenCredential object
+            token_credential (TokenCredential): TokenCredential object (defaults to a DefaultAzureCredential shared by the process)
             tenant_id (str): Tenant ID (required if outputting links to the Azure Portal)
             subscription_id (str): Subscription ID (required if outputting links to the Azure Portal)
             resource_group_name (str): Resource Group Name (required if outputting links to the Azure Portal)
             app_insights_name (str): App Insights Name (required if outputting links to the Azure Portal)
+            cache (QueryCache): Cache to store query results in and to check before running queries
+            cache_only (bool): If true then results are only read from the cache and queries are never sent to App Insights
+                               (token_credential is not required)
+            transport (HttpTransport): Transport to send queries with (defaults to a transport shared by the process,
+                                       or a new transport if token_credential is set)
+            endpoint (str): App Insights API endpoint (e.g. to run against a local stand-in)
         """
         if app_id is None:
             raise ValueError("app_id is required")
         self.__app_id = app_id
-        self.__token_credential = token_credential
+        if cache_only:
+            self.__transport = None
+        elif transport:
+            self.__transport = transport
+        elif token_credential:
+            self.__transport = HttpTransport(token_credential, APPINSIGHTS_SCOPE)
+        else:
+            self.__transport = get_shared_transport(APPINSIGHTS_SCOPE)
+        self.__endpoint = endpoint
         self.__queries = []
         self.__tenant_id = tenant_id
         self.__subscription_id = subscription_id
         self.__resource_group_name = resource_group_name
         self.__app_insights_name = app_insights_name
+        self.__cache = cache
+        self.__cache_only = cache_only
 
     def add_query(
         self,
@@ -274,7 +245,7 @@ class QueryProcessor:
 
         return query_error_count
 
-    def run_query(self, query, timespan) -> tuple[Table, str]:
+    def run_query(self, query, timespan, use_cache=True) -> tuple[Table, str]:
         """
         Runs a query on a given timespan.
 
@@ -282,19 +253,22 @@ class QueryProcessor:
             query (str): Query in Kusto query language (KQL) to run.
             timespan (str): The time period into the past from now to fetch data to query on for.
                             in format PT<TIME DURATION> e.g. PT12H.
+            use_cache (bool): If false then the query cache is bypassed (e.g. when polling for data to be ingested)
 
         Returns:
             Table with the query result.
             Error code if any.
         """
-
-        headers = {
-            "Authorization": f"Bearer {self.__token_credential.get_token('https://api.applicationinsights.io/.default').token}"
-        }
-        url = f"{APPINSIGHTS_ENDPOINT}/{self.__app_id}/query?timespan={timespan}"
-        response = requests.post(
-            url,
-            headers=headers,
+        if self.__cache and use_cache:
+            cached_table = self.__cache.get(self.__app_id, query, timespan)
+            if cached_table is not None:
+                return cached_table, None
+        if self.__cache_only:
+            return None, "Result not found in query cache"
+
+        response = self.__transport.post_json(
+            f"{self.__endpoint}/{self.__app_id}/query",
+            params={"timespan": timespan},
             json={"query": query},
         )
 
@@ -303,22 +277,59 @@ class QueryProcessor:
         else:
             primaryTable = response.json()["tables"][0]
             primaryTable = self.__create_table_from_json_response(primaryTable)
+            if self.__cache and use_cache:
+                self.__cache.put(self.__app_id, query, timespan, primaryTable)
             return primaryTable, None
 
-    def wait_for_non_zero_count(self, query, max_retries=10, wait_time_seconds=30):
+    def wait_for_non_zero_count(
+        self, query, polling_strategy: PollingStrategy | None = None
+    ):
         """
         Run a query until it returns a non-zero count.
         """
-        for _ in range(max_retries):
-            r, _ = self.run_query(query=query, timespan="P1D")
-            count = r.rows[0][0]
-            if count > 0:
-                logging.info("✔️ Found metrics data")
-                return
-            logging.info("⏳ Waiting for metrics data...")
-            time.sleep(wait_time_seconds)
+        self.wait_for_non_zero_counts([query], polling_strategy)
 
-        raise Exception("❌ No metrics data found")
+    def wait_for_non_zero_counts(
+        self, queries: list[str], polling_strategy: PollingStrategy | None = None
+    ):
+        """
+        Run a set of queries until they all return a non-zero count.
+        The queries that haven't yet returned a non-zero count are run concurrently on each attempt.
+
+        Parameters:
+            queries (list(str)): Queries returning a single count value
+            polling_strategy (PollingStrategy): Controls the interval between attempts and how long to wait for
+        """
+        polling_strategy = polling_strategy or PollingStrategy(deadline_seconds=300)
+        deadline = time.monotonic() + polling_strategy.deadline_seconds
+        intervals = polling_strategy.intervals()
+        pending_queries = list(queries)
+
+        with ThreadPoolExecutor(max_workers=len(pending_queries)) as executor:
+            while True:
+                counts = executor.map(self.__run_count_query, pending_queries)
+                pending_queries = [
+                    query
+                    for query, count in zip(pending_queries, list(counts))
+                    if count <= 0
+                ]
+                if not pending_queries:
+                    logging.info("✔️ Found metrics data")
+                    return
+
+                remaining_seconds = deadline - time.monotonic()
+                if remaining_seconds <= 0:
+                    raise Exception("❌ No metrics data found")
+                logging.info("⏳ Waiting for metrics data...")
+                time.sleep(min(next(intervals), remaining_seconds))
+
+    def __run_count_query(self, query) -> int:
+        # the count changes as data is ingested, so never cache it
+        result, error_message = self.run_query(query, timespan="P1D", use_cache=False)
+        if error_message:
+            logging.warning("Metrics data check failed: %s", error_message)
+            return 0
+        return result.rows[0][0]
 
     def __output_table(self, query_result: Table, title):
         """
@@ -341,18 +352,9 @@ class QueryProcessor:
             config: The style configuration for the chart, info can be found here: https://github.com/kroitor/asciichart.
         """
 
-        def get_column_values(table: Table, column: str):
-            try:
-                column_index = table.columns.index(column)
-            except ValueError:
-                raise ValueError(
-                    f"Column '{column}' not found in table columns: "
-                    + ",".join(table.columns)
-                )
-            return [row[column_index] for row in table.rows]
-
-        series = [get_column_values(query_result, column) for column in columns]
-        print(asciichart.plot(series, config))
+        series = [list(query_result.column(column)) for column in columns]
+        # long runs have more points than fit across the terminal
+        print(asciichart.plot(fit_series_to_terminal(series, config), config))
 
     def __create_table_from_json_response(self, json) -> Table:
         """
@@ -367,5 +369,6 @@ class QueryProcessor:
 
         # Extract column names
         columns = [column_tuple["name"] for column_tuple in json["columns"]]
+        column_types = [column_tuple.get("type") for column_tuple in json["columns"]]
         rows = json["rows"]
-        return Table(columns=columns, rows=rows)
+        return Table(columns=columns, rows=rows, column_types=column_types)
@@ -0,0 +1,79 @@
+import math
+import shutil
+from itertools import chain
+
+# asciichart defaults for the y-axis labels
+DEFAULT_LABEL_FORMAT = "{:8.2f} "
+DEFAULT_OFFSET = 3
+# don't squash charts below this many points, even in a very narrow terminal
+MIN_CHART_WIDTH = 20
+
+
+def _is_value(value) -> bool:
+    return value is not None and not math.isnan(value)
+
+
+def get_chart_width(series: list[list[float]], config: dict) -> int:
+    """
+    Get the number of points that fit across the terminal for a chart, allowing for the y-axis labels.
+    Set "width" in the chart config to override.
+    """
+    if "width" in config:
+        return config["width"]
+
+    values = [value for value in chain.from_iterable(series) if _is_value(value)]
+    label_format = config.get("format", DEFAULT_LABEL_FORMAT)
+    label_width = 0
+    if values:
+        label_width = max(
+            len(label_format.format(config.get("min", min(values)))),
+            len(label_format.format(config.get("max", max(values)))),
+        )
+    # the label and axis take up the first offset columns of the chart
+    axis_width = label_width + config.get("offset", DEFAULT_OFFSET) - 1
+    return max(shutil.get_terminal_size().columns - axis_width, MIN_CHART_WIDTH)
+
+
+def downsample_min_max(series: list[list[float]], width: int) -> list[list[float]]:
+    """
+    Reduce each series to at most width points, keeping the shape (peaks and troughs) of the series.
+
+    The points are split into width / 2 buckets (the same buckets for every series so that the series stay aligned)
+    and each bucket is replaced with its minimum and maximum values in the order they occur.
+    Missing values (NaN or None) are ignored, a bucket with no values becomes NaN so gaps are kept.
+    Series that already fit are returned unchanged.
+    """
+    point_count = max((len(values) for values in series), default=0)
+    if point_count <= width:
+        return series
+
+    bucket_count = max(width // 2, 1)
+    bucket_edges = [
+        point_count * bucket_index // bucket_count
+        for bucket_index in range(bucket_count + 1)
+    ]
+    downsampled_series = []
+    for values in series:
+        downsampled = []
+        for start, end in zip(bucket_edges, bucket_edges[1:]):
+            bucket = [value for value in values[start:end] if _is_value(value)]
+            if not bucket:
+                downsampled += [math.nan, math.nan]
+                continue
+            low = min(bucket)
+            high = max(bucket)
+            if bucket.index(low) <= bucket.index(high):
+                downsampled += [low, high]
+            else:
+                downsampled += [high, low]
+        downsampled_series.append(downsampled)
+    return downsampled_series
+
+
+def fit_series_to_terminal(
+    series: list[list[float]], config: dict
+) -> list[list[float]]:
+    """
+    Downsample a set of chart series to fit the terminal width (see get_chart_width and downsample_min_max)
+    """
+    return downsample_min_max(series, get_chart_width(series, config))
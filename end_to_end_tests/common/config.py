@@ -15,3 +15,89 @@ simulator_api_key = os.getenv("SIMULATOR_API_KEY")
 tenant_id = os.getenv("TENANT_ID")
 subscription_id = os.getenv("SUBSCRIPTION_ID")
 resource_group_name = os.getenv("RESOURCE_GROUP_NAME")
+
+# Maximum number of report queries to run concurrently against Log Analytics
+query_parallelism = int(os.getenv("QUERY_PARALLELISM", "4"))
+# Send the report queries to Log Analytics using the batch API
+query_batch = os.getenv("QUERY_BATCH", "false").lower() == "true"
+# Directory to cache report query results in so that reports can be re-rendered with report_only.py
+# (set to an empty string to disable caching)
+query_cache_dir = os.getenv(
+    "QUERY_CACHE_DIR", os.path.join(os.path.dirname(__file__), "..", ".query-cache")
+)
+# Directory to export report query results to as Parquet/Arrow IPC files (a sub-directory is created for each run)
+# (defaults to an empty string, which disables exporting)
+results_export_dir = os.getenv("RESULTS_EXPORT_DIR", "")
+# Format to export results in: "parquet" or "arrow"
+results_export_format = os.getenv("RESULTS_EXPORT_FORMAT", "parquet")
+# Also export the raw ApiManagementGatewayLogs rows for each run (requires RESULTS_EXPORT_DIR)
+export_gateway_logs = os.getenv("EXPORT_GATEWAY_LOGS", "false").lower() == "true"
+# Sum the request metric counters locally and add the totals to OpenTelemetry in bulk (rather than for every request)
+metric_aggregation = os.getenv("METRIC_AGGREGATION", "true").lower() == "true"
+# Interval between adding the aggregated counter totals to OpenTelemetry
+metric_flush_interval_seconds = float(os.getenv("METRIC_FLUSH_INTERVAL_SECONDS", "5"))
+# HTTP client for the scenario users: "requests" (locust.HttpUser) or "fast" (locust.FastHttpUser)
+http_client = os.getenv("HTTP_CLIENT", "requests")
+# JSONL file of prompts to build the scenario request bodies from (see common/payload_corpus.py)
+# (defaults to an empty string, which uses each scenario's built-in prompts)
+payload_corpus_file = os.getenv("PAYLOAD_CORPUS_FILE", "")
+# Mix of prompt and completion token sizes to send, as prompt_tokens:max_tokens:weight entries, e.g. "100:50:3,2000:500:1"
+# (defaults to an empty string, which uses each scenario's built-in token sizes)
+payload_token_mix = os.getenv("PAYLOAD_TOKEN_MIX", "")
+# Query Log Analytics and show the results when a test finishes
+# (set to false for local runs against a simulator stand-in, which have no Azure resources to query)
+report_results = os.getenv("REPORT_RESULTS", "true").lower() == "true"
+# Where the reports query the test results: "log-analytics" (the deployed Log Analytics workspace)
+# or "local" (the SQLite database at LOCAL_ANALYTICS_DB written by the local gateway emulator and simulator stand-in)
+analytics_backend = os.getenv("ANALYTICS_BACKEND", "log-analytics")
+# Path of the local analytics database (see common/local_analytics.py)
+local_analytics_db = os.getenv("LOCAL_ANALYTICS_DB", "local-analytics.db")
+# Load mode for the scenario users: "closed" (each user waits between requests, so the load drops when responses slow down)
+# or "open" (each user issues requests at ARRIVAL_RATE whether or not earlier requests have completed)
+load_mode = os.getenv("LOAD_MODE", "closed")
+# Requests per second for each user in open-loop mode
+arrival_rate = float(os.getenv("ARRIVAL_RATE", "1"))
+# Per user class overrides for ARRIVAL_RATE, e.g. "HighPriorityUser=2,LowPriorityUser=0.5"
+arrival_rates = os.getenv("ARRIVAL_RATES", "")
+# Distribution of the time between requests in open-loop mode: "constant" or "poisson"
+arrival_process = os.getenv("ARRIVAL_PROCESS", "constant")
+# Maximum number of open-loop requests in flight in each Locust process (requests due when the limit is reached are dropped)
+max_in_flight = int(os.getenv("MAX_IN_FLIGHT", "1000"))
+# Send the scenario chat completion requests with "stream": true and record time to first token and inter-token latency
+chat_streaming = os.getenv("CHAT_STREAMING", "false").lower() == "true"
+# Backends to probe for latency routing, as backend_id=endpoint entries, e.g. "payg-backend-1=https://<simulator>/openai"
+# (defaults to an empty string, which probes the PAYG1 and PAYG2 simulators)
+latency_probe_backends = os.getenv("LATENCY_PROBE_BACKENDS", "")
+# Number of latency samples to take from each backend
+latency_probe_samples = int(os.getenv("LATENCY_PROBE_SAMPLES", "5"))
+# Timeout for each latency probe request
+latency_probe_timeout_seconds = float(os.getenv("LATENCY_PROBE_TIMEOUT_SECONDS", "10"))
+# Statistic to rank the backends by: "p50" or "trimmed-mean"
+latency_probe_statistic = os.getenv("LATENCY_PROBE_STATISTIC", "p50")
+# Rank the backends by latency per completion token rather than per request
+latency_probe_per_token = (
+    os.getenv("LATENCY_PROBE_PER_TOKEN", "false").lower() == "true"
+)
+# What to rank the latency routing backends by: "total" (full response time), "ttft" (time to first token of a streamed response)
+# or "token-rate" (tokens per second after the first token of a streamed response)
+latency_probe_mode = os.getenv("LATENCY_PROBE_MODE", "total")
+# Interval between latency probes when the latency routing scenario runs the latency routing controller
+# (defaults to 0, which measures the latencies at fixed points in the test instead)
+latency_controller_interval_seconds = float(
+    os.getenv("LATENCY_CONTROLLER_INTERVAL_SECONDS", "0")
+)
+# Weight of each new latency probe in the controller's moving average of each backend's latency (1 for no smoothing)
+latency_controller_smoothing = float(os.getenv("LATENCY_CONTROLLER_SMOOTHING", "0.3"))
+# Fraction by which a backend's average latency must be lower for the controller to prefer it to another backend
+latency_controller_hysteresis = float(os.getenv("LATENCY_CONTROLLER_HYSTERESIS", "0.2"))
+# Number of consecutive probes that must agree on a new backend order before the controller passes it to APIM
+latency_controller_sustain = int(os.getenv("LATENCY_CONTROLLER_SUSTAIN", "2"))
+# Pass weights derived from the measured latencies with the preferred backends so that APIM spreads the traffic across them
+# (rather than sending it all to the fastest backend)
+latency_routing_weights = (
+    os.getenv("LATENCY_ROUTING_WEIGHTS", "false").lower() == "true"
+)
+# How strongly the latency routing weights favour the faster backends: weights are proportional to (fastest latency / latency) ** exponent
+latency_routing_weight_exponent = float(
+    os.getenv("LATENCY_ROUTING_WEIGHT_EXPONENT", "2")
+)
@@ -0,0 +1,245 @@
+import json
+import os
+import re
+from array import array
+from typing import Iterable
+
+from .table import Table
+
+EXPORT_FORMATS = ("parquet", "arrow")
+
+
+def _import_pyarrow():
+    # pyarrow is only needed when exporting results, so it isn't in requirements.txt
+    try:
+        import pyarrow
+
+        return pyarrow
+    except ImportError as e:
+        raise ImportError(
+            "Exporting query results requires pyarrow (pip install pyarrow)"
+        ) from e
+
+
+def get_export_file_name(name: str) -> str:
+    """
+    Convert a query title into a file name (without extension), e.g. "Overall request count" -> "overall-request-count"
+    """
+    return re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-") or "result"
+
+
+def _get_arrow_type(pa, kusto_type: str | None):
+    """
+    Get the arrow type for a Kusto column type (or None to infer the type from the values if the column type isn't known)
+    """
+    if kusto_type is None:
+        return None
+    if kusto_type in ("int", "long"):
+        return pa.int64()
+    if kusto_type == "real":
+        return pa.float64()
+    if kusto_type == "bool":
+        return pa.bool_()
+    if kusto_type == "datetime":
+        return pa.timestamp("us", tz="UTC")
+    # dynamic values (and other types) are stored as JSON text, so that the type doesn't depend on the values
+    return pa.string()
+
+
+def _to_json_text(value):
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value, default=str)
+
+
+def _to_arrow_array(pa, values, arrow_type=None):
+    if arrow_type == pa.string():
+        return pa.array([_to_json_text(value) for value in values], pa.string())
+    if isinstance(values, array) and values.typecode in ("q", "d"):
+        # typed columns are passed to arrow without copying
+        buffer_type = pa.int64() if values.typecode == "q" else pa.float64()
+        buffer_array = pa.Array.from_buffers(
+            buffer_type, len(values), [None, pa.py_buffer(values)]
+        )
+        if arrow_type is None or arrow_type == buffer_type:
+            return buffer_array
+        return buffer_array.cast(arrow_type)
+    if arrow_type is not None:
+        try:
+            return pa.array(values, arrow_type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            pass  # e.g. datetimes returned as text by the App Insights API, fall back to inferring the type
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # mixed values (e.g. dicts with differing keys) are stored as JSON text
+        return _to_arrow_array(pa, values, pa.string())
+
+
+def _to_arrow_table(pa, table: Table, schema=None):
+    """
+    Convert a table to an arrow table, with the column types of schema if set (other than its all-null columns)
+    """
+    column_types = table.column_types or [None] * len(table.columns)
+    arrow_types = [
+        # a dynamic column with no rows says nothing about the values' type (and the local analytics backend
+        # reports the columns of empty results as dynamic), so leave it as null to take the type of later chunks
+        (
+            pa.null()
+            if column_type == "dynamic" and not len(table)
+            else _get_arrow_type(pa, column_type)
+        )
+        for column_type in column_types
+    ]
+    if schema is not None:
+        arrow_types = [
+            arrow_type if pa.types.is_null(field.type) else field.type
+            for field, arrow_type in zip(schema, arrow_types)
+        ]
+    arrow_table = pa.Table.from_arrays(
+        [
+            _to_arrow_array(pa, table.column(column), arrow_type)
+            for column, arrow_type in zip(table.columns, arrow_types)
+        ],
+        names=table.columns,
+    )
+    return arrow_table
+
+
+def _unify_schemas(pa, schemas: list):
+    # promotes all-null columns to the type of the values in other chunks (and ints to floats)
+    return pa.unify_schemas(schemas, promote_options="permissive")
+
+
+def _has_null_fields(pa, schema) -> bool:
+    return any(pa.types.is_null(field.type) for field in schema)
+
+
+class ResultExporter:
+    """
+    Writes query results to Parquet or Arrow IPC files (one file per result) in a directory
+    so that they can be analysed later (e.g. with pandas, polars or DuckDB) without re-querying Azure.
+
+    Arrow IPC files can be memory-mapped by readers without copying.
+    Results are written in row groups (record batches for Arrow IPC) of up to row_group_size rows.
+    """
+
+    def __init__(
+        self, directory: str, format: str = "parquet", row_group_size: int = 65536
+    ) -> None:
+        """
+        Constructor
+
+        Parameters:
+            directory (str): Directory to write the files to (created if it doesn't exist)
+            format (str): "parquet" or "arrow" (Arrow IPC file format)
+            row_group_size (int): Maximum number of rows in each row group
+        """
+        if format not in EXPORT_FORMATS:
+            raise ValueError(
+                f"Unsupported export format '{format}', expected one of: {','.join(EXPORT_FORMATS)}"
+            )
+        self.__pa = _import_pyarrow()
+        self.__directory = directory
+        self.__format = format
+        self.__row_group_size = row_group_size
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def directory(self) -> str:
+        return self.__directory
+
+    def export(self, name: str, table: Table) -> str:
+        """
+        Write a table to a file named after name and return the path of the file.
+        """
+        return self.export_chunks(name, [table])
+
+    def export_chunks(self, name: str, tables: Iterable[Table]) -> str:
+        """
+        Write a sequence of tables with the same columns to a single file and return the path of the file.
+
+        tables can be a generator, each table is written (and can be released) before the next is requested
+        so the whole result never needs to be held in memory.
+
+        Column types come from the tables' Kusto column types (dynamic values are written as JSON text).
+        While a column has only had nulls its type isn't known, so tables are held back (up to row_group_size rows)
+        until a later table gives it a type, after which it is written as JSON text.
+        """
+        path = os.path.join(
+            self.__directory, f"{get_export_file_name(name)}.{self.__format}"
+        )
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        writer = None
+        schema = None
+        # chunks held back while a column's type is unknown (it has only had nulls)
+        pending_tables = []
+        try:
+            for table in tables:
+                arrow_table = _to_arrow_table(self.__pa, table, schema)
+                if writer is not None:
+                    if arrow_table.schema != schema:
+                        arrow_table = arrow_table.cast(schema)
+                    self.__write(writer, arrow_table)
+                    continue
+
+                pending_tables.append(arrow_table)
+                schema = _unify_schemas(
+                    self.__pa,
+                    [pending_table.schema for pending_table in pending_tables],
+                )
+                pending_rows = sum(map(len, pending_tables))
+                if (
+                    _has_null_fields(self.__pa, schema)
+                    and pending_rows < self.__row_group_size
+                ):
+                    continue
+                writer, schema = self.__write_pending(temp_path, schema, pending_tables)
+            if writer is None and pending_tables:
+                writer, schema = self.__write_pending(temp_path, schema, pending_tables)
+            if writer is None:
+                raise ValueError(f"No results to export for '{name}'")
+        except BaseException:
+            if writer is not None:
+                writer.close()
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        writer.close()
+        os.replace(temp_path, path)
+        return path
+
+    def __write_pending(self, path: str, schema, pending_tables: list) -> tuple:
+        """
+        Create the writer for the file and write the chunks held back so far, returning the writer and its schema.
+        Columns that have only had nulls are written as JSON text, so that later chunks can hold any value in them.
+        """
+        pa = self.__pa
+        schema = pa.schema(
+            [
+                field.with_type(pa.string()) if pa.types.is_null(field.type) else field
+                for field in schema
+            ]
+        )
+        writer = self.__create_writer(path, schema)
+        for arrow_table in pending_tables:
+            self.__write(writer, arrow_table.cast(schema))
+        pending_tables.clear()
+        return writer, schema
+
+    def __create_writer(self, path: str, schema):
+        if self.__format == "parquet":
+            import pyarrow.parquet
+
+            return pyarrow.parquet.ParquetWriter(path, schema)
+
+        import pyarrow.ipc
+
+        return pyarrow.ipc.new_file(path, schema)
+
+    def __write(self, writer, arrow_table):
+        if self.__format == "parquet":
+            writer.write_table(arrow_table, row_group_size=self.__row_group_size)
+        else:
+            writer.write_table(arrow_table, max_chunksize=self.__row_group_size)
@@ -1,19 +1,22 @@
 import logging
 import os
-import time
 import requests
 
 from opentelemetry import metrics
 from azure.monitor.opentelemetry import configure_azure_monitor
 
 from .config import (
-    apim_endpoint,
-    apim_subscription_one_key,
     app_insights_connection_string,
     simulator_api_key,
-    simulator_endpoint_payg1,
-    simulator_endpoint_payg2,
+    latency_probe_mode,
+    latency_probe_per_token,
+    latency_probe_statistic,
+    latency_routing_weight_exponent,
+    latency_routing_weights,
 )
+from .latency_controller import set_preferred_backends
+from .latency_probe import LatencyProbe, create_latency_probe
+from .weighted_routing import latency_weights
 
 deployment_name = "gpt-35-turbo-100k-token"
 
@@ -73,6 +76,19 @@ def set_simulator_chat_completions_latency(endpoint: str, latency: float):
     response.raise_for_status()
 
 
+_latency_probe: LatencyProbe | None = None
+
+
+def get_latency_probe() -> LatencyProbe:
+    """
+    Get the LatencyProbe for the latency routing backends (created on first use so that its connections are re-used)
+    """
+    global _latency_probe
+    if _latency_probe is None:
+        _latency_probe = create_latency_probe(deployment_name)
+    return _latency_probe
+
+
 def measure_latency_and_update_apim():
     """
     Make calls to the simulator endpoints to measure the latency.
@@ -90,65 +106,45 @@ def measure_latency_and_update_apim():
     # The measurement used here takes a balanced view by measuring the time to receive the full
     # response but setting max_tokens to 10 to limit the degree of variation in the
     # number of tokens in the response (and hence the response time)
-
-    def measure_latency(endpoint: str):
-        """Helper to measure the latency of an endpoint"""
-        time_start = time.perf_counter()
-        try:
-            response = requests.post(
-                url=f"{endpoint}/deployments/{deployment_name}/completions?api-version=2023-05-15",
-                headers={
-                    "api-key": simulator_api_key,
-                    "Content-Type": "application/json",
-                },
-                json={
-                    "model": "gpt-5-turbo-1",
-                    "prompt": "Once upon a time",
-                    "max_tokens": 10,
-                },
-                timeout=30,
-            )
-            response.raise_for_status()
-            time_end = time.perf_counter()
-            return time_end - time_start
-        except requests.ReadTimeout:
-            logging.warning("Request to %s timed out", endpoint)
-            return float("inf")
-
-    backends = [
-        {
-            "endpoint": f"{simulator_endpoint_payg1}/openai",
-            "backend-id": "payg-backend-1",
-        },
-        {
-            "endpoint": f"{simulator_endpoint_payg2}/openai",
-            "backend-id": "payg-backend-2",
-        },
-    ]
-    backends_with_latency = [
-        {
-            "endpoint": backend["endpoint"],
-            "backend-id": backend["backend-id"],
-            "latency": measure_latency(backend["endpoint"]),
-        }
-        for backend in backends
-    ]
-
-    # sort with lowest latency first
-    backends_with_latency = sorted(backends_with_latency, key=lambda x: x["latency"])
-    for backend in backends_with_latency:
+    # (set LATENCY_PROBE_PER_TOKEN to rank on the time per generated token instead)
+    # For interactive chat the time to first token is the latency that users see, and ranking on the total time
+    # penalizes backends that are generating tokens, so set LATENCY_PROBE_MODE to ttft to stream the probe requests
+    # and rank on the time to first token (or token-rate to rank on the tokens per second after the first token)
+    # Several samples are taken from each backend (concurrently) and ranked by LATENCY_PROBE_STATISTIC
+    # so that a single slow request doesn't reorder the backends
+    # Set LATENCY_ROUTING_WEIGHTS to pass weights derived from the latencies so that APIM spreads the traffic across
+    # the backends rather than sending it all to the fastest one
+
+    latency_probe = get_latency_probe()
+    results = latency_probe.probe()
+    unit = (
+        "ms/token"
+        if latency_probe_per_token or latency_probe_mode == "token-rate"
+        else "ms"
+    )
+    for result in results:
         logging.info(
-            "    %s: %s ms",
-            backend["endpoint"],
-            backend["latency"] * 1000,
+            "    %s: %.1f %s (%s %s of %s)",
+            result.backend.endpoint,
+            result.latency * 1000,
+            unit,
+            latency_probe_mode,
+            latency_probe_statistic,
+            ", ".join(f"{sample * 1000:.1f}" for sample in result.samples),
+        )
+        if result.time_to_first_token is not None:
+            logging.info(
+                "        time to first token: %.1f ms, tokens per second: %.1f",
+                result.time_to_first_token * 1000,
+                result.tokens_per_second,
+            )
+    # sorted with lowest latency first
+    sorted_backends = [result.backend.backend_id for result in results]
+    weights = None
+    if latency_routing_weights:
+        weights = latency_weights(
+            [result.latency for result in results], latency_routing_weight_exponent
         )
-    sorted_backends = [backend["backend-id"] for backend in backends_with_latency]
+        logging.info("    Weights: %s", weights)
 
-    payload = {"preferredBackends": sorted_backends}
-    response = requests.post(
-        url=f"{apim_endpoint}/helpers/set-preferred-backends",
-        json=payload,
-        headers={"api-key": apim_subscription_one_key},
-    )
-    response.raise_for_status()
-    logging.info("    Updated APIM with preferred backends: %s", response.text)
+    set_preferred_backends(latency_probe.session, sorted_backends, weights)
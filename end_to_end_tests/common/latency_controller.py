@@ -0,0 +1,298 @@
+import asyncio
+import copy
+import logging
+import math
+import threading
+from dataclasses import asdict, dataclass
+from datetime import UTC, datetime
+from typing import Callable
+
+import requests
+
+from .config import (
+    apim_endpoint,
+    apim_subscription_one_key,
+    latency_controller_hysteresis,
+    latency_controller_smoothing,
+    latency_controller_sustain,
+    latency_routing_weight_exponent,
+    latency_routing_weights,
+)
+from .latency_probe import LatencyProbe, ProbeResult
+from .weighted_routing import latency_weights, weighted_preferred_backends
+
+
+def set_preferred_backends(
+    session: requests.Session,
+    backend_ids: list[str],
+    weights: list[float] | None = None,
+):
+    """
+    Pass the preferred backend order (fastest first) to the set-preferred-backends helper API in APIM,
+    with the weight of each backend to spread the traffic across them if given
+    """
+    response = session.post(
+        url=f"{apim_endpoint}/helpers/set-preferred-backends",
+        json={"preferredBackends": weighted_preferred_backends(backend_ids, weights)},
+        headers={"api-key": apim_subscription_one_key},
+        timeout=30,
+    )
+    response.raise_for_status()
+    logging.info("    Updated APIM with preferred backends: %s", response.text)
+
+
+@dataclass
+class BackendState:
+    backend_id: str
+    endpoint: str
+    # exponentially weighted moving average of the probe latencies (None until the backend has been probed successfully)
+    ewma_latency: float | None = None
+    last_latency: float | None = None
+    # consecutive failed probes (a failing backend is ranked last, and its average restarts when it recovers)
+    failures: int = 0
+
+    @property
+    def ranking_latency(self) -> float:
+        if self.failures or self.ewma_latency is None:
+            return math.inf
+        return self.ewma_latency
+
+
+@dataclass
+class ControllerState:
+    # the order last passed to APIM (None until the first update)
+    preferred_backends: list[str] | None
+    # the weights last passed to APIM with preferred_backends (None if the controller doesn't weight the backends)
+    weights: list[float] | None
+    # an order that differs from preferred_backends, and the number of consecutive probes that have ranked the backends in it
+    candidate_backends: list[str] | None
+    candidate_count: int
+    backends: list[BackendState]
+    probe_count: int
+    update_count: int
+    last_probe_time: datetime | None
+    last_update_time: datetime | None
+
+    def to_dict(self) -> dict:
+        """
+        The state as a JSON serializable dictionary
+        """
+        state = asdict(self)
+        for name in ("last_probe_time", "last_update_time"):
+            if state[name] is not None:
+                state[name] = state[name].isoformat()
+        for backend in state["backends"]:
+            for name in ("ewma_latency", "last_latency"):
+                # infinity isn't valid JSON
+                if backend[name] is not None and math.isinf(backend[name]):
+                    backend[name] = None
+        return state
+
+
+class LatencyRoutingController:
+    """
+    Keeps the preferred backend order for latency routing up to date: probes the backends on an interval,
+    smooths each backend's latency with an exponentially weighted moving average (EWMA),
+    and passes the order to APIM only when it changes.
+    If a weight exponent is given, the backends are also weighted by their average latencies (see latency_weights),
+    and the weights are passed to APIM again when any of them changes by more than the hysteresis fraction.
+
+    To avoid flipping the order (and churning the preferred backends cached in APIM) on noise, a backend only moves
+    ahead of another if its average latency is lower by more than the hysteresis fraction, and a new order is only
+    passed to APIM once `sustain` consecutive probes have agreed on it (or straight away if the preferred backend is failing).
+
+    Call step to probe once (e.g. from a scheduled task or a greenlet), or run the controller as an asyncio service with run.
+    """
+
+    def __init__(
+        self,
+        probe: LatencyProbe,
+        update_preferred_backends: Callable[[list[str], list[float] | None], None],
+        smoothing: float = 0.3,
+        hysteresis: float = 0.2,
+        sustain: int = 2,
+        weight_exponent: float | None = None,
+    ) -> None:
+        """
+        Constructor
+
+        Parameters:
+            probe (LatencyProbe): Probe to measure the backend latencies with
+            update_preferred_backends (Callable): Called with the backend IDs (fastest first) and weights when they change
+            smoothing (float): Weight of each new probe in the moving average (between 0 and 1, 1 for no smoothing)
+            hysteresis (float): Fraction by which a backend's average latency must be lower to move ahead of another
+            sustain (int): Number of consecutive probes that must agree on a new order before it is used
+            weight_exponent (float): Exponent for latency_weights to weight the backends with (None to pass only the order)
+        """
+        if not 0 < smoothing <= 1:
+            raise ValueError("Smoothing must be greater than 0 and at most 1")
+        if not 0 <= hysteresis < 1:
+            raise ValueError("Hysteresis must be at least 0 and less than 1")
+        if sustain < 1:
+            raise ValueError("Sustain must be at least 1")
+        self.__probe = probe
+        self.__update_preferred_backends = update_preferred_backends
+        self.__smoothing = smoothing
+        self.__hysteresis = hysteresis
+        self.__sustain = sustain
+        self.__weight_exponent = weight_exponent
+        self.__lock = threading.Lock()
+        self.__backends = {
+            backend.backend_id: BackendState(backend.backend_id, backend.endpoint)
+            for backend in probe.backends
+        }
+        self.__preferred = None
+        self.__weights = None
+        self.__candidate = None
+        self.__candidate_count = 0
+        self.__probe_count = 0
+        self.__update_count = 0
+        self.__last_probe_time = None
+        self.__last_update_time = None
+
+    @property
+    def state(self) -> ControllerState:
+        """
+        A snapshot of the controller's state for inspection
+        """
+        with self.__lock:
+            return ControllerState(
+                preferred_backends=copy.copy(self.__preferred),
+                weights=copy.copy(self.__weights),
+                candidate_backends=copy.copy(self.__candidate),
+                candidate_count=self.__candidate_count,
+                backends=[copy.copy(backend) for backend in self.__backends.values()],
+                probe_count=self.__probe_count,
+                update_count=self.__update_count,
+                last_probe_time=self.__last_probe_time,
+                last_update_time=self.__last_update_time,
+            )
+
+    def step(self) -> bool:
+        """
+        Probe the backends once and pass the preferred order (and weights) to APIM if it has changed.
+        Returns True if the order was passed to APIM.
+        """
+        results = self.__probe.probe()
+        with self.__lock:
+            self.__record(results)
+            order = self.__rank()
+            weights = self.__weigh(order)
+            if order == self.__preferred:
+                self.__candidate = None
+                self.__candidate_count = 0
+                if not self.__weights_changed(weights):
+                    return False
+            else:
+                if order == self.__candidate:
+                    self.__candidate_count += 1
+                else:
+                    self.__candidate = order
+                    self.__candidate_count = 1
+                if not (
+                    self.__preferred is None
+                    or self.__candidate_count >= self.__sustain
+                    or self.__backends[self.__preferred[0]].failures
+                ):
+                    return False
+
+        # if this fails then the order is still a candidate, so the update is retried after the next probe
+        self.__update_preferred_backends(order, weights)
+        with self.__lock:
+            self.__preferred = order
+            self.__weights = weights
+            self.__candidate = None
+            self.__candidate_count = 0
+            self.__update_count += 1
+            self.__last_update_time = datetime.now(UTC)
+        return True
+
+    async def run(self, interval: float, stop: asyncio.Event | None = None):
+        """
+        Call step every interval seconds until stop is set.
+        The probes block, so they run in a thread to keep the event loop free (e.g. to serve the state).
+        """
+        stop = stop or asyncio.Event()
+        while not stop.is_set():
+            try:
+                await asyncio.to_thread(self.step)
+            except Exception:
+                logging.exception("Failed to update the preferred backends")
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=interval)
+            except TimeoutError:
+                pass
+
+    def __record(self, results: list[ProbeResult]):
+        self.__probe_count += 1
+        self.__last_probe_time = datetime.now(UTC)
+        for result in results:
+            backend = self.__backends[result.backend.backend_id]
+            backend.last_latency = result.latency
+            if math.isinf(result.latency):
+                backend.failures += 1
+            elif backend.failures or backend.ewma_latency is None:
+                backend.failures = 0
+                backend.ewma_latency = result.latency
+            else:
+                backend.ewma_latency = (
+                    self.__smoothing * result.latency
+                    + (1 - self.__smoothing) * backend.ewma_latency
+                )
+
+    def __rank(self) -> list[str]:
+        if self.__preferred is None:
+            return sorted(
+                self.__backends,
+                key=lambda backend_id: self.__backends[backend_id].ranking_latency,
+            )
+
+        # insertion sort from the current order, only moving a backend ahead of another if it is better by the hysteresis margin
+        order = list(self.__preferred)
+        for index in range(1, len(order)):
+            while index > 0 and self.__is_better(order[index], order[index - 1]):
+                order[index - 1], order[index] = order[index], order[index - 1]
+                index -= 1
+        return order
+
+    def __weigh(self, order: list[str]) -> list[float] | None:
+        if self.__weight_exponent is None:
+            return None
+        return latency_weights(
+            [self.__backends[backend_id].ranking_latency for backend_id in order],
+            self.__weight_exponent,
+        )
+
+    def __weights_changed(self, weights: list[float] | None) -> bool:
+        if weights is None or self.__weights is None:
+            return weights != self.__weights
+        return any(
+            abs(weight - previous) > self.__hysteresis * previous
+            for weight, previous in zip(weights, self.__weights)
+        )
+
+    def __is_better(self, backend_id: str, other_backend_id: str) -> bool:
+        latency = self.__backends[backend_id].ranking_latency
+        other_latency = self.__backends[other_backend_id].ranking_latency
+        if math.isinf(other_latency):
+            return not math.isinf(latency)
+        return latency < other_latency * (1 - self.__hysteresis)
+
+
+def create_latency_routing_controller(probe: LatencyProbe) -> LatencyRoutingController:
+    """
+    Create a LatencyRoutingController that passes the preferred backends to APIM,
+    with the LATENCY_CONTROLLER_* and LATENCY_ROUTING_* settings
+    """
+    return LatencyRoutingController(
+        probe,
+        lambda backend_ids, weights: set_preferred_backends(
+            probe.session, backend_ids, weights
+        ),
+        smoothing=latency_controller_smoothing,
+        hysteresis=latency_controller_hysteresis,
+        sustain=latency_controller_sustain,
+        weight_exponent=(
+            latency_routing_weight_exponent if latency_routing_weights else None
+        ),
+    )
@@ -0,0 +1,279 @@
+import json
+import logging
+import math
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import NamedTuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .config import (
+    latency_probe_backends,
+    latency_probe_mode,
+    latency_probe_per_token,
+    latency_probe_samples,
+    latency_probe_statistic,
+    latency_probe_timeout_seconds,
+    simulator_api_key,
+    simulator_endpoint_payg1,
+    simulator_endpoint_payg2,
+)
+from .sse import SSEParser
+
+# what to rank the backends by:
+#  - total: time for the full (non-streamed) response
+#  - ttft: time to the first token of a streamed response
+#  - token-rate: time per token after the first token of a streamed response (i.e. highest tokens per second first)
+PROBE_MODES = ("total", "ttft", "token-rate")
+STATISTICS = ("p50", "trimmed-mean")
+# fraction of the samples to drop from each end for the trimmed mean
+TRIM_FRACTION = 0.2
+
+
+@dataclass(frozen=True)
+class ProbeBackend:
+    backend_id: str
+    # base URL for the OpenAI API, e.g. https://<simulator>/openai
+    endpoint: str
+
+
+class ProbeSample(NamedTuple):
+    # seconds for the full response
+    latency: float
+    completion_tokens: int
+    # seconds to the first token and tokens per second after it (for streamed responses)
+    time_to_first_token: float | None = None
+    tokens_per_second: float | None = None
+
+
+@dataclass(frozen=True)
+class ProbeResult:
+    backend: ProbeBackend
+    # the statistic over the samples for the probe mode (seconds, or seconds per token) - infinite if the backend failed
+    latency: float
+    samples: list[float]
+    # the statistic over the streamed samples' time to first token and tokens per second (for the ttft and token-rate modes)
+    time_to_first_token: float | None = None
+    tokens_per_second: float | None = None
+
+
+class ProbeError(Exception):
+    pass
+
+
+def parse_probe_backends(value: str) -> list[ProbeBackend]:
+    """
+    Parse backends to probe from a comma-separated list of backend_id=endpoint entries,
+    e.g. "payg-backend-1=https://sim1.example.com/openai,payg-backend-2=https://sim2.example.com/openai"
+    """
+    backends = []
+    for entry in filter(None, (entry.strip() for entry in value.split(","))):
+        backend_id, separator, endpoint = entry.partition("=")
+        if not separator:
+            raise ValueError(
+                f"Invalid probe backend '{entry}', expected backend_id=endpoint"
+            )
+        backends.append(ProbeBackend(backend_id.strip(), endpoint.strip()))
+    return backends
+
+
+def trimmed_mean(samples: list[float], trim_fraction: float = TRIM_FRACTION) -> float:
+    """
+    Mean of the samples after dropping trim_fraction of them from each end (at least one from each end for 3 or more samples)
+    """
+    samples = sorted(samples)
+    trim = int(len(samples) * trim_fraction)
+    if trim == 0 and len(samples) >= 3:
+        trim = 1
+    if trim:
+        samples = samples[trim:-trim]
+    return statistics.fmean(samples)
+
+
+def summarize(samples: list[float], statistic: str) -> float:
+    if statistic == "p50":
+        return statistics.median(samples)
+    if statistic == "trimmed-mean":
+        return trimmed_mean(samples)
+    raise ValueError(
+        f"Unsupported statistic '{statistic}', expected one of: {','.join(STATISTICS)}"
+    )
+
+
+class LatencyProbe:
+    """
+    Measures the latency of a set of backends to rank them for latency routing.
+
+    The backends are probed concurrently, so the time to probe them all is the time for the slowest one.
+    In the ttft and token-rate modes the probe requests are streamed and both the time to first token and
+    the tokens per second are measured, and the backends are ranked by the one for the mode.
+    Each backend is sent a warm-up request (so that connection and TLS setup aren't measured)
+    and then several samples over the same pooled, keep-alive connection, which are summarized with a robust statistic.
+    A backend that fails, times out or returns an unexpected response body is ranked last.
+    """
+
+    def __init__(
+        self,
+        backends: list[ProbeBackend],
+        deployment_name: str,
+        api_key: str,
+        samples: int = 5,
+        timeout: float = 10,
+        statistic: str = "p50",
+        per_token: bool = False,
+        mode: str = "total",
+    ) -> None:
+        """
+        Constructor
+
+        Parameters:
+            backends (list(ProbeBackend)): Backends to probe
+            deployment_name (str): Deployment to send the probe requests to
+            api_key (str): API key for the backends
+            samples (int): Number of samples to take from each backend
+            timeout (float): Timeout for each probe request (in seconds)
+            statistic (str): Statistic to rank the backends by: "p50" or "trimmed-mean"
+            per_token (bool): Divide each sample by the number of completion tokens in the response (for the total mode)
+            mode (str): What to rank the backends by: "total", "ttft" or "token-rate" (see PROBE_MODES)
+        """
+        if not backends:
+            raise ValueError("At least one backend is required")
+        if samples < 1:
+            raise ValueError("At least one sample is required")
+        if mode not in PROBE_MODES:
+            raise ValueError(
+                f"Unsupported probe mode '{mode}', expected one of: {','.join(PROBE_MODES)}"
+            )
+        if statistic not in STATISTICS:
+            raise ValueError(
+                f"Unsupported statistic '{statistic}', expected one of: {','.join(STATISTICS)}"
+            )
+        self.backends = backends
+        self.__deployment_name = deployment_name
+        self.__api_key = api_key
+        self.__samples = samples
+        self.__timeout = timeout
+        self.__statistic = statistic
+        self.__per_token = per_token
+        self.__mode = mode
+        self.__stream = mode != "total"
+        # limit the variation in response time from the number of generated tokens
+        body = {
+            "model": "gpt-5-turbo-1",
+            "prompt": "Once upon a time",
+            "max_tokens": 10,
+        }
+        if self.__stream:
+            body["stream"] = True
+        self.__body = json.dumps(body).encode("utf-8")
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=len(backends), pool_maxsize=len(backends)
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def probe(self) -> list[ProbeResult]:
+        """
+        Probe the backends and return the results sorted with the lowest latency first
+        """
+        with ThreadPoolExecutor(max_workers=len(self.backends)) as executor:
+            results = list(executor.map(self.__probe_backend, self.backends))
+        return sorted(results, key=lambda result: result.latency)
+
+    def __probe_backend(self, backend: ProbeBackend) -> ProbeResult:
+        samples = []
+        try:
+            self.__measure(backend)
+            for _ in range(self.__samples):
+                samples.append(self.__measure(backend))
+        except (requests.RequestException, ProbeError, KeyError, ValueError) as e:
+            # don't keep a slow or failing backend waiting for more timeouts
+            # (KeyError and ValueError are from response bodies without usage or choices, or that aren't JSON)
+            logging.warning("Latency probe for %s failed: %s", backend.endpoint, e)
+            return ProbeResult(backend, math.inf, [])
+
+        values = [self.__get_value(sample) for sample in samples]
+        if not self.__stream:
+            return ProbeResult(backend, summarize(values, self.__statistic), values)
+        return ProbeResult(
+            backend,
+            summarize(values, self.__statistic),
+            values,
+            time_to_first_token=summarize(
+                [sample.time_to_first_token for sample in samples], self.__statistic
+            ),
+            tokens_per_second=summarize(
+                [sample.tokens_per_second for sample in samples], self.__statistic
+            ),
+        )
+
+    def __get_value(self, sample: ProbeSample) -> float:
+        if self.__mode == "ttft":
+            return sample.time_to_first_token
+        if self.__mode == "token-rate":
+            return 1 / sample.tokens_per_second
+        if self.__per_token:
+            return sample.latency / max(sample.completion_tokens, 1)
+        return sample.latency
+
+    def __measure(self, backend: ProbeBackend) -> ProbeSample:
+        start_time = time.perf_counter()
+        response = self.session.post(
+            url=f"{backend.endpoint}/deployments/{self.__deployment_name}/completions?api-version=2023-05-15",
+            headers={"api-key": self.__api_key, "Content-Type": "application/json"},
+            data=self.__body,
+            timeout=self.__timeout,
+            stream=self.__stream,
+        )
+        response.raise_for_status()
+        if not self.__stream:
+            return ProbeSample(
+                time.perf_counter() - start_time,
+                response.json()["usage"]["completion_tokens"],
+            )
+
+        parser = SSEParser()
+        token_times = []
+        for chunk in response.iter_content(chunk_size=None):
+            for data in parser.feed(chunk):
+                if data != b"[DONE]" and any(
+                    choice.get("text") for choice in json.loads(data)["choices"]
+                ):
+                    token_times.append(time.perf_counter())
+        if len(token_times) < 2:
+            raise ProbeError(
+                f"Expected at least 2 streamed tokens, received {len(token_times)}"
+            )
+        return ProbeSample(
+            time.perf_counter() - start_time,
+            len(token_times),
+            time_to_first_token=token_times[0] - start_time,
+            tokens_per_second=(len(token_times) - 1)
+            / max(token_times[-1] - token_times[0], 1e-6),
+        )
+
+
+def create_latency_probe(deployment_name: str) -> LatencyProbe:
+    """
+    Create a LatencyProbe for the backends in LATENCY_PROBE_BACKENDS (or the PAYG1 and PAYG2 simulators if it isn't set)
+    with the LATENCY_PROBE_* settings
+    """
+    backends = parse_probe_backends(latency_probe_backends) or [
+        ProbeBackend("payg-backend-1", f"{simulator_endpoint_payg1}/openai"),
+        ProbeBackend("payg-backend-2", f"{simulator_endpoint_payg2}/openai"),
+    ]
+    return LatencyProbe(
+        backends,
+        deployment_name,
+        simulator_api_key,
+        samples=latency_probe_samples,
+        timeout=latency_probe_timeout_seconds,
+        statistic=latency_probe_statistic,
+        per_token=latency_probe_per_token,
+        mode=latency_probe_mode,
+    )
@@ -0,0 +1,311 @@
+import logging
+import time
+from dataclasses import dataclass, field
+
+from locust import LoadTestShape, events
+from locust.runners import MasterRunner
+
+
+@dataclass(frozen=True)
+class Stage:
+    """
+    A stage in a UserMixShape.
+
+    duration is the time (in seconds since the start of the test) that the stage ends at,
+    and users is the number of users to run for each profile, e.g. {"low": 9, "high": 9}.
+    tokens_per_minute optionally sets a target rate of tokens (as counted by the gateway) for each profile,
+    e.g. {"low": 20000, "high": 50000}, in which case the users for the profile are paced to send that rate
+    (see UserMix.pace) and the users count is the most requests that can be in flight for the profile.
+    """
+
+    duration: float
+    users: dict[str, int]
+    spawn_rate: float = 1
+    tokens_per_minute: dict[str, float] = field(default_factory=dict)
+
+
+def _get_process_targets(
+    users: dict[str, int], process_user_counts: list[int]
+) -> list[dict[str, int]]:
+    """
+    Split the user counts for a stage between the processes in proportion to the users that Locust has dispatched to each,
+    so that each process's targets add up to its users and (once the stage's users are all running) the targets for each
+    profile add up to the stage's count. The profiles are interleaved so that each process gets a similar mix.
+    """
+    # lay out a slot for each user, with each profile's slots spread evenly, and give each process a run of slots
+    slots = sorted(
+        ((index + 0.5) / count, profile)
+        for profile, count in users.items()
+        for index in range(count)
+    )
+    targets = []
+    offset = 0
+    for user_count in process_user_counts:
+        process_targets = dict.fromkeys(users, 0)
+        for _, profile in slots[offset : offset + user_count]:
+            process_targets[profile] += 1
+        targets.append(process_targets)
+        offset += user_count
+    return targets
+
+
+def _get_process_messages(stage: Stage, process_user_counts: list[int]) -> list[dict]:
+    """
+    Get the user mix message for each process: its user counts for the stage (see _get_process_targets)
+    and its share of the stage's tokens per minute, in proportion to its users
+    """
+    total_user_count = sum(process_user_counts)
+    messages = []
+    for process_targets, user_count in zip(
+        _get_process_targets(stage.users, process_user_counts), process_user_counts
+    ):
+        share = (
+            user_count / total_user_count
+            if total_user_count
+            else 1 / len(process_user_counts)
+        )
+        messages.append(
+            {
+                "users": process_targets,
+                "tokens_per_minute": {
+                    profile: rate * share
+                    for profile, rate in stage.tokens_per_minute.items()
+                },
+            }
+        )
+    return messages
+
+
+class TokenPacer:
+    """
+    Paces requests to a target rate of tokens per minute.
+
+    Each request reserves the next send time: the time of the previous reservation plus the time to send
+    the previous request's tokens at the target rate (or now, if that has passed, so that idle time isn't saved up as a burst).
+    """
+
+    def __init__(self, tokens_per_minute: float) -> None:
+        self.set_rate(tokens_per_minute)
+        self.__next_send_time = 0.0
+
+    def set_rate(self, tokens_per_minute: float):
+        """
+        Change the target rate (from the next reservation, keeping the send time already reserved)
+        """
+        if tokens_per_minute <= 0:
+            raise ValueError("Tokens per minute must be positive")
+        self.__seconds_per_token = 60 / tokens_per_minute
+
+    def reserve(self, tokens: int) -> float:
+        """
+        Reserve a send time for a request and return the time to wait until it (in seconds)
+        """
+        now = time.monotonic()
+        send_time = max(self.__next_send_time, now)
+        self.__next_send_time = send_time + tokens * self.__seconds_per_token
+        return send_time - now
+
+
+class UserMix:
+    """
+    Assigns the running users in this process to profiles (e.g. "low" and "high" priority)
+    so that the number of users with each profile matches the current stage of a UserMixShape.
+
+    Locust stops the most recently started users when the user count drops, regardless of their class,
+    and so can't target a count for each user class. Instead, the shape runs a single user class
+    whose users call get_profile before each request: users keep their profile while it is needed
+    and switch to the profile that is furthest below its target otherwise.
+    So a stage change only starts, stops or switches the users that differ, and the load is continuous.
+
+    When a stage sets tokens_per_minute, users call pace with each request's tokens before sending it
+    so that the requests for each profile add up to the target rate.
+
+    The UserMixShape sends each process (each worker in a distributed run) its user counts with a custom message.
+    """
+
+    def __init__(self, message_type: str = "user_mix") -> None:
+        """
+        Constructor
+
+        Parameters:
+            message_type (str): Name of the Locust custom message used to send the user counts
+        """
+        self.message_type = message_type
+        self.__targets = {}
+        self.__counts = {}
+        self.__profiles = {}
+        self.__pacers = {}
+        events.init.add_listener(self.__on_init)
+
+    def is_paced(self, profile: str | None) -> bool:
+        """
+        True if the current stage targets a rate of tokens per minute for a profile
+        """
+        return profile in self.__pacers
+
+    def set_users(
+        self,
+        users: dict[str, int],
+        tokens_per_minute: dict[str, float] | None = None,
+    ):
+        """
+        Set the user counts (and optionally the tokens per minute) for each profile in this process
+        """
+        self.__targets = dict(users)
+        for profile in self.__targets:
+            self.__counts.setdefault(profile, 0)
+        # keep the existing pacers (at the new rates), so that resending the counts doesn't reset the pacing
+        pacers = {}
+        for profile, rate in (tokens_per_minute or {}).items():
+            if rate > 0:
+                pacer = pacers[profile] = self.__pacers.get(profile) or TokenPacer(rate)
+                pacer.set_rate(rate)
+        self.__pacers = pacers
+
+    def get_profile(self, user) -> str | None:
+        """
+        Get the profile for a user's next request, or None if the UserMixShape hasn't sent this process its user counts yet
+        (in which case the user shouldn't send a request)
+        """
+        profile = self.__profiles.get(user)
+        if profile is not None and self.__counts[profile] <= self.__targets.get(
+            profile, 0
+        ):
+            return profile
+        if not self.__targets:
+            return profile
+
+        # the profile that is furthest below its target
+        new_profile = max(
+            self.__targets,
+            key=lambda name: self.__targets[name] - self.__counts[name],
+        )
+        if (
+            profile is not None
+            and self.__targets[new_profile] <= self.__counts[new_profile]
+        ):
+            # this process has more users than the targets, so keep the current profile
+            return profile
+
+        if profile is not None:
+            self.__counts[profile] -= 1
+        self.__counts[new_profile] += 1
+        self.__profiles[user] = new_profile
+        return new_profile
+
+    def pace(self, profile: str, tokens: int) -> float:
+        """
+        Get the time to wait before sending a request for a profile (in seconds),
+        which is zero if the current stage doesn't target a rate of tokens per minute for the profile
+
+        Parameters:
+            profile (str): Profile of the user sending the request (from get_profile)
+            tokens (int): Tokens counted by the gateway for the request (e.g. Payload.policy_tokens)
+        """
+        pacer = self.__pacers.get(profile)
+        if pacer is None:
+            return 0
+        return pacer.reserve(tokens)
+
+    def remove(self, user):
+        """
+        Remove a user that has stopped (call from on_stop)
+        """
+        profile = self.__profiles.pop(user, None)
+        if profile is not None:
+            self.__counts[profile] -= 1
+
+    def __on_init(self, environment, **kwargs):
+        runner = environment.runner
+        if runner is not None and not isinstance(runner, MasterRunner):
+            runner.register_message(self.message_type, self.__on_message)
+
+    def __on_message(self, environment, msg, **kwargs):
+        self.set_users(msg.data["users"], msg.data["tokens_per_minute"])
+
+
+class UserMixShape(LoadTestShape):
+    """
+    Load shape that runs a declared number of users for each profile in each stage (see UserMix).
+
+    Subclasses set stages (a list of Stage), user_class (the user class to run, which uses user_mix to get its profile)
+    and user_mix.
+
+    Example:
+        class StagesShape(UserMixShape):
+            stages = [
+                Stage(duration=120, users={"low": 9}),
+                Stage(duration=240, users={"low": 9, "high": 9}),
+            ]
+            user_class = PriorityUser
+            user_mix = priority_mix
+    """
+
+    abstract = True
+
+    stages: list[Stage] = []
+    user_class = None
+    user_mix: UserMix = None
+
+    def __init__(self):
+        super().__init__()
+        self._current_stage = None
+        # the last user mix message sent to each process (by worker ID, or None for a local run)
+        self.__sent_messages = {}
+
+    def tick(self):
+        run_time = self.get_run_time()
+
+        for stage in self.stages:
+            if run_time < stage.duration:
+                if stage != self._current_stage:
+                    logging.info(
+                        f"Changing user mix to {stage.users}"
+                        + (
+                            f" at {stage.tokens_per_minute} tokens per minute"
+                            if stage.tokens_per_minute
+                            else ""
+                        )
+                    )
+                    self._current_stage = stage
+                self.__send_users(stage)
+                return (sum(stage.users.values()), stage.spawn_rate, [self.user_class])
+        return None
+
+    def __send_users(self, stage: Stage):
+        """
+        Send each process its user counts for the stage if they have changed,
+        which they do as Locust dispatches the users to the workers and as workers connect or disconnect
+        """
+        if isinstance(self.runner, MasterRunner):
+            clients = self.runner.clients
+            workers = sorted(
+                clients.ready + clients.spawning + clients.running,
+                key=lambda worker: worker.id,
+            )
+            if not workers:
+                return
+            process_ids = [worker.id for worker in workers]
+            # the users that each worker reports running (Locust may not dispatch them to the workers in order)
+            process_user_counts = [worker.user_count for worker in workers]
+            if not any(process_user_counts):
+                # nothing has been reported yet, so assume the users will be spread evenly
+                user_count = sum(stage.users.values())
+                process_user_counts = [
+                    user_count // len(workers) + (index < user_count % len(workers))
+                    for index in range(len(workers))
+                ]
+        else:
+            process_ids = [None]
+            process_user_counts = [sum(stage.users.values())]
+
+        if set(process_ids) != set(self.__sent_messages):
+            # resend to every process when workers connect or disconnect (a reconnected worker may have lost its counts)
+            self.__sent_messages = {}
+        messages = _get_process_messages(stage, process_user_counts)
+        for process_id, message in zip(process_ids, messages):
+            if self.__sent_messages.get(process_id) != message:
+                self.runner.send_message(
+                    self.user_mix.message_type, message, client_id=process_id
+                )
+                self.__sent_messages[process_id] = message
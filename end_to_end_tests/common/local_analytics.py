@@ -0,0 +1,263 @@
+"""
+A local analytics backend for the scenario reports, so that they can be rendered as soon as a test stops
+(without waiting for Log Analytics ingestion) and run offline, e.g. in CI.
+
+The local gateway emulator and simulator stand-in (local/gateway.py and local/simulator.py) write their gateway logs and metrics
+to an SQLite database with LocalAnalyticsWriter, in tables that mirror the Log Analytics tables that the scenario reports query.
+LocalAnalyticsClient takes the place of LogsQueryClient in QueryProcessor and runs the SQL equivalent of each report query
+(the local_query passed to QueryProcessor.add_query) against the database.
+
+In the SQL queries:
+    - TimeGenerated is seconds since the epoch (UTC), and is returned as a datetime
+    - :start and :end are the start and end of the query's timespan (in seconds since the epoch)
+    - bin(value, size) rounds down to a multiple of size, like KQL's bin (e.g. bin(TimeGenerated, 10) for 10s bins)
+    - dynamic columns (ResponseHeaders, Properties) are JSON text, e.g. json_extract(ResponseHeaders, '$."x-gw-priority"')
+"""
+
+import json
+import logging
+import math
+import queue
+import sqlite3
+import threading
+from datetime import UTC, datetime, timedelta
+
+from azure.core.exceptions import HttpResponseError
+from azure.monitor.query import (
+    LogsBatchQuery,
+    LogsQueryError,
+    LogsQueryResult,
+    LogsTable,
+)
+
+# table -> (column, SQLite type) for the Log Analytics tables that the scenario reports query
+TABLES = {
+    "ApiManagementGatewayLogs": [
+        ("TimeGenerated", "REAL"),
+        ("CorrelationId", "TEXT"),
+        ("ApiId", "TEXT"),
+        ("OperationName", "TEXT"),
+        ("OperationId", "TEXT"),
+        ("BackendId", "TEXT"),
+        ("ResponseCode", "INTEGER"),
+        ("BackendResponseCode", "INTEGER"),
+        # milliseconds
+        ("TotalTime", "INTEGER"),
+        ("ResponseHeaders", "TEXT"),
+    ],
+    "AppMetrics": [
+        ("TimeGenerated", "REAL"),
+        ("Name", "TEXT"),
+        ("Sum", "REAL"),
+        ("Count", "INTEGER"),
+        ("Min", "REAL"),
+        ("Max", "REAL"),
+        ("Properties", "TEXT"),
+    ],
+}
+# Kusto type of the values in a result column (used when the result is exported)
+KUSTO_TYPES = {int: "long", float: "real", str: "string"}
+
+
+def _bin(value, size):
+    if value is None or not size:
+        return None
+    return math.floor(value / size) * size
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """
+    Open the local analytics database at path, creating the tables if they don't exist
+    """
+    # WAL mode lets the report read while the gateway and simulator (possibly in other processes) are writing
+    connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    for table, columns in TABLES.items():
+        column_definitions = ", ".join(
+            f"{name} {column_type}" for name, column_type in columns
+        )
+        connection.execute(f"CREATE TABLE IF NOT EXISTS {table} ({column_definitions})")
+        connection.execute(
+            f"CREATE INDEX IF NOT EXISTS {table}_TimeGenerated ON {table} (TimeGenerated)"
+        )
+    connection.commit()
+    connection.create_function("bin", 2, _bin, deterministic=True)
+    return connection
+
+
+def _to_epoch_seconds(value: datetime) -> float:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=UTC)
+    return value.timestamp()
+
+
+def get_timespan_parameters(timespan) -> dict[str, float]:
+    """
+    Get the :start and :end query parameters for a timespan in the forms that LogsQueryClient accepts:
+    a (start, end) or (start, duration) tuple, a duration back from now, or the "<start>/<end>" string of a batch query
+    """
+    now = datetime.now(UTC)
+    if isinstance(timespan, str) and "/" in timespan:
+        timespan = tuple(map(datetime.fromisoformat, timespan.split("/")))
+    if isinstance(timespan, timedelta):
+        timespan = (now - timespan, now)
+    if timespan is None:
+        timespan = (datetime.fromtimestamp(0, UTC), now)
+    if not isinstance(timespan, tuple):
+        raise ValueError(f"Unsupported timespan for a local query: {timespan}")
+    start, end = timespan
+    if isinstance(end, timedelta):
+        end = start + end
+    return {"start": _to_epoch_seconds(start), "end": _to_epoch_seconds(end)}
+
+
+class LocalAnalyticsWriter:
+    """
+    Appends rows to the local analytics database from a background thread, in a transaction per batch of rows,
+    so that writing gateway logs and metrics never blocks the request being logged.
+
+    Example:
+        writer = LocalAnalyticsWriter("local-analytics.db")
+        writer.write("AppMetrics", TimeGenerated=time.time(), Name="ConsumedTokens", Sum=42, Count=1, Properties={"API ID": "x"})
+        writer.close()
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Constructor
+
+        Parameters:
+            path (str): Path of the SQLite database (created if it doesn't exist)
+        """
+        self.path = path
+        self.__connection = connect(path)
+        self.__queue = queue.Queue()
+        self.__thread = threading.Thread(target=self.__write_rows, daemon=True)
+        self.__thread.start()
+
+    def write(self, table: str, **values):
+        """
+        Queue a row to write to table. Columns that aren't set are NULL, and dict values are stored as JSON.
+        """
+        self.__queue.put(
+            (
+                table,
+                tuple(
+                    json.dumps(value) if isinstance(value, dict) else value
+                    for value in (values.get(name) for name, _ in TABLES[table])
+                ),
+            )
+        )
+
+    def flush(self):
+        """
+        Wait for the queued rows to be written
+        """
+        self.__queue.join()
+
+    def close(self):
+        self.__queue.put(None)
+        self.__thread.join()
+        self.__connection.close()
+
+    def __write_rows(self):
+        while True:
+            # take everything that has been queued since the last write as one batch
+            batch = [self.__queue.get()]
+            while True:
+                try:
+                    batch.append(self.__queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            rows_by_table = {}
+            for row in batch:
+                if row is not None:
+                    rows_by_table.setdefault(row[0], []).append(row[1])
+            try:
+                with self.__connection:
+                    for table, rows in rows_by_table.items():
+                        placeholders = ", ".join("?" * len(TABLES[table]))
+                        self.__connection.executemany(
+                            f"INSERT INTO {table} VALUES ({placeholders})", rows
+                        )
+            except sqlite3.Error as e:
+                logging.warning("Failed to write local analytics rows: %s", e)
+            finally:
+                for _ in batch:
+                    self.__queue.task_done()
+            if None in batch:
+                return
+
+
+class LocalAnalyticsClient:
+    """
+    Runs report queries against the local analytics database in place of LogsQueryClient (see QueryProcessor's logs_query_client).
+    QueryProcessor sends it the local_query of each report query, as its query_language is "sql".
+
+    Results are returned in the same form as LogsQueryClient's: a LogsQueryResult from query_workspace
+    (or HttpResponseError if the query fails) and a LogsQueryResult or LogsQueryError for each query from query_batch.
+    """
+
+    query_language = "sql"
+
+    def __init__(self, path: str) -> None:
+        """
+        Constructor
+
+        Parameters:
+            path (str): Path of the SQLite database written by LocalAnalyticsWriter
+        """
+        self.path = path
+        # sqlite connections are used by one thread at a time, and QueryProcessor runs queries in parallel
+        self.__connections = threading.local()
+
+    def query_workspace(self, workspace_id: str, query: str, timespan=None, **kwargs):
+        response = self.__run_query(query, timespan)
+        if isinstance(response, LogsQueryError):
+            raise HttpResponseError(message=response.message)
+        return response
+
+    def query_batch(self, queries: list[LogsBatchQuery], **kwargs):
+        return [
+            self.__run_query(query.body["query"], query.body.get("timespan"))
+            for query in queries
+        ]
+
+    def __get_connection(self) -> sqlite3.Connection:
+        connection = getattr(self.__connections, "connection", None)
+        if connection is None:
+            connection = self.__connections.connection = connect(self.path)
+        return connection
+
+    def __run_query(self, query: str, timespan):
+        try:
+            cursor = self.__get_connection().execute(
+                query, get_timespan_parameters(timespan)
+            )
+            rows = cursor.fetchall()
+        except (sqlite3.Error, ValueError) as e:
+            return LogsQueryError(code="LocalQueryError", message=str(e))
+
+        columns = [description[0] for description in cursor.description]
+        time_indexes = [
+            index for index, column in enumerate(columns) if column == "TimeGenerated"
+        ]
+        rows = [list(row) for row in rows]
+        for row in rows:
+            for index in time_indexes:
+                if row[index] is not None:
+                    row[index] = datetime.fromtimestamp(row[index], UTC)
+
+        columns_types = []
+        for index, column in enumerate(columns):
+            values = (row[index] for row in rows if row[index] is not None)
+            value_type = type(next(values, None))
+            columns_types.append(
+                "datetime"
+                if index in time_indexes
+                else KUSTO_TYPES.get(value_type, "dynamic")
+            )
+        return LogsQueryResult(
+            tables=[LogsTable(columns=columns, columns_types=columns_types, rows=rows)]
+        )
@@ -1,4 +1,6 @@
 import base64
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import UTC, datetime, timedelta
 import io
 import logging
@@ -10,72 +12,34 @@ import asciichartpy as asciichart
 
 from azure.core.credentials import TokenCredential
 from azure.core.exceptions import HttpResponseError
-from azure.monitor.query import LogsQueryClient, MetricsQueryClient, MetricsClient
-from dataclasses import dataclass
+from azure.monitor.query import (
+    LogsBatchQuery,
+    LogsQueryClient,
+    LogsQueryStatus,
+    MetricsQueryClient,
+    MetricsClient,
+)
 from gzip import GzipFile
 from tabulate import tabulate
-from typing import Any
 
+from .charts import fit_series_to_terminal
+from .export import ResultExporter
+from .polling import PollingStrategy
+from .query_cache import QueryCache
+from .table import GroupDefinition, Table
 from .terminal import get_link
 
 
 APPINSIGHTS_ENDPOINT = "https://api.applicationinsights.io/v1/apps"
 
-# https://learn.microsoft.com/en-us/python/api/overview/azure/monitor-query-readme?view=azure-python
-
-
-## TODO extract this to separate file and share with AppInsights code
-@dataclass
-class GroupDefinition:
-    id_column: str
-    group_column: str
-    value_column: str
-    missing_value: Any = None
-
-
-@dataclass
-class Table:
-    columns: list[str]
-    rows: list[list[Any]]
-
-    def group_by(
-        self,
-        id_column: str,
-        group_column: str,
-        value_column: str,
-        missing_value: Any = None,
-    ) -> "Table":
-
-        # assume rows are sorted on id_column
-
-        group_column_index = self.columns.index(group_column)
-        distinct_group_column_values = sorted(
-            list(set(row[group_column_index] for row in self.rows))
-        )
-
-        new_columns = [id_column] + [
-            f"{value_column}_{name}" for name in distinct_group_column_values
-        ]
-
-        id_column_index = self.columns.index(id_column)
-        value_column_index = self.columns.index(value_column)
-
-        # Produce a new table where each row has the id_column and a column for each distinct value in group_column with the value of value_column
-        rows = []
-        current_row = None
-        for row in self.rows:
-            if current_row is None or current_row[0] != row[id_column_index]:
-                if current_row is not None:
-                    rows.append(current_row)
-                # start new row
-                current_row = [row[id_column_index]] + (
-                    [missing_value] * len(distinct_group_column_values)
-                )
-            group = row[group_column_index]
-            value = row[value_column_index]
-            current_row[distinct_group_column_values.index(group) + 1] = value
+# Maximum number of queries that Log Analytics accepts in a single batch request
+MAX_QUERIES_PER_BATCH = 10
+# Maximum number of rows that Log Analytics returns for a query (larger results are truncated)
+MAX_ROWS_PER_QUERY = 500000
+# Smallest window that a time-sliced query is split into when a window's result is truncated
+MIN_TIME_SLICE = timedelta(seconds=10)
 
-        return Table(rows=rows, columns=new_columns)
+# https://learn.microsoft.com/en-us/python/api/overview/azure/monitor-query-readme?view=azure-python
 
 
 def get_log_analytics_portal_url(
@@ -106,6 +70,54 @@ def get_log_analytics_portal_url(
     return f"https://portal.azure.com#@{tenant_id}/blade/Microsoft_OperationsManagementSuite_Workspace/Logs.ReactView/resourceId/%2Fsubscriptions%2F{subscription_id}%2Fresourcegroups%2F{resource_group_name}%2Fproviders%2Fmicrosoft.operationalinsights%2Fworkspaces%2F{workspace_name}/source/LogsBlade.AnalyticsShareLinkToQuery/q/{encoded_query}"
 
 
+class _TimeSliceError(Exception):
+    pass
+
+
+def _get_absolute_timespan(timespan) -> tuple[datetime, datetime]:
+    if not isinstance(timespan, tuple):
+        raise ValueError(
+            f"Time-sliced queries require a (start, end) timespan, got: {timespan}"
+        )
+    start, end = timespan
+    return start, start + end if isinstance(end, timedelta) else end
+
+
+def _align_time(value: datetime, size: timedelta) -> datetime:
+    # round down to a multiple of size since the epoch, as KQL's bin does (and the local analytics backend's bin)
+    epoch = datetime(1970, 1, 1, tzinfo=value.tzinfo)
+    return value - (value - epoch) % size
+
+
+def _split_timespan(
+    start: datetime, end: datetime, time_slice: timedelta
+) -> list[tuple[datetime, datetime]]:
+    """
+    Split a timespan into windows that start and end on multiples of time_slice (apart from the first and last),
+    so that a bin that divides time_slice never spans two windows
+    """
+    windows = []
+    window_start = start
+    while window_start < end:
+        window_end = min(_align_time(window_start, time_slice) + time_slice, end)
+        windows.append((window_start, window_end))
+        window_start = window_end
+    return windows
+
+
+def _get_window_middle(
+    start: datetime, end: datetime, min_time_slice: timedelta
+) -> datetime | None:
+    """
+    Get the point to split a truncated window at: a multiple of min_time_slice close to the middle of the window
+    (or None if the window can't be split)
+    """
+    middle = _align_time(start + (end - start) / 2, min_time_slice)
+    if middle <= start:
+        middle += min_time_slice
+    return middle if middle < end else None
+
+
 class QueryProcessor:
     """
     This is a class to run queries against Log Analytics.
@@ -120,6 +132,10 @@ class QueryProcessor:
         resource_group_name: str | None = None,
         workspace_name: str | None = None,
         app_insights_name: str | None = None,
+        logs_query_client: LogsQueryClient | None = None,
+        cache: QueryCache | None = None,
+        cache_only: bool = False,
+        exporter: ResultExporter | None = None,
     ) -> None:
         """
         Constructor
@@ -133,6 +149,14 @@ class QueryProcessor:
             resource_group_name (str): Resource Group Name (required if outputting links to the Azure Portal)
             workspace_name (str): Workspace Name (required if outputting links to the Azure Portal)
             app_insights_name (str): App Insights Name (required if outputting links to the Azure Portal)
+            logs_query_client (LogsQueryClient): Client to run the queries with (defaults to a LogsQueryClient using token_credential).
+                                                 Can be set to a fake client such as local.logs_query_client.FakeLogsQueryClient to run offline,
+                                                 or to a common.local_analytics.LocalAnalyticsClient to run the queries' local_query SQL
+                                                 against the local analytics database.
+            cache (QueryCache): Cache to store query results in and to check before running queries
+            cache_only (bool): If true then results are only read from the cache and queries are never sent to Log Analytics
+                               (token_credential is not required)
+            exporter (ResultExporter): If set then the result of each query is also written to a file with the exporter
         """
         if workspace_id is None:
             raise ValueError("workspace_id is required")
@@ -141,9 +165,21 @@ class QueryProcessor:
         self.__tenant_id = tenant_id
         self.__subscription_id = subscription_id
         self.__resource_group_name = resource_group_name
-        self.__logs_query_client = LogsQueryClient(token_credential)
+        self.__cache = cache
+        self.__cache_only = cache_only
+        self.__exporter = exporter
+        if cache_only:
+            self.__logs_query_client = None
+        else:
+            self.__logs_query_client = logs_query_client or LogsQueryClient(
+                token_credential
+            )
         self.__workspace_name = workspace_name
         self.__app_insights_name = app_insights_name
+        # clients with a query_language of "sql" run the local_query of each query (see common/local_analytics.py)
+        self.__query_language = getattr(
+            self.__logs_query_client, "query_language", "kql"
+        )
 
     def add_query(
         self,
@@ -158,6 +194,8 @@ class QueryProcessor:
         show_query=False,
         include_link=False,
         missing_value=float("nan"),
+        time_slice: timedelta | None = None,
+        local_query: str | None = None,
     ):
         """
         Adds a query to be executed.
@@ -174,7 +212,20 @@ class QueryProcessor:
             chart_config (dict): Asciichart graph config, info can be found here: https://github.com/kroitor/asciichart.
             show_query (bool): If true then the query is printed before the result.
             include_link (bool): If true then a link to the query in the Azure Portal is printed. Requires tenant, subscription, resource group  and app insights name to be set
+            time_slice (timedelta): If set then timespan (which must be a (start, end) tuple) is split into windows of this length
+                                    which are run in parallel and merged in time order (see iter_time_slices).
+                                    Only use for queries where each row only depends on data in its own window:
+                                    per-request rows, or bins of TimeGenerated that divide both time_slice and MIN_TIME_SLICE
+                                    (windows are aligned to multiples of time_slice, and truncated windows are split on
+                                    multiples of MIN_TIME_SLICE)
+            local_query (str): SQL equivalent of query returning the same columns, run instead of query
+                               on the local analytics backend (see common/local_analytics.py)
         """
+        if time_slice:
+            _get_absolute_timespan(timespan)  # validate the timespan up front
+        query, include_link = self.__get_query_to_run(
+            title, query, local_query, include_link
+        )
 
         self.__queries.append(
             (
@@ -189,6 +240,7 @@ class QueryProcessor:
                 show_query,
                 include_link,
                 missing_value,
+                time_slice,
             )
         )
 
@@ -206,6 +258,7 @@ class QueryProcessor:
             show_query,
             include_link,
             missing_value,
+            time_slice,
         ) in enumerate(self.__queries):
             query_text += f"\n\n// {title}\n{query.strip()}\n\n\n"
 
@@ -218,12 +271,23 @@ class QueryProcessor:
         )
         return get_link(link_text, url)
 
-    def run_queries(self, all_queries_link_text=None):
+    def run_queries(self, all_queries_link_text=None, parallelism=1, batch=False):
         """
         Runs queries stored in __queries and prints result to stdout.
+
+        Parameters:
+            all_queries_link_text (str): If set, a link to run all of the queries in Log Analytics is printed with this text.
+            parallelism (int): Maximum number of queries to run concurrently.
+                               Results are always output in the order the queries were added.
+            batch (bool): If true then the queries are sent using the batch API (up to MAX_QUERIES_PER_BATCH queries
+                          per request) rather than one request per query. When batching, parallelism is only used
+                          for the windows of time-sliced queries (which aren't batched).
         """
         query_error_count = 0
         all_queries_text = ""
+        run_start = time.perf_counter()
+        query_durations = []
+        query_results = self.__iter_query_results(parallelism, batch)
         for query_index, (
             title,
             query,
@@ -236,6 +300,7 @@ class QueryProcessor:
             show_query,
             include_link,
             missing_value,
+            time_slice,
         ) in enumerate(self.__queries):
             all_queries_text += f"\n\n// {title}\n{query.strip()}\n\n\n"
             print()
@@ -258,7 +323,8 @@ class QueryProcessor:
                 link = get_link("Run in Log Analytics", url)
                 print(link)
                 print("")
-            result, error_message = self.run_query(query, timespan)
+            result, error_message, duration = next(query_results)
+            query_durations.append(duration)
 
             if error_message:
                 print()
@@ -266,6 +332,9 @@ class QueryProcessor:
                 query_error_count += 1
                 continue
 
+            if self.__exporter:
+                self.__exporter.export(f"{query_index + 1:02}-{title}", result)
+
             if group_definition:
                 if columns and len(columns) > 0:
                     raise ValueError(
@@ -301,7 +370,19 @@ class QueryProcessor:
 
             print()
 
-        if all_queries_link_text:
+        if query_durations:
+            run_duration = time.perf_counter() - run_start
+            if batch:
+                print(
+                    f"Ran {len(query_durations)} queries in {run_duration:.2f}s (batched)"
+                )
+            else:
+                print(
+                    f"Ran {len(query_durations)} queries in {run_duration:.2f}s"
+                    + f" (sequential query time: {sum(query_durations):.2f}s, parallelism: {parallelism})"
+                )
+
+        if all_queries_link_text and self.__query_language == "kql":
             all_queries_url = get_log_analytics_portal_url(
                 self.__tenant_id,
                 self.__subscription_id,
@@ -317,7 +398,7 @@ class QueryProcessor:
 
         return query_error_count
 
-    def run_query(self, query, timespan) -> tuple[Table, str]:
+    def run_query(self, query, timespan, use_cache=True) -> tuple[Table, str]:
         """
         Runs a query on a given timespan.
 
@@ -325,12 +406,223 @@ class QueryProcessor:
             query (str): Query in Kusto query language (KQL) to run.
             timespan (str): The time period into the past from now to fetch data to query on for.
                             in format PT<TIME DURATION> e.g. PT12H.
+            use_cache (bool): If false then the query cache is bypassed (e.g. when polling for data to be ingested)
 
         Returns:
             Table with results
             Error code if any.
         """
+        if use_cache:
+            cached_result = self.__get_cached_result(query, timespan)
+            if cached_result:
+                return cached_result
+
+        table, error_message, _ = self.__fetch_result(query, timespan)
+        if use_cache:
+            self.__cache_result(query, timespan, (table, error_message))
+        return table, error_message
+
+    def run_sliced_query(
+        self,
+        query,
+        timespan,
+        time_slice: timedelta,
+        parallelism=4,
+        min_time_slice=MIN_TIME_SLICE,
+    ) -> tuple[Table, str]:
+        """
+        Runs a query over timespan in windows of time_slice and merges the results into one table (see iter_time_slices).
 
+        Returns:
+            Table with results
+            Error code if any.
+        """
+        try:
+            return (
+                Table.concat(
+                    self.__iter_sliced_tables(
+                        query, timespan, time_slice, parallelism, min_time_slice
+                    )
+                ),
+                None,
+            )
+        except _TimeSliceError as e:
+            return None, str(e)
+
+    def export_query(
+        self,
+        name,
+        query,
+        timespan,
+        time_slice: timedelta | None = None,
+        parallelism=4,
+        local_query: str | None = None,
+    ) -> tuple[str, str]:
+        """
+        Runs a query and writes the result with the exporter (without outputting it), e.g. to pull raw gateway logs.
+        If time_slice is set, each window is written as it is received so the whole result is never held in memory.
+        local_query is the SQL equivalent of query for the local analytics backend (see add_query).
+
+        Returns:
+            Path of the exported file
+            Error code if any.
+        """
+        if not self.__exporter:
+            raise ValueError("An exporter is required to export query results")
+        query, _ = self.__get_query_to_run(name, query, local_query, False)
+        if not time_slice:
+            table, error_message = self.run_query(query, timespan)
+            if error_message:
+                return None, error_message
+            return self.__exporter.export(name, table), None
+
+        try:
+            return (
+                self.__exporter.export_chunks(
+                    name,
+                    self.__iter_sliced_tables(
+                        query,
+                        timespan,
+                        time_slice,
+                        parallelism,
+                        MIN_TIME_SLICE,
+                        # raw pulls can be large, don't let them evict the report results from the cache
+                        use_cache=False,
+                    ),
+                ),
+                None,
+            )
+        except _TimeSliceError as e:
+            return None, str(e)
+
+    def __iter_sliced_tables(
+        self, query, timespan, time_slice, parallelism, min_time_slice, use_cache=True
+    ):
+        """
+        Yields the table for each window of a time-sliced query, raising _TimeSliceError if a window fails.
+        """
+        time_slices = self.iter_time_slices(
+            query, timespan, time_slice, parallelism, min_time_slice, use_cache
+        )
+        try:
+            for (start, end), table, error_message in time_slices:
+                if error_message:
+                    raise _TimeSliceError(
+                        f"Time slice {start.isoformat()} - {end.isoformat()} failed: {error_message}"
+                    )
+                yield table
+        finally:
+            time_slices.close()
+
+    def iter_time_slices(
+        self,
+        query,
+        timespan,
+        time_slice: timedelta,
+        parallelism=4,
+        min_time_slice=MIN_TIME_SLICE,
+        use_cache=True,
+    ):
+        """
+        Runs a query over timespan in windows of time_slice and yields ((start, end), table, error_message)
+        for each window in time order.
+
+        Up to parallelism windows are run concurrently. Each window is yielded as soon as it (and the windows before it)
+        have been received. Windows are only started as earlier windows are consumed, so only a few windows' results
+        are held at a time. If a window's result is truncated (a partial result or MAX_ROWS_PER_QUERY rows),
+        it is split in half and re-run, down to min_time_slice.
+
+        Window edges (other than the start and end of timespan) are multiples of time_slice since the epoch,
+        and truncated windows are split on multiples of min_time_slice, so rows binned on TimeGenerated by a size that
+        divides both are never split across windows.
+
+        Parameters:
+            query (str): Query in Kusto query language (KQL) to run.
+            timespan (tuple): (start, end) time range to run the query over, end can be a datetime or timedelta
+            time_slice (timedelta): Length of the windows to split timespan into
+            parallelism (int): Maximum number of windows to run concurrently
+            min_time_slice (timedelta): Smallest window to split a truncated window into
+            use_cache (bool): If false then the query cache is bypassed
+        """
+        start, end = _get_absolute_timespan(timespan)
+        parallelism = max(parallelism, 1)
+        windows = deque(_split_timespan(start, end, time_slice))
+        with ThreadPoolExecutor(max_workers=parallelism) as executor:
+
+            def submit(window):
+                return (
+                    window,
+                    executor.submit(self.__run_time_slice, query, window, use_cache),
+                )
+
+            pending_windows = deque()
+            try:
+                while True:
+                    while windows and len(pending_windows) < parallelism:
+                        pending_windows.append(submit(windows.popleft()))
+                    if not pending_windows:
+                        return
+
+                    window, future = pending_windows.popleft()
+                    table, error_message, truncated = future.result()
+                    window_start, window_end = window
+                    middle = (
+                        _get_window_middle(window_start, window_end, min_time_slice)
+                        if truncated
+                        else None
+                    )
+                    if middle is not None:
+                        logging.info(
+                            "Result for %s - %s truncated, splitting the window",
+                            window_start.isoformat(),
+                            window_end.isoformat(),
+                        )
+                        pending_windows.extendleft(
+                            submit(half)
+                            for half in [(middle, window_end), (window_start, middle)]
+                        )
+                        continue
+                    if truncated and not error_message:
+                        error_message = f"Result truncated at {len(table)} rows"
+                    yield window, table, error_message
+            finally:
+                # don't wait for windows that haven't started if we exit early
+                for _, future in pending_windows:
+                    future.cancel()
+
+    def __run_time_slice(
+        self, query, window, use_cache=True
+    ) -> tuple[Table, str, bool]:
+        """
+        Runs a query for a window of a time-sliced query, returning the result and whether it was truncated.
+        """
+        if use_cache:
+            cached_result = self.__get_cached_result(query, window)
+            if cached_result:
+                return *cached_result, False
+
+        table, error_message, truncated = self.__fetch_result(query, window)
+        if use_cache and not truncated:
+            self.__cache_result(query, window, (table, error_message))
+        return table, error_message, truncated
+
+    def __get_query_to_run(self, title, query, local_query, include_link):
+        """
+        Get the query to send to the client (the SQL local_query for local analytics clients) and whether a link can be included
+        """
+        if self.__query_language == "kql":
+            return query, include_link
+        if local_query is None:
+            raise ValueError(
+                f"'{title}' has no local_query to run on the local analytics backend"
+            )
+        # there is no portal to link to for local queries
+        return local_query, False
+
+    def __fetch_result(self, query, timespan) -> tuple[Table, str, bool]:
+        """
+        Sends a query to Log Analytics, returning the result and whether it was truncated.
+        """
         try:
             response = self.__logs_query_client.query_workspace(
                 workspace_id=self.__workspace_id,
@@ -338,31 +630,234 @@ class QueryProcessor:
                 timespan=timespan,
             )
         except HttpResponseError as e:
-            return None, e.message
+            return None, e.message, False
 
-        table = response.tables[0]
-        rows = table.rows
-        columns = table.columns
-        return Table(columns=columns, rows=rows), None
+        table, error_message = self.__result_from_response(response)
+        truncated = response.status == LogsQueryStatus.PARTIAL or (
+            table is not None and len(table) >= MAX_ROWS_PER_QUERY
+        )
+        return table, error_message, truncated
 
-    def wait_for_non_zero_count(self, query, max_retries=20, wait_time_seconds=30):
+    def __get_cached_result(self, query, timespan) -> tuple[Table, str] | None:
         """
-        Run a query until it returns a non-zero count.
+        Get the result for a query from the cache (or None if the query needs to be run).
         """
-        logging.info("Check for metrics data, query: %s", query)
-        for _ in range(max_retries):
-            r, _ = self.run_query(
-                query=query,
-                timespan=(datetime.now(UTC) - timedelta(days=1), datetime.now(UTC)),
+        if self.__cache:
+            table = self.__cache.get(self.__workspace_id, query, timespan)
+            if table is not None:
+                return table, None
+        if self.__cache_only:
+            return None, "Result not found in query cache"
+        return None
+
+    def __cache_result(self, query, timespan, result: tuple[Table, str]):
+        table, error_message = result
+        if self.__cache and not error_message:
+            self.__cache.put(self.__workspace_id, query, timespan, table)
+
+    def __result_from_response(self, response) -> tuple[Table, str]:
+        """
+        Converts a LogsQueryResult, LogsQueryPartialResult or LogsQueryError into a Table or error message.
+        """
+        if response.status == LogsQueryStatus.SUCCESS:
+            table = response.tables[0]
+            return (
+                Table(
+                    columns=table.columns,
+                    rows=table.rows,
+                    column_types=table.columns_types,
+                ),
+                None,
             )
-            count = r.rows[0][0]
-            if count > 0:
-                logging.info("✔️ Found metrics data")
-                return
-            logging.info("⏳ Waiting for metrics data...")
-            time.sleep(wait_time_seconds)
+        if response.status == LogsQueryStatus.PARTIAL:
+            return None, f"Partial result returned: {response.partial_error.message}"
+        return None, response.message
 
-        raise Exception("❌ No metrics data found")
+    def __iter_query_results(self, parallelism, batch):
+        """
+        Yields (result, error_message, duration) for each query in the order the queries were added.
+
+        When parallelism is greater than 1 the queries are all submitted to a bounded thread pool up front
+        so that each result can be output as soon as it (and the results before it) have been received.
+        """
+        if batch:
+            yield from self.__iter_batched_query_results(parallelism)
+            return
+
+        if parallelism <= 1 or len(self.__queries) <= 1:
+            for _, query, _, timespan, *_, time_slice in self.__queries:
+                yield self.__run_query_timed(query, timespan, time_slice, parallelism)
+            return
+
+        with ThreadPoolExecutor(max_workers=parallelism) as executor:
+            futures = [
+                executor.submit(
+                    self.__run_query_timed, query, timespan, time_slice, parallelism
+                )
+                for _, query, _, timespan, *_, time_slice in self.__queries
+            ]
+            try:
+                for future in futures:
+                    yield future.result()
+            finally:
+                # don't wait for queries that haven't started if we exit early
+                for future in futures:
+                    future.cancel()
+
+    def __iter_batched_query_results(self, parallelism):
+        """
+        Yields (result, error_message, duration) for each query in the order the queries were added,
+        sending the queries that aren't in the cache to Log Analytics in batches of up to MAX_QUERIES_PER_BATCH.
+
+        The time taken for each batch request is split evenly across the queries in the batch.
+        Time-sliced queries aren't batched, they are run (with up to parallelism windows at a time) when they are reached.
+        """
+        sliced_query_indexes = {
+            index for index, (*_, time_slice) in enumerate(self.__queries) if time_slice
+        }
+        results = [
+            (
+                None
+                if index in sliced_query_indexes
+                # cache results for time-sliced queries are stored per window
+                else self.__get_cached_result(query, timespan)
+            )
+            for index, (_, query, _, timespan, *_) in enumerate(self.__queries)
+        ]
+        durations = [0.0] * len(results)
+        uncached_queries = [
+            (index, query, timespan)
+            for index, (_, query, _, timespan, *_) in enumerate(self.__queries)
+            if not results[index] and index not in sliced_query_indexes
+        ]
+
+        next_index = 0
+
+        def iter_available_results():
+            """
+            Yields the results that are available in order, running time-sliced queries as they are reached
+            """
+            nonlocal next_index
+            while next_index < len(results):
+                if next_index in sliced_query_indexes:
+                    _, query, _, timespan, *_, time_slice = self.__queries[next_index]
+                    yield self.__run_query_timed(
+                        query, timespan, time_slice, parallelism
+                    )
+                elif results[next_index]:
+                    yield *results[next_index], durations[next_index]
+                else:
+                    return
+                next_index += 1
+
+        for batch_start in range(0, len(uncached_queries), MAX_QUERIES_PER_BATCH):
+            batch = uncached_queries[batch_start : batch_start + MAX_QUERIES_PER_BATCH]
+            batch_indexes = [index for index, _, _ in batch]
+            batch_queries = [
+                LogsBatchQuery(
+                    workspace_id=self.__workspace_id,
+                    query=query,
+                    timespan=timespan,
+                )
+                for _, query, timespan in batch
+            ]
+            start = time.perf_counter()
+            try:
+                # responses are returned in the same order as the queries in the batch
+                responses = self.__logs_query_client.query_batch(batch_queries)
+                for (index, query, timespan), response in zip(batch, responses):
+                    results[index] = self.__result_from_response(response)
+                    self.__cache_result(query, timespan, results[index])
+            except HttpResponseError as e:
+                for index in batch_indexes:
+                    results[index] = (None, e.message)
+            duration = (time.perf_counter() - start) / len(batch_indexes)
+            for index in batch_indexes:
+                durations[index] = duration
+
+            # output results as soon as all of the results before them are available
+            yield from iter_available_results()
+
+        yield from iter_available_results()
+
+    def __run_query_timed(
+        self, query, timespan, time_slice=None, parallelism=1
+    ) -> tuple[Table, str, float]:
+        """
+        Runs a query (time-sliced if time_slice is set) and also returns the time taken (in seconds) to run it.
+        """
+        start = time.perf_counter()
+        if time_slice:
+            result, error_message = self.run_sliced_query(
+                query, timespan, time_slice, parallelism
+            )
+        else:
+            result, error_message = self.run_query(query, timespan)
+        return result, error_message, time.perf_counter() - start
+
+    def wait_for_non_zero_count(
+        self, query, polling_strategy: PollingStrategy | None = None
+    ):
+        """
+        Run a query until it returns a non-zero count.
+        """
+        self.wait_for_non_zero_counts([query], polling_strategy)
+
+    def wait_for_non_zero_counts(
+        self, queries: list[str], polling_strategy: PollingStrategy | None = None
+    ):
+        """
+        Run a set of queries until they all return a non-zero count (e.g. to wait for data to be ingested into several tables).
+        The queries that haven't yet returned a non-zero count are run concurrently on each attempt.
+
+        Parameters:
+            queries (list(str)): Queries returning a single count value
+            polling_strategy (PollingStrategy): Controls the interval between attempts and how long to wait for
+        """
+        if self.__query_language == "sql":
+            # local analytics data can be queried as soon as it is written, there's no ingestion to wait for
+            return
+
+        polling_strategy = polling_strategy or PollingStrategy()
+        deadline = time.monotonic() + polling_strategy.deadline_seconds
+        intervals = polling_strategy.intervals()
+        pending_queries = list(queries)
+        for query in pending_queries:
+            logging.info("Check for metrics data, query: %s", query)
+
+        with ThreadPoolExecutor(max_workers=len(pending_queries)) as executor:
+            while True:
+                timespan = (datetime.now(UTC) - timedelta(days=1), datetime.now(UTC))
+                counts = executor.map(
+                    lambda query: self.__run_count_query(query, timespan),
+                    pending_queries,
+                )
+                pending_queries = [
+                    query
+                    for query, count in zip(pending_queries, list(counts))
+                    if count <= 0
+                ]
+                if not pending_queries:
+                    logging.info("✔️ Found metrics data")
+                    return
+
+                remaining_seconds = deadline - time.monotonic()
+                if remaining_seconds <= 0:
+                    raise Exception("❌ No metrics data found")
+                logging.info(
+                    "⏳ Waiting for metrics data (%d of %d queries pending)...",
+                    len(pending_queries),
+                    len(queries),
+                )
+                time.sleep(min(next(intervals), remaining_seconds))
+
+    def __run_count_query(self, query, timespan) -> int:
+        # the count changes as data is ingested, so never cache it
+        result, error_message = self.run_query(query, timespan, use_cache=False)
+        if error_message:
+            logging.warning("Metrics data check failed: %s", error_message)
+            return 0
+        return result.rows[0][0]
 
     def __output_table(self, query_result: Table):
         """
@@ -387,15 +882,9 @@ class QueryProcessor:
             config: The style configuration for the chart, info can be found here: https://github.com/kroitor/asciichart.
         """
 
-        def get_column_values(table: Table, column: str):
-            try:
-                column_index = table.columns.index(column)
-            except ValueError:
-                raise ValueError(
-                    f"Column '{column}' not found in table columns: "
-                    + ",".join(table.columns)
-                )
-            return [row[column_index] or missing_value for row in table.rows]
-
-        series = [get_column_values(query_result, column) for column in columns]
-        print(asciichart.plot(series, config))
+        series = [
+            [value or missing_value for value in query_result.column(column)]
+            for column in columns
+        ]
+        # long runs have more points than fit across the terminal
+        print(asciichart.plot(fit_series_to_terminal(series, config), config))
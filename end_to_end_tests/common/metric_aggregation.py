@@ -0,0 +1,95 @@
+import logging
+
+import gevent
+from locust import events
+from opentelemetry import metrics
+
+from .config import metric_aggregation, metric_flush_interval_seconds
+
+_aggregators = []
+_flush_greenlet = None
+
+
+class CounterAggregator:
+    """
+    Sums additions to an OpenTelemetry counter locally (per set of attribute values)
+    and adds the totals to the counter when flushed, so that counting a request is a dictionary update
+    rather than a call into the OpenTelemetry SDK.
+
+    Histograms are recorded directly: the OpenTelemetry API can only record one measurement at a time,
+    so aggregating them locally would only delay the same calls (and lose the exact min and max).
+
+    Locust users run as greenlets that only switch on I/O, so the totals need no locking:
+    flushing swaps in a new dict before reading the old one.
+    """
+
+    def __init__(
+        self,
+        counter: metrics.Counter,
+        attribute_names: tuple[str, ...] = (),
+        enabled: bool = metric_aggregation,
+    ) -> None:
+        """
+        Constructor
+
+        Parameters:
+            counter (Counter): OpenTelemetry counter to add the totals to
+            attribute_names (tuple(str)): Names of the attributes, add is passed the values in the same order
+            enabled (bool): If false then each addition is passed directly to the counter
+        """
+        self.__counter = counter
+        self.__attribute_names = attribute_names
+        self.__enabled = enabled
+        self.__totals = {}
+        _aggregators.append(self)
+
+    def add(self, amount: float = 1, attribute_values: tuple = ()):
+        if not self.__enabled:
+            self.__counter.add(
+                amount, dict(zip(self.__attribute_names, attribute_values))
+            )
+            return
+
+        self.__totals[attribute_values] = (
+            self.__totals.get(attribute_values, 0) + amount
+        )
+
+    def flush(self):
+        totals, self.__totals = self.__totals, {}
+        for attribute_values, total in totals.items():
+            self.__counter.add(
+                total, dict(zip(self.__attribute_names, attribute_values))
+            )
+
+
+def flush_metrics():
+    """
+    Record the aggregated measurements for all aggregators to OpenTelemetry
+    """
+    for aggregator in _aggregators:
+        aggregator.flush()
+
+
+def _flush_periodically():
+    while True:
+        gevent.sleep(metric_flush_interval_seconds)
+        try:
+            flush_metrics()
+        except Exception:
+            logging.exception("Failed to flush metrics")
+
+
+@events.test_start.add_listener
+def on_test_start(environment, **kwargs):
+    global _flush_greenlet
+    if metric_aggregation and _flush_greenlet is None:
+        _flush_greenlet = gevent.spawn(_flush_periodically)
+
+
+@events.test_stop.add_listener
+def on_test_stop(environment, **kwargs):
+    global _flush_greenlet
+    if _flush_greenlet is not None:
+        _flush_greenlet.kill()
+        _flush_greenlet = None
+    flush_metrics()
@@ -0,0 +1,244 @@
+import logging
+import random
+import time
+import traceback
+from functools import wraps
+from weakref import WeakKeyDictionary
+
+import gevent
+from gevent.pool import Pool
+from locust import HttpUser, constant, events
+from locust.clients import LocustHttpAdapter
+from opentelemetry import metrics
+
+from .config import (
+    arrival_process,
+    arrival_rate,
+    arrival_rates,
+    load_mode,
+    max_in_flight,
+)
+from .metric_aggregation import CounterAggregator
+from .users import ScenarioHttpUser
+
+LOAD_MODES = ("closed", "open")
+ARRIVAL_PROCESSES = ("constant", "poisson")
+# "request type" used to report dropped requests in the Locust failures table
+DROPPED_REQUEST_TYPE = "DROPPED"
+
+
+def parse_arrival_rates(value: str) -> dict[str, float]:
+    """
+    Parse per user class arrival rates from a comma-separated list of name=rate entries, e.g. "HighPriorityUser=2,LowPriorityUser=0.5"
+    """
+    rates = {}
+    for entry in filter(None, (entry.strip() for entry in value.split(","))):
+        name, separator, rate = entry.partition("=")
+        if not separator:
+            raise ValueError(f"Invalid arrival rate '{entry}', expected name=rate")
+        rates[name.strip()] = float(rate)
+    return rates
+
+
+class RequestDropped(Exception):
+    pass
+
+
+class ArrivalScheduler:
+    """
+    Schedules open-loop requests for the users in this Locust process.
+
+    Each user is an independent arrival stream: the time to its next request is scheduled from the time of its previous request
+    (rather than from when the previous request completed), and the requests run in a shared pool of greenlets.
+    When max_in_flight requests are already running, a request that is due is dropped rather than delayed
+    (so that the requests that are sent are still on time), and reported in the Locust failures table and
+    the locust.request_dropped metric.
+    """
+
+    def __init__(
+        self,
+        default_rate: float,
+        rates: dict[str, float],
+        process: str = "constant",
+        max_in_flight: int = 1000,
+    ) -> None:
+        """
+        Constructor
+
+        Parameters:
+            default_rate (float): Requests per second for each user
+            rates (dict(str, float)): Requests per second for each user, by user class name (overrides default_rate)
+            process (str): "constant" (fixed interval between requests) or "poisson" (exponentially distributed intervals)
+            max_in_flight (int): Maximum number of requests running at once
+        """
+        if process not in ARRIVAL_PROCESSES:
+            raise ValueError(
+                f"Unsupported arrival process '{process}', expected one of: {','.join(ARRIVAL_PROCESSES)}"
+            )
+        for name, rate in [("default", default_rate), *rates.items()]:
+            if rate <= 0:
+                raise ValueError(f"Arrival rate for {name} must be positive")
+        self.__default_rate = default_rate
+        self.__rates = rates
+        self.__poisson = process == "poisson"
+        self.__pool = Pool(max_in_flight)
+        self.__next_arrivals = WeakKeyDictionary()
+        # the running requests for each user, so that they can be killed when the user stops
+        self.__user_greenlets = WeakKeyDictionary()
+        self.dropped_counts = {}
+        self.__request_dropped = CounterAggregator(
+            metrics.get_meter(__name__).create_counter(
+                "locust.request_dropped", "Dropped open-loop requests", "count"
+            ),
+            attribute_names=("user_class",),
+        )
+
+    @property
+    def in_flight(self) -> int:
+        return len(self.__pool)
+
+    def get_rate(self, user) -> float:
+        return self.__rates.get(type(user).__name__, self.__default_rate)
+
+    def get_wait_time(self, user) -> float:
+        """
+        Get the time until a user's next request
+        """
+        now = time.monotonic()
+        rate = self.get_rate(user)
+        interval = random.expovariate(rate) if self.__poisson else 1 / rate
+        next_arrival = self.__next_arrivals.get(user, now) + interval
+        self.__next_arrivals[user] = next_arrival
+        # if this process has fallen behind then send the request straight away
+        return max(next_arrival - time.monotonic(), 0)
+
+    def dispatch(self, user, task, *args):
+        """
+        Run a task for a user without waiting for it to complete (or drop it if max_in_flight requests are running)
+        """
+        if self.__pool.full():
+            self.__record_dropped(user, task)
+            return
+        greenlet = self.__pool.spawn(self.__run_task, user, task, *args)
+        greenlets = self.__user_greenlets.setdefault(user, set())
+        greenlets.add(greenlet)
+        greenlet.link(greenlets.discard)
+
+    def stop_user(self, user):
+        """
+        Kill a user's running requests (when the user stops, e.g. when a stage change reduces the user count)
+        """
+        greenlets = self.__user_greenlets.pop(user, set())
+        gevent.killall(list(greenlets), block=False)
+
+    def stop(self):
+        self.__pool.kill(block=False)
+        self.__request_dropped.flush()
+        for name, count in self.dropped_counts.items():
+            logging.warning(
+                f"Dropped {count} {name} open-loop requests (more than {self.__pool.size} requests in flight)"
+            )
+
+    def __run_task(self, user, task, *args):
+        try:
+            task(user, *args)
+        except Exception as e:
+            # the same handling as Locust for exceptions from tasks
+            logging.error("%s\n%s", e, traceback.format_exc())
+            user.environment.events.user_error.fire(
+                user_instance=user, exception=e, tb=e.__traceback__
+            )
+
+    def __record_dropped(self, user, task):
+        name = type(user).__name__
+        self.dropped_counts[name] = self.dropped_counts.get(name, 0) + 1
+        self.__request_dropped.add(1, (name,))
+        # log_error (rather than firing a request event) so that dropped requests aren't counted in the response times
+        user.environment.stats.log_error(
+            DROPPED_REQUEST_TYPE,
+            f"{name}.{task.__name__}",
+            RequestDropped(f"More than {self.__pool.size} requests in flight"),
+        )
+
+
+if load_mode not in LOAD_MODES:
+    raise ValueError(
+        f"Unsupported load mode '{load_mode}', expected one of: {','.join(LOAD_MODES)}"
+    )
+
+arrival_scheduler = None
+if load_mode == "open":
+    arrival_scheduler = ArrivalScheduler(
+        arrival_rate,
+        parse_arrival_rates(arrival_rates),
+        arrival_process,
+        max_in_flight,
+    )
+
+
+def open_loop_task(task):
+    """
+    Decorator for the tasks of an OpenLoopUser: in open-loop mode the task is dispatched to the ArrivalScheduler
+    so that the user can issue its next request on time, otherwise it runs as normal.
+
+    Example:
+        @task
+        @open_loop_task
+        def get_completion(self):
+            ...
+    """
+    if arrival_scheduler is None:
+        return task
+
+    @wraps(task)
+    def wrapper(user, *args):
+        arrival_scheduler.dispatch(user, task, *args)
+
+    return wrapper
+
+
+class OpenLoopUser(ScenarioHttpUser):
+    """
+    Base class for scenario users that can run either closed loop (the default) or open loop (LOAD_MODE=open).
+
+    In closed-loop mode the user waits for closed_loop_wait_time between requests, so the load drops when responses slow down.
+    In open-loop mode the user issues requests at its arrival rate (ARRIVAL_RATE, or ARRIVAL_RATES for the user class)
+    whether or not its earlier requests have completed. Decorate tasks with open_loop_task.
+    Subclasses that override on_stop call super().on_stop() to stop their running requests.
+    """
+
+    abstract = True
+
+    closed_loop_wait_time = constant(1)
+    # FastHttpUser limits the concurrent requests for each user (to 10 by default),
+    # so raise the limit to stop open-loop requests queueing in the client (the scheduler limits the total)
+    concurrency = max_in_flight
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if arrival_scheduler is not None and isinstance(self, HttpUser):
+            # likewise, requests keeps 10 connections for each user (by default) and opens and then discards
+            # a new connection for each request beyond that, which would add the connection time to their latency
+            for prefix in ("https://", "http://"):
+                self.client.mount(
+                    prefix,
+                    LocustHttpAdapter(
+                        pool_manager=self.pool_manager, pool_maxsize=max_in_flight
+                    ),
+                )
+
+    def on_stop(self):
+        if arrival_scheduler is not None:
+            # requests that are still running would otherwise keep using the stopped user's client
+            arrival_scheduler.stop_user(self)
+
+    def wait_time(self):
+        if arrival_scheduler is not None:
+            return arrival_scheduler.get_wait_time(self)
+        return self.closed_loop_wait_time()
+
+
+@events.test_stop.add_listener
+def on_test_stop(environment, **kwargs):
+    if arrival_scheduler is not None:
+        arrival_scheduler.stop()
@@ -0,0 +1,312 @@
+import json
+import mmap
+import os
+import random
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import NamedTuple
+
+from .config import payload_corpus_file, payload_token_mix
+from .token_estimation import estimate_policy_tokens, estimate_tokens
+from .users import encode_json
+
+OPERATIONS = ("completions", "chat", "embeddings")
+# prompts within this fraction of a token size's prompt_tokens are used for it
+PROMPT_TOKEN_TOLERANCE = 0.25
+# limit on the number of bodies encoded for each token size (prompts are sampled if there are more)
+MAX_BODIES_PER_TOKEN_SIZE = 1000
+
+
+@dataclass(frozen=True)
+class TokenSize:
+    """
+    A prompt and completion size in a token mix.
+
+    prompt_tokens is the approximate prompt size to select from the corpus (None for any prompt)
+    and max_tokens is sent as max_tokens in the request (0 to omit it).
+    """
+
+    prompt_tokens: int | None
+    max_tokens: int
+    weight: float = 1.0
+
+
+def parse_token_mix(value: str) -> list[TokenSize]:
+    """
+    Parse a token mix from a comma-separated list of prompt_tokens:max_tokens:weight entries,
+    e.g. "100:50:3,2000:500:1" (use * for prompt_tokens to allow any prompt, and the weight defaults to 1)
+    """
+    token_mix = []
+    for entry in value.split(","):
+        parts = entry.strip().split(":")
+        if len(parts) not in (2, 3):
+            raise ValueError(
+                f"Invalid token mix entry '{entry}', expected prompt_tokens:max_tokens[:weight]"
+            )
+        token_mix.append(
+            TokenSize(
+                prompt_tokens=None if parts[0] == "*" else int(parts[0]),
+                max_tokens=int(parts[1]),
+                weight=float(parts[2]) if len(parts) == 3 else 1.0,
+            )
+        )
+    return token_mix
+
+
+class AliasTable:
+    """
+    Samples indices in proportion to a list of weights in O(1) time per sample (Vose's alias method).
+    """
+
+    def __init__(self, weights: list[float]) -> None:
+        count = len(weights)
+        total = sum(weights)
+        if count == 0 or total <= 0:
+            raise ValueError("At least one positive weight is required")
+
+        scaled = [weight * count / total for weight in weights]
+        self.__count = count
+        self.__probabilities = [1.0] * count
+        self.__aliases = list(range(count))
+        small = [index for index, value in enumerate(scaled) if value < 1]
+        large = [index for index, value in enumerate(scaled) if value >= 1]
+        while small and large:
+            small_index = small.pop()
+            large_index = large.pop()
+            self.__probabilities[small_index] = scaled[small_index]
+            self.__aliases[small_index] = large_index
+            scaled[large_index] += scaled[small_index] - 1
+            if scaled[large_index] < 1:
+                small.append(large_index)
+            else:
+                large.append(large_index)
+        # anything left over is (allowing for rounding errors) exactly 1
+
+    def sample(self, rng: random.Random = random) -> int:
+        # a single random number picks both the column and whether to take its alias
+        value = rng.random() * self.__count
+        index = int(value)
+        if value - index < self.__probabilities[index]:
+            return index
+        return self.__aliases[index]
+
+
+class Payload(NamedTuple):
+    body: bytes
+    prompt_tokens: int
+    max_tokens: int
+    # tokens counted against the deployment's TPM limit by the gateway (see common/token_estimation.py)
+    policy_tokens: int
+
+
+class PayloadSampler:
+    """
+    Samples pre-encoded request bodies according to their weights
+    """
+
+    def __init__(self, payloads: list[Payload], weights: list[float]) -> None:
+        self.__payloads = payloads
+        self.__alias_table = AliasTable(weights)
+
+    def __len__(self) -> int:
+        return len(self.__payloads)
+
+    def sample(self, rng: random.Random = random) -> Payload:
+        return self.__payloads[self.__alias_table.sample(rng)]
+
+
+class PayloadCorpus:
+    """
+    A set of prompts to build request bodies from.
+
+    Each record has either a "prompt" (text) or "messages" (chat messages) and optionally "prompt_tokens"
+    (estimated from the text length if not set). Prompts are converted to messages for chat requests
+    and messages are joined for completions and embeddings requests.
+    """
+
+    def __init__(self, records: list[dict]) -> None:
+        if not records:
+            raise ValueError("The payload corpus is empty")
+        self.__records = records
+        self.__prompt_tokens = [
+            record.get("prompt_tokens") or estimate_tokens(_get_prompt_text(record))
+            for record in records
+        ]
+
+    @classmethod
+    def load(cls, path: str) -> "PayloadCorpus":
+        """
+        Load a corpus from a JSONL file (one record per line).
+        The file is memory-mapped and parsed line by line so that it isn't copied into memory as a whole.
+        """
+        records = []
+        with open(path, "rb") as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                raise ValueError(f"The payload corpus file '{path}' is empty")
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                start = 0
+                while start < len(data):
+                    end = data.find(b"\n", start)
+                    if end < 0:
+                        end = len(data)
+                    line = data[start:end].strip()
+                    if line:
+                        records.append(json.loads(line))
+                    start = end + 1
+        return cls(records)
+
+    def __len__(self) -> int:
+        return len(self.__records)
+
+    def create_sampler(
+        self,
+        operation: str,
+        model: str,
+        token_mix: list[TokenSize],
+        rng: random.Random = random,
+        stream: bool = False,
+    ) -> PayloadSampler:
+        """
+        Encode the request bodies for each token size in token_mix and return a sampler for them.
+
+        Each token size's weight is split evenly between the bodies built for it.
+
+        Parameters:
+            operation (str): "completions", "chat" or "embeddings" (max_tokens is not sent for embeddings)
+            model (str): Model name to send in the request bodies
+            token_mix (list(TokenSize)): Prompt and completion sizes to sample
+            rng (Random): Random number generator used to select prompts when there are more than MAX_BODIES_PER_TOKEN_SIZE
+            stream (bool): Send "stream": true in completions and chat requests
+        """
+        if operation not in OPERATIONS:
+            raise ValueError(
+                f"Unsupported operation '{operation}', expected one of: {','.join(OPERATIONS)}"
+            )
+        payloads = []
+        weights = []
+        for token_size in token_mix:
+            record_indices = self.__get_record_indices(token_size.prompt_tokens)
+            if len(record_indices) > MAX_BODIES_PER_TOKEN_SIZE:
+                record_indices = rng.sample(record_indices, MAX_BODIES_PER_TOKEN_SIZE)
+            for record_index in record_indices:
+                record = self.__records[record_index]
+                body = _build_body(
+                    operation, model, record, token_size.max_tokens, stream
+                )
+                payloads.append(
+                    Payload(
+                        body=encode_json(body),
+                        prompt_tokens=self.__prompt_tokens[record_index],
+                        max_tokens=(
+                            0
+                            if operation == "embeddings"
+                            else max(token_size.max_tokens, 0)
+                        ),
+                        policy_tokens=estimate_policy_tokens(operation, body),
+                    )
+                )
+                weights.append(token_size.weight / len(record_indices))
+        return PayloadSampler(payloads, weights)
+
+    def iter_bodies(self, operation: str, model: str, max_tokens: int):
+        """
+        Yields the request body for each record in the corpus (e.g. to replay the whole corpus rather than sample it)
+
+        Parameters:
+            operation (str): "completions", "chat" or "embeddings"
+            model (str): Model name to send in the request bodies
+            max_tokens (int): max_tokens to send for completions and chat requests (0 to omit it)
+        """
+        for record in self.__records:
+            yield _build_body(operation, model, record, max_tokens)
+
+    def __get_record_indices(self, prompt_tokens: int | None) -> list[int]:
+        if prompt_tokens is None:
+            return list(range(len(self.__records)))
+        tolerance = prompt_tokens * PROMPT_TOKEN_TOLERANCE
+        record_indices = [
+            index
+            for index, tokens in enumerate(self.__prompt_tokens)
+            if abs(tokens - prompt_tokens) <= tolerance
+        ]
+        if record_indices:
+            return record_indices
+        # fall back to the closest prompt
+        return [
+            min(
+                range(len(self.__records)),
+                key=lambda index: abs(self.__prompt_tokens[index] - prompt_tokens),
+            )
+        ]
+
+
+def _get_prompt_text(record: dict) -> str:
+    if "prompt" in record:
+        return record["prompt"]
+    return "\n".join(message.get("content", "") for message in record["messages"])
+
+
+def _build_body(
+    operation: str, model: str, record: dict, max_tokens: int, stream: bool = False
+) -> dict:
+    # keys are in the same order as the bodies the scenarios have always sent
+    if operation == "embeddings":
+        return {"input": _get_prompt_text(record), "model": model}
+    if operation == "completions":
+        body = {"model": model, "prompt": _get_prompt_text(record)}
+    else:
+        messages = record.get("messages") or [
+            {"role": "user", "content": record["prompt"]}
+        ]
+        body = {"messages": messages, "model": model}
+    if max_tokens > 0:
+        body["max_tokens"] = max_tokens
+    if stream:
+        body["stream"] = True
+    return body
+
+
+@lru_cache(maxsize=None)
+def load_payload_corpus(path: str) -> PayloadCorpus:
+    """
+    Load a corpus file (once per process)
+    """
+    return PayloadCorpus.load(path)
+
+
+def get_payload_sampler(
+    operation: str,
+    model: str,
+    default_records: list[dict],
+    default_token_mix: list[TokenSize],
+    max_tokens: int | None = None,
+    stream: bool = False,
+) -> PayloadSampler:
+    """
+    Create a sampler for a scenario's request bodies.
+
+    The prompts are loaded from PAYLOAD_CORPUS_FILE and the token mix from PAYLOAD_TOKEN_MIX if they are set,
+    otherwise the scenario's defaults are used.
+
+    Parameters:
+        operation (str): "completions", "chat" or "embeddings"
+        model (str): Model name to send in the request bodies
+        default_records (list(dict)): Prompts to use if PAYLOAD_CORPUS_FILE isn't set
+        default_token_mix (list(TokenSize)): Token mix to use if PAYLOAD_TOKEN_MIX isn't set
+        max_tokens (int): If set, overrides max_tokens for every token size (for users that test a fixed completion size)
+        stream (bool): Send "stream": true in completions and chat requests
+    """
+    corpus = (
+        load_payload_corpus(payload_corpus_file)
+        if payload_corpus_file
+        else PayloadCorpus(default_records)
+    )
+    token_mix = (
+        parse_token_mix(payload_token_mix) if payload_token_mix else default_token_mix
+    )
+    if max_tokens is not None:
+        token_mix = [
+            TokenSize(token_size.prompt_tokens, max_tokens, token_size.weight)
+            for token_size in token_mix
+        ]
+    return corpus.create_sampler(operation, model, token_mix, stream=stream)
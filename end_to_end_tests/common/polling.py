@@ -0,0 +1,29 @@
+import random
+from dataclasses import dataclass
+from typing import Iterator
+
+
+@dataclass
+class PollingStrategy:
+    """
+    Controls how often to poll when waiting for data to be ingested.
+
+    Polling starts at initial_interval_seconds and backs off exponentially (by backoff_factor) up to max_interval_seconds.
+    Each interval is randomly adjusted by up to +/- jitter (as a fraction of the interval) to avoid polling in lock-step.
+    Polling stops once deadline_seconds have elapsed.
+    """
+
+    initial_interval_seconds: float = 5
+    max_interval_seconds: float = 30
+    backoff_factor: float = 1.5
+    jitter: float = 0.1
+    deadline_seconds: float = 600
+
+    def intervals(self) -> Iterator[float]:
+        """
+        Yields the time to wait before each successive poll.
+        """
+        interval = self.initial_interval_seconds
+        while True:
+            yield interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+            interval = min(interval * self.backoff_factor, self.max_interval_seconds)
@@ -0,0 +1,214 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import UTC, datetime, timedelta
+from typing import Any
+
+from .table import Table
+
+
+def _normalize_query(query: str) -> str:
+    # whitespace doesn't change the meaning of a query, so don't let it change the cache key
+    return " ".join(query.split())
+
+
+def _timespan_end(timespan) -> datetime | None:
+    """
+    Get the end of an absolute timespan (or None for timespans relative to now)
+    """
+    if isinstance(timespan, tuple):
+        start, end = timespan
+        return start + end if isinstance(end, timedelta) else end
+    if isinstance(timespan, str) and "/" in timespan:
+        try:
+            return datetime.fromisoformat(timespan.split("/")[1])
+        except ValueError:
+            return None
+    return None
+
+
+def _normalize_timespan(timespan) -> str:
+    if isinstance(timespan, tuple):
+        return f"{timespan[0].isoformat()}/{_timespan_end(timespan).isoformat()}"
+    if isinstance(timespan, timedelta):
+        return f"PT{timespan.total_seconds()}S"
+    return str(timespan)
+
+
+def _encode_value(value: Any):
+    # query results only hold JSON values and datetimes (timespan and guid columns are returned as strings),
+    # anything else would come back from the cache as a different type than from a live query
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    raise TypeError(
+        f"Can't cache a query result value of type {type(value).__name__}: {value!r}"
+    )
+
+
+def _decode_object(value: dict):
+    if "$datetime" in value:
+        return datetime.fromisoformat(value["$datetime"])
+    return value
+
+
+class QueryCache:
+    """
+    An on-disk, content-addressed cache of query results.
+
+    Results are keyed on the data source (workspace/app ID), the query (with whitespace normalized) and the timespan.
+    Results for timespans that ended more than ingestion_grace_seconds ago are immutable so don't expire,
+    other results (including those for timespans that have only just ended, whose logs may still be being ingested)
+    expire after ttl_seconds.
+    When the cache grows beyond max_size_bytes, the least recently used entries are removed.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        ttl_seconds: float = 3600,
+        max_size_bytes: int = 512 * 1024 * 1024,
+        ingestion_grace_seconds: float = 900,
+    ) -> None:
+        """
+        Constructor
+
+        Parameters:
+            directory (str): Directory to store the cache in (created if it doesn't exist)
+            ttl_seconds (float): Time to keep results for timespans that are relative to now (e.g. PT12H) or haven't ended
+            max_size_bytes (int): Maximum size of the cache on disk
+            ingestion_grace_seconds (float): Time after the end of a timespan for its logs to be ingested,
+                after which its results don't change
+        """
+        self.__directory = directory
+        self.__ttl_seconds = ttl_seconds
+        self.__max_size_bytes = max_size_bytes
+        self.__ingestion_grace = timedelta(seconds=ingestion_grace_seconds)
+        os.makedirs(os.path.join(directory, "results"), exist_ok=True)
+        os.makedirs(os.path.join(directory, "runs"), exist_ok=True)
+
+    def get(self, source: str, query: str, timespan) -> Table | None:
+        """
+        Get a cached result (or None if there isn't a valid cached result).
+        """
+        path = self.__get_result_path(source, query, timespan)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f, object_hook=_decode_object)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            logging.warning("Ignoring unreadable query cache entry: %s", path)
+            return None
+
+        expires_at = entry["expires_at"]
+        if expires_at is not None and expires_at < time.time():
+            return None
+
+        os.utime(path)  # track last use for eviction
+        return Table(
+            columns=entry["columns"],
+            rows=entry["rows"],
+            column_types=entry.get("column_types"),
+        )
+
+    def put(self, source: str, query: str, timespan, table: Table):
+        """
+        Add a result to the cache.
+
+        Raises TypeError if the table has a value that can't be cached (anything but JSON values and datetimes).
+        """
+        timespan_end = _timespan_end(timespan)
+        if timespan_end is not None and timespan_end.tzinfo is None:
+            timespan_end = timespan_end.replace(tzinfo=UTC)
+        # Log Analytics ingests logs minutes after they are written, so a result for a timespan that has just ended
+        # may be missing its last logs
+        is_closed = (
+            timespan_end is not None
+            and timespan_end + self.__ingestion_grace <= datetime.now(UTC)
+        )
+        entry = {
+            "source": source,
+            "query": query,
+            "timespan": _normalize_timespan(timespan),
+            "expires_at": None if is_closed else time.time() + self.__ttl_seconds,
+            "columns": table.columns,
+            "column_types": table.column_types,
+            "rows": table.rows,
+        }
+
+        # encode before opening the file, so that an unsupported value doesn't leave a partial file behind
+        text = json.dumps(entry, default=_encode_value)
+
+        path = self.__get_result_path(source, query, timespan)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(temp_path, path)
+
+        self.__evict()
+
+    def save_run(self, name: str, source: str, start: datetime, end: datetime):
+        """
+        Record the source and time range of a test run so that its report can be re-rendered from the cache.
+        """
+        run = {"source": source, "start": start.isoformat(), "end": end.isoformat()}
+        with open(self.__get_run_path(name), "w", encoding="utf-8") as f:
+            json.dump(run, f)
+
+    def load_run(self, name: str) -> tuple[str, datetime, datetime]:
+        """
+        Get the source, start and end time of the last recorded test run with the given name.
+        """
+        with open(self.__get_run_path(name), "r", encoding="utf-8") as f:
+            run = json.load(f)
+        return (
+            run["source"],
+            datetime.fromisoformat(run["start"]),
+            datetime.fromisoformat(run["end"]),
+        )
+
+    def __get_result_path(self, source: str, query: str, timespan) -> str:
+        key = json.dumps(
+            [source, _normalize_query(query), _normalize_timespan(timespan)]
+        )
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.__directory, "results", digest[:2], f"{digest}.json")
+
+    def __get_run_path(self, name: str) -> str:
+        return os.path.join(self.__directory, "runs", f"{name}.json")
+
+    def __evict(self):
+        """
+        Remove the least recently used entries until the cache is within max_size_bytes.
+        """
+        entries = []
+        total_size = 0
+        for dir_path, _, file_names in os.walk(
+            os.path.join(self.__directory, "results")
+        ):
+            for file_name in file_names:
+                if not file_name.endswith(".json"):
+                    continue
+                path = os.path.join(dir_path, file_name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue  # removed by another writer
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total_size += stat.st_size
+
+        if total_size <= self.__max_size_bytes:
+            return
+
+        for _, size, path in sorted(entries):
+            if total_size <= self.__max_size_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
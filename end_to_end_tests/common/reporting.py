@@ -0,0 +1,133 @@
+import logging
+import os
+from datetime import datetime, timedelta
+
+from .config import (
+    analytics_backend,
+    app_insights_name,
+    export_gateway_logs,
+    local_analytics_db,
+    log_analytics_workspace_id,
+    log_analytics_workspace_name,
+    query_cache_dir,
+    query_parallelism,
+    resource_group_name,
+    results_export_dir,
+    results_export_format,
+    subscription_id,
+    tenant_id,
+)
+from .export import ResultExporter
+from .local_analytics import LocalAnalyticsClient
+from .log_analytics import QueryProcessor
+from .query_cache import QueryCache
+from .transport import get_default_credential
+
+
+def get_query_cache() -> QueryCache | None:
+    """
+    Get the cache for report query results (or None if caching is disabled)
+    """
+    if not query_cache_dir:
+        return None
+    return QueryCache(query_cache_dir)
+
+
+def create_result_exporter(
+    scenario_file: str, test_start_time: datetime
+) -> ResultExporter | None:
+    """
+    Create an exporter that writes the results for a test run to a directory under RESULTS_EXPORT_DIR
+    (or None if exporting is disabled)
+    """
+    if not results_export_dir:
+        return None
+    run_directory = os.path.join(
+        results_export_dir,
+        f"{get_scenario_name(scenario_file)}-{test_start_time.strftime('%Y%m%dT%H%M%SZ')}",
+    )
+    return ResultExporter(run_directory, results_export_format)
+
+
+def create_query_processor(
+    cache_only: bool = False,
+    workspace_id: str | None = None,
+    exporter: ResultExporter | None = None,
+) -> QueryProcessor:
+    """
+    Create a QueryProcessor for the scenario reports using the Log Analytics settings from the environment,
+    or the local analytics database if ANALYTICS_BACKEND is "local".
+
+    Parameters:
+        cache_only (bool): If true then results are only read from the query cache (no Azure credentials are needed)
+        workspace_id (str): Workspace ID (defaults to LOG_ANALYTICS_WORKSPACE_ID)
+        exporter (ResultExporter): If set then each query result is also exported (see create_result_exporter)
+    """
+    if analytics_backend == "local" and not cache_only:
+        # local results are queried straight from the database, so they aren't cached
+        return QueryProcessor(
+            workspace_id=local_analytics_db,
+            token_credential=None,
+            logs_query_client=LocalAnalyticsClient(local_analytics_db),
+            exporter=exporter,
+        )
+    return QueryProcessor(
+        workspace_id=workspace_id or log_analytics_workspace_id,
+        token_credential=None if cache_only else get_default_credential(),
+        tenant_id=tenant_id,
+        subscription_id=subscription_id,
+        resource_group_name=resource_group_name,
+        workspace_name=log_analytics_workspace_name,
+        app_insights_name=app_insights_name,
+        cache=get_query_cache(),
+        cache_only=cache_only,
+        exporter=exporter,
+    )
+
+
+def get_scenario_name(scenario_file: str) -> str:
+    return os.path.splitext(os.path.basename(scenario_file))[0]
+
+
+def save_test_run(
+    scenario_file: str, test_start_time: datetime, test_stop_time: datetime
+):
+    """
+    Record the time range of a test run so that report_only.py can re-render its results from the query cache
+    """
+    query_cache = get_query_cache()
+    if query_cache:
+        query_cache.save_run(
+            get_scenario_name(scenario_file),
+            log_analytics_workspace_id,
+            test_start_time,
+            test_stop_time,
+        )
+
+
+def export_raw_gateway_logs(
+    query_processor: QueryProcessor, test_start_time: datetime, test_stop_time: datetime
+):
+    """
+    Export the raw ApiManagementGatewayLogs rows for a test run if EXPORT_GATEWAY_LOGS is set.
+    The logs are pulled in 5 minute windows and each window is written as it is received.
+    """
+    if not export_gateway_logs:
+        return
+    if not results_export_dir:
+        logging.warning("EXPORT_GATEWAY_LOGS requires RESULTS_EXPORT_DIR to be set")
+        return
+
+    logging.info("Exporting gateway logs...")
+    path, error_message = query_processor.export_query(
+        "gateway-logs",
+        "ApiManagementGatewayLogs\n| order by TimeGenerated asc",
+        timespan=(test_start_time, test_stop_time),
+        time_slice=timedelta(minutes=5),
+        parallelism=query_parallelism,
+        local_query="SELECT * FROM ApiManagementGatewayLogs WHERE TimeGenerated >= :start AND TimeGenerated < :end ORDER BY TimeGenerated",
+    )
+    if error_message:
+        logging.warning("Failed to export gateway logs: %s", error_message)
+    else:
+        logging.info("Exported gateway logs to %s", path)
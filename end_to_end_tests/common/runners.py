@@ -0,0 +1,35 @@
+from functools import wraps
+
+from locust.env import Environment
+from locust.runners import WorkerRunner
+
+
+def is_worker(environment: Environment) -> bool:
+    """
+    Returns true if this process is a worker in a distributed (master/worker) run
+    """
+    return isinstance(environment.runner, WorkerRunner)
+
+
+def master_only(listener):
+    """
+    Decorator for event listeners that should run once per test rather than in every process,
+    i.e. on the master in a distributed run (or in the only process in a single-process run).
+
+    test_start and test_stop fire on the master and on each worker, so setup (e.g. setting the simulator latencies)
+    and reporting (e.g. querying Log Analytics) listeners are skipped on the workers.
+
+    Example:
+        @events.test_start.add_listener
+        @master_only
+        def on_test_start(environment, **kwargs):
+            ...
+    """
+
+    @wraps(listener)
+    def wrapper(environment: Environment, **kwargs):
+        if is_worker(environment):
+            return None
+        return listener(environment, **kwargs)
+
+    return wrapper
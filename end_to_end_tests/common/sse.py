@@ -0,0 +1,28 @@
+class SSEParser:
+    """
+    Parses a server-sent events stream incrementally, as chunks of it arrive, into the data of each event
+    """
+
+    def __init__(self) -> None:
+        self.__buffer = b""
+        self.__data = []
+
+    def feed(self, chunk: bytes) -> list[bytes]:
+        """
+        Parse a chunk of the stream and return the data of the events that it completes
+        """
+        lines = (self.__buffer + chunk).split(b"\n")
+        # keep the incomplete last line for the next chunk
+        self.__buffer = lines.pop()
+        events = []
+        for line in lines:
+            line = line.rstrip(b"\r")
+            if not line:
+                if self.__data:
+                    events.append(b"\n".join(self.__data))
+                    self.__data = []
+            elif line.startswith(b"data:"):
+                data = line[5:]
+                self.__data.append(data[1:] if data.startswith(b" ") else data)
+            # the other fields (event, id and retry) and comments aren't used by the OpenAI API
+        return events
@@ -0,0 +1,145 @@
+import json
+import time
+from typing import NamedTuple
+
+from locust.contrib.fasthttp import FastResponse
+from opentelemetry import metrics
+
+from .sse import SSEParser
+from .users import JSON_HEADERS
+
+# "request types" for the streaming measurements in the Locust statistics
+# (the response times columns show the measurement, in milliseconds or tokens per second)
+TIME_TO_FIRST_TOKEN_REQUEST_TYPE = "TTFT"
+INTER_TOKEN_LATENCY_REQUEST_TYPE = "ITL"
+TOKENS_PER_SECOND_REQUEST_TYPE = "TOKENS/S"
+STREAM_REQUEST_TYPE = "STREAM"
+
+STREAM_HEADERS = {**JSON_HEADERS, "Accept": "text/event-stream"}
+
+_meter = metrics.get_meter(__name__)
+time_to_first_token = _meter.create_histogram(
+    "locust.stream.time_to_first_token", "Time to first token", "s"
+)
+inter_token_latency = _meter.create_histogram(
+    "locust.stream.inter_token_latency", "Time between tokens", "s"
+)
+tokens_per_second = _meter.create_histogram(
+    "locust.stream.tokens_per_second",
+    "Tokens per second after the first token",
+    "tokens/s",
+)
+
+
+class StreamIncomplete(Exception):
+    pass
+
+
+class StreamResult(NamedTuple):
+    response: object
+    # seconds from sending the request to receiving the first token (None if no tokens were received)
+    time_to_first_token: float | None
+    token_count: int
+    # True if the stream ended with the [DONE] event
+    completed: bool
+
+
+def post_json_stream(
+    client, url: str, body: bytes, headers: dict | None = None, name: str = None
+) -> StreamResult:
+    """
+    POST a body from encode_json for a streamed completion (with "stream": true) with either client backend,
+    and read the server-sent events as they arrive without buffering the response.
+
+    The client records the request in the Locust statistics as usual, with the time to the response headers.
+    The time to first token, the time between each pair of tokens and the tokens per second after the first token
+    are also recorded in the Locust statistics (as TTFT, ITL and TOKENS/S requests) and OpenTelemetry histograms.
+    Each event with completion text counts as a token.
+
+    Parameters:
+        client (HttpSession | FastHttpSession): The user's client
+        url (str): URL to POST to
+        body (bytes): Request body
+        headers (dict): Headers to add to STREAM_HEADERS
+        name (str): Name for the request in the Locust statistics and the histograms (defaults to the URL)
+    """
+    headers = {**STREAM_HEADERS, **(headers or {})}
+    name = name or url
+    stats = client.user.environment.stats
+
+    start_time = time.perf_counter()
+    response = client.post(url, data=body, headers=headers, stream=True, name=name)
+    if response.status_code != 200:
+        # read the error so that the connection can be re-used
+        response.content
+        return StreamResult(response, None, 0, False)
+
+    parser = SSEParser()
+    first_token_time = None
+    last_token_time = None
+    token_count = 0
+    completed = False
+    for chunk in _iter_chunks(response):
+        for data in parser.feed(chunk):
+            if data == b"[DONE]":
+                completed = True
+                continue
+            if not _has_token(json.loads(data)):
+                continue
+
+            now = time.perf_counter()
+            if first_token_time is None:
+                first_token_time = now
+                stats.log_request(
+                    TIME_TO_FIRST_TOKEN_REQUEST_TYPE,
+                    name,
+                    (now - start_time) * 1000,
+                    0,
+                )
+                time_to_first_token.record(now - start_time, {"name": name})
+            else:
+                stats.log_request(
+                    INTER_TOKEN_LATENCY_REQUEST_TYPE,
+                    name,
+                    (now - last_token_time) * 1000,
+                    0,
+                )
+                inter_token_latency.record(now - last_token_time, {"name": name})
+            last_token_time = now
+            token_count += 1
+
+    if token_count > 1 and last_token_time > first_token_time:
+        rate = (token_count - 1) / (last_token_time - first_token_time)
+        stats.log_request(TOKENS_PER_SECOND_REQUEST_TYPE, name, rate, 0)
+        tokens_per_second.record(rate, {"name": name})
+    if not completed:
+        stats.log_error(
+            STREAM_REQUEST_TYPE,
+            name,
+            StreamIncomplete("Stream ended without [DONE]"),
+        )
+    return StreamResult(
+        response,
+        None if first_token_time is None else first_token_time - start_time,
+        token_count,
+        completed,
+    )
+
+
+def _iter_chunks(response):
+    if isinstance(response, FastResponse):
+        # geventhttpclient's read blocks until the whole length is read, so read an event line at a time
+        stream = response.stream
+        while line := stream.readline(b"\n"):
+            yield line
+    else:
+        # yields each chunk as it arrives
+        yield from response.iter_content(chunk_size=None)
+
+
+def _has_token(event: dict) -> bool:
+    for choice in event.get("choices", []):
+        # chat completions have a delta, completions have text
+        if choice.get("delta", {}).get("content") or choice.get("text"):
+            return True
+    return False
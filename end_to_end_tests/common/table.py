@@ -0,0 +1,203 @@
+from array import array
+from dataclasses import dataclass
+from typing import Any, Iterable, Sequence
+
+
+@dataclass
+class GroupDefinition:
+    id_column: str
+    group_column: str
+    value_column: str
+    missing_value: Any = None
+
+
+def _compact_column(values: Sequence[Any], promote_to_float: bool = False):
+    """
+    Store a column as a typed array if all values are ints or all values are floats.
+    Columns with other types (datetimes, strings, None etc) are stored as a list.
+
+    If promote_to_float is true, columns with a mix of ints and floats are stored as floats.
+    """
+    value_types = set(map(type, values))
+    if value_types == {int}:
+        try:
+            return array("q", values)
+        except OverflowError:
+            return list(values)
+    if value_types == {float} or (promote_to_float and value_types == {int, float}):
+        return array("d", values)
+    return list(values)
+
+
+class Table:
+    """
+    A query result table.
+
+    Values are stored by column (numeric columns as typed arrays) to keep long results compact
+    and to allow a column of values to be retrieved without walking every row.
+    """
+
+    def __init__(
+        self,
+        columns: list[str],
+        rows: list[list[Any]],
+        column_types: list[str] | None = None,
+    ) -> None:
+        """
+        Constructor
+
+        Parameters:
+            columns (list(str)): Column names
+            rows (list(list)): Row values, each row has a value for each column
+            column_types (list(str)): Kusto type of each column (e.g. "datetime", "long", "string") if known
+        """
+        column_values = [[] for _ in columns]
+        for row in rows:
+            for values, value in zip(column_values, row):
+                values.append(value)
+        self.__set_columns(
+            columns,
+            [_compact_column(values) for values in column_values],
+            column_types,
+        )
+
+    @classmethod
+    def from_columns(
+        cls,
+        columns: list[str],
+        column_values: list[Sequence[Any]],
+        column_types: list[str] | None = None,
+    ) -> "Table":
+        """
+        Create a Table from a sequence of values for each column.
+        """
+        table = cls.__new__(cls)
+        table.__set_columns(columns, column_values, column_types)
+        return table
+
+    @classmethod
+    def concat(cls, tables: Iterable["Table"]) -> "Table":
+        """
+        Create a Table with the rows of each table in turn. The tables must all have the same columns.
+
+        tables can be a generator, each table is appended as it is produced.
+        """
+        columns = None
+        column_types = None
+        column_values = []
+        for table in tables:
+            if columns is None:
+                columns = table.columns
+                column_types = table.column_types
+                column_values = [[] for _ in columns]
+            elif table.columns != columns:
+                raise ValueError(
+                    f"Cannot concatenate tables with different columns: {','.join(columns)} and {','.join(table.columns)}"
+                )
+            for values, column in zip(column_values, columns):
+                values.extend(table.column(column))
+        if columns is None:
+            raise ValueError("No tables to concatenate")
+        return cls.from_columns(
+            columns,
+            [_compact_column(values) for values in column_values],
+            column_types,
+        )
+
+    def __set_columns(
+        self,
+        columns: list[str],
+        column_values: list[Sequence[Any]],
+        column_types: list[str] | None,
+    ):
+        self.__columns = list(columns)
+        self.__column_types = list(column_types) if column_types else None
+        self.__column_values = column_values
+        self.__column_indexes = {column: index for index, column in enumerate(columns)}
+        self.__rows = None
+
+    @property
+    def columns(self) -> list[str]:
+        return self.__columns
+
+    @property
+    def column_types(self) -> list[str] | None:
+        return self.__column_types
+
+    @property
+    def rows(self) -> list[list[Any]]:
+        if self.__rows is None:
+            self.__rows = [list(row) for row in zip(*self.__column_values)]
+        return self.__rows
+
+    def __len__(self) -> int:
+        return len(self.__column_values[0]) if self.__column_values else 0
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Table):
+            return NotImplemented
+        return self.columns == other.columns and self.rows == other.rows
+
+    def __repr__(self) -> str:
+        return f"Table(columns={self.columns!r}, rows={self.rows!r})"
+
+    def column(self, column: str) -> Sequence[Any]:
+        """
+        Get the values for a column.
+        """
+        try:
+            return self.__column_values[self.__column_indexes[column]]
+        except KeyError:
+            raise ValueError(
+                f"Column '{column}' not found in table columns: "
+                + ",".join(self.columns)
+            )
+
+    def group_by(
+        self,
+        id_column: str,
+        group_column: str,
+        value_column: str,
+        missing_value: Any = None,
+    ) -> "Table":
+        """
+        Produce a new table where each row has the id_column and a column for each distinct value
+        in group_column with the value of value_column (or missing_value if there isn't a value for that group).
+
+        The rows don't need to be sorted on id_column, the output rows are sorted by id_column.
+        """
+        ids = self.column(id_column)
+        groups = self.column(group_column)
+        values = self.column(value_column)
+
+        distinct_group_column_values = sorted(set(groups))
+        group_indexes = {
+            group: index for index, group in enumerate(distinct_group_column_values)
+        }
+
+        # map each id to its output row
+        id_values = list(dict.fromkeys(ids))
+        try:
+            id_values = sorted(id_values)
+        except TypeError:
+            pass  # ids aren't comparable, keep them in the order they were seen
+        row_indexes = {id_value: index for index, id_value in enumerate(id_values)}
+
+        group_values = [
+            [missing_value] * len(id_values) for _ in distinct_group_column_values
+        ]
+        for id_value, group, value in zip(ids, groups, values):
+            group_values[group_indexes[group]][row_indexes[id_value]] = value
+
+        new_columns = [id_column] + [
+            f"{value_column}_{name}" for name in distinct_group_column_values
+        ]
+        promote_to_float = isinstance(missing_value, float)
+        return Table.from_columns(
+            new_columns,
+            [_compact_column(id_values)]
+            + [
+                _compact_column(values, promote_to_float=promote_to_float)
+                for values in group_values
+            ],
+        )
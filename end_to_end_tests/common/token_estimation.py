@@ -0,0 +1,88 @@
+import math
+
+# tokens counted by the prioritization policies for completions and chat requests that don't set max_tokens
+DEFAULT_MAX_TOKENS = 16
+# tokens that frame each chat message (its role and delimiters), and the assistant header that primes the reply
+CHAT_MESSAGE_TOKENS = 4
+CHAT_REPLY_TOKENS = 3
+
+
+def estimate_tokens(text: str) -> int:
+    # roughly 4 characters per token for English text
+    return max(len(text) // 4, 1)
+
+
+def estimate_prompt_tokens(body: dict) -> int:
+    """
+    Estimate the prompt tokens of a request body like the consumed-tokens variable in prioritization-token-calculating.xml:
+    4 ASCII characters per token and a token for each other character of the embeddings input, completions prompt
+    or chat message content (token IDs in the input or prompt count as one token each),
+    plus the tokens that frame each chat message and the reply
+    """
+    texts = []
+    tokens = 0
+    prompt = body["input"] if "input" in body else body.get("prompt")
+    if prompt is not None:
+        for item in prompt if isinstance(prompt, list) else [prompt]:
+            if isinstance(item, str):
+                texts.append(item)
+            elif isinstance(item, int):
+                tokens += 1
+            elif isinstance(item, list):
+                tokens += len(item)
+
+    messages = body.get("messages")
+    if isinstance(messages, list):
+        for message in messages:
+            tokens += CHAT_MESSAGE_TOKENS
+            content = message.get("content") if isinstance(message, dict) else None
+            if isinstance(content, str):
+                texts.append(content)
+            elif isinstance(content, list):
+                # only text parts are estimated (not e.g. image parts)
+                texts += [
+                    part["text"]
+                    for part in content
+                    if isinstance(part, dict) and isinstance(part.get("text"), str)
+                ]
+        tokens += CHAT_REPLY_TOKENS
+
+    ascii_characters = 0
+    for text in texts:
+        text_ascii_characters = len(text.encode("ascii", "ignore"))
+        ascii_characters += text_ascii_characters
+        # the policy counts C# chars, which are UTF-16 code units
+        tokens += (
+            len(text.encode("utf-16-le", "surrogatepass")) // 2 - text_ascii_characters
+        )
+    return tokens + math.ceil(ascii_characters * 0.25)
+
+
+def estimate_policy_tokens(operation: str, body: dict) -> int:
+    """
+    Estimate the tokens that the gateway counts against a deployment's tokens-per-minute limit for a request,
+    using the same heuristics as the consumed-tokens variable in prioritization-token-calculating.xml:
+    the prompt tokens (see estimate_prompt_tokens) plus, for completions and chat, max_tokens for each of the best_of (or n) choices
+
+    Parameters:
+        operation (str): "completions", "chat" or "embeddings"
+        body (dict): Request body
+    """
+    prompt_tokens = estimate_prompt_tokens(body)
+    if operation == "embeddings" or body.get("model") == "embedding":
+        return prompt_tokens
+    max_tokens = _first_value(body, "max_completion_tokens", "max_tokens")
+    if max_tokens is None:
+        max_tokens = DEFAULT_MAX_TOKENS
+    choices = _first_value(body, "best_of", "n")
+    if choices is None:
+        choices = 1
+    return prompt_tokens + max_tokens * choices
+
+
+def _first_value(body: dict, *names: str):
+    # like chaining Value<int?>(name) with ?? in the policy expression, which skips missing and null values
+    for name in names:
+        if body.get(name) is not None:
+            return body[name]
+    return None
@@ -0,0 +1,146 @@
+import threading
+import time
+from dataclasses import dataclass
+
+import requests
+from azure.core.credentials import AccessToken, TokenCredential
+from requests.adapters import HTTPAdapter
+
+# refresh access tokens this long before they expire so that a token doesn't expire mid-request
+TOKEN_REFRESH_MARGIN_SECONDS = 300
+
+_default_credential = None
+_default_credential_lock = threading.Lock()
+_shared_transports = {}
+_shared_transports_lock = threading.Lock()
+
+
+def get_default_credential() -> TokenCredential:
+    """
+    Get a DefaultAzureCredential shared by the whole process (created on first use)
+    """
+    global _default_credential
+    with _default_credential_lock:
+        if _default_credential is None:
+            # imported here so that scenarios that never query Azure don't pay for the import
+            from azure.identity import DefaultAzureCredential
+
+            _default_credential = DefaultAzureCredential()
+        return _default_credential
+
+
+@dataclass
+class TransportStats:
+    requests: int = 0
+    connections_opened: int = 0
+    token_requests: int = 0
+    token_cache_hits: int = 0
+
+    @property
+    def network_calls_saved(self) -> int:
+        """
+        Number of connections and token requests avoided compared to connecting and getting a token for each request
+        """
+        return (self.requests - self.connections_opened) + self.token_cache_hits
+
+
+class HttpTransport:
+    """
+    A shared HTTP transport for calling Azure APIs.
+
+    Requests are sent over a pooled, keep-alive requests.Session (gzip responses are decoded by requests)
+    and the access token is cached until it is close to expiry rather than being requested for each call.
+    Safe to use from multiple threads.
+    """
+
+    def __init__(
+        self,
+        token_credential: TokenCredential | None,
+        scope: str,
+        pool_size: int = 10,
+        token_refresh_margin_seconds: float = TOKEN_REFRESH_MARGIN_SECONDS,
+    ) -> None:
+        """
+        Constructor
+
+        Parameters:
+            token_credential (TokenCredential): Credential to get access tokens from (defaults to the process-wide DefaultAzureCredential)
+            scope (str): Scope to request access tokens for
+            pool_size (int): Maximum number of connections to keep open (should be at least the number of threads using the transport)
+            token_refresh_margin_seconds (float): How long before expiry to refresh the access token
+        """
+        self.__token_credential = token_credential
+        self.__scope = scope
+        self.__token_refresh_margin_seconds = token_refresh_margin_seconds
+        self.__access_token: AccessToken | None = None
+        self.__lock = threading.Lock()
+        self.__stats = TransportStats()
+
+        self.__session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.__session.mount("https://", adapter)
+        self.__session.mount("http://", adapter)
+        self.__session.headers["Accept-Encoding"] = "gzip"
+
+    @property
+    def stats(self) -> TransportStats:
+        """
+        Get a snapshot of the request, connection and token counts
+        """
+        with self.__lock:
+            return TransportStats(
+                requests=self.__stats.requests,
+                connections_opened=self.__count_connections_opened(),
+                token_requests=self.__stats.token_requests,
+                token_cache_hits=self.__stats.token_cache_hits,
+            )
+
+    def post_json(self, url: str, json, params=None) -> requests.Response:
+        """
+        POST a JSON body to url with the bearer token for the transport's scope
+        """
+        headers = {"Authorization": f"Bearer {self.__get_token()}"}
+        response = self.__session.post(url, params=params, json=json, headers=headers)
+        with self.__lock:
+            self.__stats.requests += 1
+        return response
+
+    def close(self):
+        self.__session.close()
+
+    def __get_token(self) -> str:
+        with self.__lock:
+            if (
+                self.__access_token is not None
+                and self.__access_token.expires_on - time.time()
+                > self.__token_refresh_margin_seconds
+            ):
+                self.__stats.token_cache_hits += 1
+                return self.__access_token.token
+
+            token_credential = self.__token_credential or get_default_credential()
+            self.__access_token = token_credential.get_token(self.__scope)
+            self.__stats.token_requests += 1
+            return self.__access_token.token
+
+    def __count_connections_opened(self) -> int:
+        connections_opened = 0
+        for adapter in set(self.__session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    connections_opened += pool.num_connections
+        return connections_opened
+
+
+def get_shared_transport(scope: str) -> HttpTransport:
+    """
+    Get an HttpTransport for scope using the process-wide DefaultAzureCredential, shared by the whole process
+    """
+    with _shared_transports_lock:
+        transport = _shared_transports.get(scope)
+        if transport is None:
+            transport = HttpTransport(token_credential=None, scope=scope)
+            _shared_transports[scope] = transport
+        return transport
@@ -0,0 +1,69 @@
+import json
+from http import HTTPStatus
+
+from locust import FastHttpUser, HttpUser
+
+from .config import http_client
+
+# HTTP client backends for the scenario users:
+#  - requests: locust.HttpUser (python-requests)
+#  - fast: locust.FastHttpUser (geventhttpclient), several times the requests per second per core
+HTTP_CLIENTS = {
+    "requests": HttpUser,
+    "fast": FastHttpUser,
+}
+
+# Headers for posting pre-encoded JSON bodies.
+# The scenarios don't read the response bodies, so ask for them uncompressed to avoid decompressing them
+JSON_HEADERS = {
+    "Content-Type": "application/json",
+    "Accept-Encoding": "identity",
+}
+
+
+def get_http_user_class(name: str) -> type[HttpUser] | type[FastHttpUser]:
+    """
+    Get the Locust user class for an HTTP client backend name (see HTTP_CLIENTS)
+    """
+    user_class = HTTP_CLIENTS.get(name)
+    if user_class is None:
+        raise ValueError(
+            f"Unsupported HTTP client '{name}', expected one of: {','.join(HTTP_CLIENTS)}"
+        )
+    return user_class
+
+
+# Base class for the scenario users, set by the HTTP_CLIENT environment variable
+ScenarioHttpUser = get_http_user_class(http_client)
+
+
+def encode_json(payload) -> bytes:
+    """
+    Encode a request payload once so that it isn't re-encoded by the client for every request
+    """
+    return json.dumps(payload).encode("utf-8")
+
+
+def post_json(client, url: str, body: bytes, headers: dict | None = None, **kwargs):
+    """
+    POST a body from encode_json with either client backend.
+
+    The response body is read (so that the connection can be re-used) but never decoded.
+    """
+    # copied as the clients can add headers to the dictionary they are passed
+    headers = {**JSON_HEADERS, **(headers or {})}
+    return client.post(url, data=body, headers=headers, **kwargs)
+
+
+def get_reason(response) -> str:
+    """
+    Get the reason phrase for a response from either client backend
+    (FastHttpUser responses don't have a reason attribute)
+    """
+    reason = getattr(response, "reason", None)
+    if reason:
+        return reason
+    try:
+        return HTTPStatus(response.status_code).phrase
+    except ValueError:
+        return ""
@@ -0,0 +1,95 @@
+import math
+
+# replays the backend selection in capabilities/latency-routing/latency-routing-inbound.xml and latency-routing-backend.xml
+# (keep them in sync)
+
+DEFAULT_BACKEND_ID = "payg-backend-1"
+
+
+def latency_weights(latencies: list[float], exponent: float = 2) -> list[float]:
+    """
+    Weights to spread traffic across backends by their measured latencies:
+    each backend's weight is proportional to (fastest latency / its latency) ** exponent,
+    so 1 spreads the traffic in proportion to speed and higher exponents favour the faster backends more.
+    Failed backends (infinite latency) get no weight. The weights are normalized to sum to 1.
+
+    Parameters:
+        latencies (list[float]): Measured latency of each backend
+        exponent (float): How strongly to favour the faster backends
+    """
+    measured = [latency for latency in latencies if not math.isinf(latency)]
+    if not measured:
+        # nothing to go on, so spread the traffic evenly
+        return [round(1 / len(latencies), 3) for _ in latencies]
+
+    fastest = max(min(measured), 1e-9)
+    weights = [
+        0 if math.isinf(latency) else (fastest / max(latency, 1e-9)) ** exponent
+        for latency in latencies
+    ]
+    total = sum(weights)
+    return [round(weight / total, 3) for weight in weights]
+
+
+def weighted_preferred_backends(
+    backend_ids: list[str], weights: list[float] | None
+) -> list:
+    """
+    The preferredBackends value for the set-preferred-backends helper API:
+    the backend IDs in ranked order, with their weights if given
+    """
+    if weights is None:
+        return list(backend_ids)
+    return [
+        {"backendId": backend_id, "weight": weight}
+        for backend_id, weight in zip(backend_ids, weights)
+    ]
+
+
+def select_backend_order(preferred_backends: list, point: float) -> list[str]:
+    """
+    The order to try the backends in for a request, as the latency-routing-inbound fragment picks it:
+    a backend picked in proportion to the weights (the first backend if there are no weights),
+    followed by the remaining backends in ranked order
+
+    Parameters:
+        preferred_backends (list): The preferredBackends value passed to set-preferred-backends
+        point (float): Random number in [0, 1) (the policy's Random.NextDouble)
+    """
+    backend_ids = []
+    weights = []
+    for backend in preferred_backends:
+        if isinstance(backend, dict):
+            backend_ids.append(backend["backendId"])
+            weights.append(max(0, backend.get("weight") or 0))
+        else:
+            backend_ids.append(backend)
+            weights.append(0)
+    if not backend_ids:
+        return []
+
+    selected = 0
+    total_weight = sum(weights)
+    if total_weight > 0:
+        point *= total_weight
+        while selected < len(backend_ids) - 1 and point >= weights[selected]:
+            point -= weights[selected]
+            selected += 1
+
+    return [backend_ids[selected]] + [
+        backend_id for index, backend_id in enumerate(backend_ids) if index != selected
+    ]
+
+
+def select_backend(order: list[str], attempt: int) -> str:
+    """
+    The backend to send an attempt to, as the latency-routing-backend fragment picks it:
+    the next backend in the order on each retry, staying on the last one
+
+    Parameters:
+        order (list[str]): Order from select_backend_order
+        attempt (int): 0 for the first attempt, 1 for the first retry, etc.
+    """
+    if not order:
+        return DEFAULT_BACKEND_ID
+    return order[min(attempt, len(order) - 1)]
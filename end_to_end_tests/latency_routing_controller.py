@@ -0,0 +1,94 @@
+"""
+Run the latency routing controller as a long-running service: probe the backends on an interval
+and update the preferred backends in APIM when the ranking changes (see common/latency_controller.py).
+
+The backends and probe settings are taken from the LATENCY_PROBE_* environment variables, the smoothing and hysteresis
+from the LATENCY_CONTROLLER_* environment variables, and APIM from APIM_ENDPOINT and APIM_SUBSCRIPTION_ONE_KEY.
+The controller's state is served as JSON on the status port for inspection.
+
+Usage:
+    python end_to_end_tests/latency_routing_controller.py --interval 60 --status-port 8090
+    curl http://127.0.0.1:8090/
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import signal
+import sys
+
+from common.latency_controller import (
+    LatencyRoutingController,
+    create_latency_routing_controller,
+)
+from common.latency_probe import create_latency_probe
+
+
+async def serve_state(
+    controller: LatencyRoutingController,
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+):
+    # the state is the only resource, so the request line and headers are read and ignored
+    while (await reader.readline()).strip():
+        pass
+    body = json.dumps(controller.state.to_dict(), indent=2).encode("utf-8")
+    writer.write(
+        b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+        + b"Content-Length: %d\r\nConnection: close\r\n\r\n" % len(body)
+        + body
+    )
+    await writer.drain()
+    writer.close()
+
+
+async def run(args):
+    controller = create_latency_routing_controller(
+        create_latency_probe(args.deployment)
+    )
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signal_number, stop.set)
+
+    server = await asyncio.start_server(
+        lambda reader, writer: serve_state(controller, reader, writer),
+        args.host,
+        args.status_port,
+    )
+    host, port = server.sockets[0].getsockname()[:2]
+    logging.info("Serving the controller state on http://%s:%s/", host, port)
+    async with server:
+        await controller.run(args.interval, stop)
+    state = controller.state
+    logging.info(
+        "Stopped after %s probes and %s updates, preferred backends: %s",
+        state.probe_count,
+        state.update_count,
+        state.preferred_backends,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--interval", type=float, default=60, help="Seconds between probes"
+    )
+    parser.add_argument("--deployment", default="gpt-35-turbo-100k-token")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument(
+        "--status-port",
+        type=int,
+        default=8090,
+        help="Port to serve the controller state on (0 for a free port)",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    asyncio.run(run(args))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+import json
+import time
+from typing import Any
+
+from .http_server import LocalHttpServer
+
+
+class FakeAppInsightsServer(LocalHttpServer):
+    """
+    A local HTTP stand-in for the App Insights query API (POST /v1/apps/<app ID>/query)
+    so that app_insights.QueryProcessor can be run and benchmarked offline.
+
+    Like the real API, connections are kept alive (HTTP/1.1) and responses are gzipped when the client accepts gzip.
+    Results are registered against a fragment of query text and returned for any query containing that fragment
+    (the first matching registration wins). Queries that don't match a registration return a 400 response.
+
+    Example:
+        with FakeAppInsightsServer() as server:
+            server.add_result("requests", ["timestamp", "count"], rows)
+            query_processor = QueryProcessor(app_id="offline", token_credential=FakeTokenCredential(), endpoint=server.endpoint)
+    """
+
+    def __init__(self, latency_seconds: float = 0.0, port: int = 0) -> None:
+        """
+        Constructor
+
+        Parameters:
+            latency_seconds (float): Time to sleep for each request to simulate the query execution time
+            port (int): Port to listen on (defaults to a free port)
+        """
+        self.__latency_seconds = latency_seconds
+        self.__results = []
+        super().__init__(port=port)
+
+    @property
+    def endpoint(self) -> str:
+        return f"{self.base_url}/v1/apps"
+
+    def add_result(self, query_match: str, columns: list[str], rows: list[list[Any]]):
+        """
+        Registers a result for queries containing query_match
+        """
+        self.__results.append(
+            (
+                query_match,
+                {
+                    "tables": [
+                        {
+                            "name": "PrimaryResult",
+                            "columns": [
+                                {"name": column, "type": "dynamic"}
+                                for column in columns
+                            ],
+                            "rows": rows,
+                        }
+                    ]
+                },
+            )
+        )
+
+    def handle_request(self, method: str, path: str, headers, body: bytes):
+        if self.__latency_seconds > 0:
+            time.sleep(self.__latency_seconds)
+
+        if method != "POST" or not path.split("?")[0].endswith("/query"):
+            return 404, {"error": {"message": "Not found"}}
+        if not headers.get("Authorization", "").startswith("Bearer "):
+            return 401, {"error": {"message": "Missing token"}}
+
+        query = json.loads(body).get("query", "")
+        for query_match, result in self.__results:
+            if query_match in query:
+                return 200, result
+        return 400, {"error": {"message": "No fake result registered for query"}}
@@ -0,0 +1,368 @@
+import asyncio
+import json
+import socket
+import threading
+from collections import defaultdict, deque
+from collections.abc import AsyncIterator, Callable
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit
+
+from requests.structures import CaseInsensitiveDict
+
+# HTTP/1.1 over asyncio streams for the local stand-ins that need many concurrent connections
+# (the gateway emulator in local/gateway.py and the simulator in local/simulator.py):
+# a server base class, and a client that keeps connections to the backends alive between requests
+
+STATUS_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    429: "Too Many Requests",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+# pending connections to queue, so that thousands of clients can connect at once
+LISTEN_BACKLOG = 4096
+
+
+@dataclass
+class Response:
+    # 0 until a response has been received or set
+    status_code: int = 0
+    reason: str = ""
+    headers: CaseInsensitiveDict = field(default_factory=CaseInsensitiveDict)
+    body: bytes = b""
+    # chunks of a response that is streamed to the client rather than buffered (e.g. server-sent events)
+    stream: AsyncIterator[bytes] | None = None
+    # called to release the backend connection if a streamed response isn't sent to the client (e.g. when retrying)
+    close: Callable | None = None
+
+    async def discard(self):
+        if self.close is not None:
+            await self.close()
+            self.close = None
+
+
+def json_response(status_code: int, body, headers: dict | None = None) -> Response:
+    return Response(
+        status_code=status_code,
+        headers=CaseInsensitiveDict(
+            {"Content-Type": "application/json", **(headers or {})}
+        ),
+        body=json.dumps(body).encode("utf-8"),
+    )
+
+
+async def read_headers(reader: asyncio.StreamReader) -> CaseInsensitiveDict:
+    """
+    Read header lines up to the blank line that ends the head of a request or response
+    """
+    headers = CaseInsensitiveDict()
+    while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip()] = value.strip()
+    return headers
+
+
+class AsyncHttpServer:
+    """
+    Base class for the local HTTP stand-ins that serve requests on an asyncio event loop,
+    so that one thread can keep thousands of connections open (with HTTP/1.1 keep-alive).
+
+    Counts connections and requests. Subclasses implement handle_request to return the Response for each request,
+    which is sent with chunked transfer encoding as it is generated if it has a stream.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        """
+        Constructor
+
+        Parameters:
+            host (str): Address to listen on
+            port (int): Port to listen on (defaults to a free port)
+        """
+        self.request_count = 0
+        self.connection_count = 0
+        self.__socket = socket.create_server((host, port), backlog=LISTEN_BACKLOG)
+        self.__loop = None
+        self.__thread = None
+        self.__stopped = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.__socket.getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    async def handle_request(
+        self, method: str, target: str, headers: CaseInsensitiveDict, body: bytes
+    ) -> Response:
+        raise NotImplementedError()
+
+    async def startup(self):
+        """
+        Called on the event loop before serving (e.g. to create clients that belong to the loop)
+        """
+
+    async def shutdown(self):
+        """
+        Called on the event loop after serving
+        """
+
+    def start(self):
+        """
+        Serve on a background thread
+        """
+        started = threading.Event()
+        self.__thread = threading.Thread(
+            target=self.serve_forever, args=(started,), daemon=True
+        )
+        self.__thread.start()
+        started.wait()
+
+    def serve_forever(self, started: threading.Event | None = None):
+        asyncio.run(self.__serve(started))
+
+    def stop(self):
+        if self.__loop is not None:
+            self.__loop.call_soon_threadsafe(self.__stopped.set)
+        if self.__thread:
+            self.__thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    async def __serve(self, started: threading.Event | None):
+        self.__loop = asyncio.get_running_loop()
+        self.__stopped = asyncio.Event()
+        await self.startup()
+        try:
+            server = await asyncio.start_server(
+                self.__handle_connection, sock=self.__socket
+            )
+            async with server:
+                if started is not None:
+                    started.set()
+                await self.__stopped.wait()
+        finally:
+            await self.shutdown()
+
+    async def __handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        self.connection_count += 1
+        try:
+            while request_line := await reader.readline():
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = await read_headers(reader)
+                body = await reader.readexactly(int(headers.get("Content-Length", 0)))
+                self.request_count += 1
+
+                response = await self.handle_request(method, target, headers, body)
+                await self.__write_response(writer, response)
+                if headers.get("Connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass  # clients closing kept-alive connections (e.g. when a load test stops) aren't errors
+        except asyncio.CancelledError:
+            pass  # the server stopping with the connection open
+        finally:
+            writer.close()
+
+    async def __write_response(self, writer: asyncio.StreamWriter, response: Response):
+        reason = response.reason or STATUS_REASONS.get(response.status_code, "")
+        lines = [f"HTTP/1.1 {response.status_code} {reason}"]
+        lines += [f"{name}: {value}" for name, value in response.headers.items()]
+        if response.stream is None:
+            lines.append(f"Content-Length: {len(response.body)}")
+            writer.write(
+                "\r\n".join(lines).encode("latin-1") + b"\r\n\r\n" + response.body
+            )
+            await writer.drain()
+            return
+
+        lines.append("Transfer-Encoding: chunked")
+        writer.write("\r\n".join(lines).encode("latin-1") + b"\r\n\r\n")
+        try:
+            async for chunk in response.stream:
+                if chunk:
+                    writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                    await writer.drain()
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        finally:
+            await response.discard()
+
+
+class HttpResponse:
+    """
+    A backend response whose body is read from the connection as it is consumed.
+    The connection goes back to the client's pool once the body has been read,
+    and is closed if the response is closed before then.
+    """
+
+    def __init__(
+        self,
+        status_code: int,
+        reason: str,
+        headers: CaseInsensitiveDict,
+        reader: asyncio.StreamReader,
+        release,
+    ) -> None:
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.__reader = reader
+        self.__release = release
+        self.__released = False
+
+    async def aiter_bytes(self) -> AsyncIterator[bytes]:
+        reader = self.__reader
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            while size := int((await reader.readline()).split(b";")[0], 16):
+                yield await reader.readexactly(size)
+                await reader.readexactly(2)  # CRLF after the chunk
+            await read_headers(reader)  # trailers
+            keep_alive = True
+        elif "Content-Length" in self.headers:
+            remaining = int(self.headers["Content-Length"])
+            while remaining:
+                chunk = await reader.read(min(remaining, 65536))
+                if not chunk:
+                    raise asyncio.IncompleteReadError(b"", remaining)
+                remaining -= len(chunk)
+                yield chunk
+            keep_alive = True
+        else:
+            # the body ends when the backend closes the connection
+            while chunk := await reader.read(65536):
+                yield chunk
+            keep_alive = False
+        keep_alive = (
+            keep_alive and self.headers.get("Connection", "").lower() != "close"
+        )
+        self.__finish(keep_alive)
+
+    async def aread(self) -> bytes:
+        return b"".join([chunk async for chunk in self.aiter_bytes()])
+
+    async def aclose(self):
+        self.__finish(keep_alive=False)
+
+    def __finish(self, keep_alive: bool):
+        if not self.__released:
+            self.__released = True
+            self.__release(keep_alive)
+
+
+class HttpClient:
+    """
+    HTTP/1.1 client for the gateway emulator's requests to the backends.
+    Keeps idle connections to each backend to reuse (most recently used first)
+    and limits the number of requests in progress to max_connections, so that each has its own connection.
+    """
+
+    def __init__(self, max_connections: int = 1000) -> None:
+        """
+        Constructor
+
+        Parameters:
+            max_connections (int): Maximum connections to the backends
+        """
+        # (scheme, host, port) -> idle (reader, writer) pairs
+        self.__idle = defaultdict(deque)
+        self.__slots = asyncio.Semaphore(max_connections)
+
+    async def send(
+        self,
+        method: str,
+        url: str,
+        headers: dict[str, str],
+        body: bytes,
+        timeout: float,
+    ) -> HttpResponse:
+        """
+        Send a request and read the head of the response within timeout seconds.
+        The response must be read or closed to free its connection.
+        """
+        url = urlsplit(url)
+        origin = (
+            url.scheme,
+            url.hostname,
+            url.port or (443 if url.scheme == "https" else 80),
+        )
+        target = url.path + (f"?{url.query}" if url.query else "")
+        lines = [f"{method} {target} HTTP/1.1", f"Host: {url.netloc}"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        lines.append(f"Content-Length: {len(body)}")
+        request = "\r\n".join(lines).encode("latin-1") + b"\r\n\r\n" + body
+
+        await self.__slots.acquire()
+        writer = None
+        try:
+            async with asyncio.timeout(timeout):
+                reader, writer, status_line = await self.__exchange(origin, request)
+                headers = await read_headers(reader)
+        except BaseException:
+            if writer is not None:
+                writer.close()
+            self.__slots.release()
+            raise
+
+        _, status_code, *reason = status_line.decode("latin-1").split(" ", 2)
+
+        def release(keep_alive: bool):
+            if keep_alive:
+                self.__idle[origin].append((reader, writer))
+            else:
+                writer.close()
+            self.__slots.release()
+
+        return HttpResponse(
+            int(status_code),
+            reason[0].strip() if reason else "",
+            headers,
+            reader,
+            release,
+        )
+
+    async def aclose(self):
+        for connections in self.__idle.values():
+            for _, writer in connections:
+                writer.close()
+        self.__idle.clear()
+
+    async def __exchange(self, origin: tuple, request: bytes) -> tuple:
+        """
+        Write the request and read the status line, on an idle connection if there is one
+        """
+        while True:
+            reader, writer, reused = await self.__connect(origin)
+            try:
+                writer.write(request)
+                await writer.drain()
+                status_line = await reader.readline()
+                if not status_line:
+                    raise ConnectionResetError("The backend closed the connection")
+                return reader, writer, status_line
+            except ConnectionError:
+                writer.close()
+                # the backend may have closed an idle connection before it was reused, so retry on a new one
+                if not reused:
+                    raise
+
+    async def __connect(self, origin: tuple) -> tuple:
+        idle = self.__idle[origin]
+        while idle:
+            reader, writer = idle.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer, True
+            writer.close()
+        scheme, host, port = origin
+        reader, writer = await asyncio.open_connection(
+            host, port, ssl=scheme == "https"
+        )
+        return reader, writer, False
@@ -0,0 +1,531 @@
+"""
+A local APIM gateway emulator that runs the capability policies (capabilities/*/*.xml) so that policy changes
+can be tried with the Locust scenarios without deploying APIM: point APIM_ENDPOINT at the emulator
+and use the API path as the host path (e.g. http://127.0.0.1:8080/prioritization-token-calculating/).
+
+The APIs, policy fragments and backends (including the backend pools and the circuit breaker) mirror
+infra/apim-genai/modules/apiManagement.bicep. Policies are run by local/gateway_policy.py with the Python equivalents
+of their expressions in local/gateway_expressions.py. APIs whose policies use anything outside the supported subset
+(e.g. usage tracking, which emits token metrics and logs to Event Hub) are skipped with a warning.
+Subscription keys aren't checked, and metrics emitted by emit-metric are served as JSON on /++/metrics.
+With --analytics-db, the gateway logs and emitted metrics are also written to a local analytics database
+for the scenario reports to query (see common/local_analytics.py).
+
+Usage:
+    python -m local.gateway --port 8080
+    python -m local.gateway --port 8080 --ptu1 https://<simulator> --payg1 https://<simulator> --payg2 https://<simulator>
+    python -m local.gateway --port 8080 --analytics-db local-analytics.db
+"""
+
+import argparse
+import asyncio
+import logging
+import math
+import os
+import random
+import re
+import sys
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from requests.structures import CaseInsensitiveDict
+
+from common.local_analytics import LocalAnalyticsWriter
+
+from .async_http import AsyncHttpServer, HttpClient, json_response
+from .gateway_expressions import CAPABILITY_EXPRESSIONS
+from .gateway_policy import (
+    GatewayServices,
+    Policy,
+    PolicyCompiler,
+    PolicyContext,
+    PolicyError,
+    Request,
+    Response,
+    run_policy,
+)
+from .simulator import FakeSimulatorServer
+
+CAPABILITIES_ROOT = os.path.normpath(
+    os.path.join(os.path.dirname(__file__), "..", "..", "capabilities")
+)
+# API path -> policy file (relative to capabilities/)
+APIS = {
+    "round-robin-simple/openai": "load-balancing/simple-round-robin-policy.xml",
+    "round-robin-simple-v2/openai": "load-balancing-v2/simple-round-robin-policy.xml",
+    "round-robin-weighted/openai": "load-balancing/weighted-round-robin-policy.xml",
+    "round-robin-weighted-v2/openai": "load-balancing-v2/weighted-round-robin-policy.xml",
+    "retry-with-payg/openai": "manage-spikes-with-payg/retry-with-payg-policy.xml",
+    "retry-with-payg-v2/openai": "manage-spikes-with-payg-v2/retry-with-payg-policy.xml",
+    "latency-routing/openai": "latency-routing/latency-routing-policy.xml",
+    "usage-tracking/openai": "usage-tracking/usage-tracking-policy.xml",
+    "prioritization-token-calculating/openai": "prioritization/prioritization-token-calculating.xml",
+    "prioritization-token-tracking/openai": "prioritization/prioritization-token-tracking.xml",
+    "helpers": "latency-routing/set-latency-policy.xml",
+}
+# fragment ID -> policy file (relative to capabilities/)
+FRAGMENTS = {
+    "simple-round-robin": "load-balancing/simple-round-robin.xml",
+    "simple-round-robin-v2": "load-balancing-v2/simple-round-robin.xml",
+    "weighted-round-robin": "load-balancing/weighted-round-robin.xml",
+    "weighted-round-robin-v2": "load-balancing-v2/weighted-round-robin.xml",
+    "retry-with-payg": "manage-spikes-with-payg/retry-with-payg.xml",
+    "retry-with-payg-v2": "manage-spikes-with-payg-v2/retry-with-payg.xml",
+    "latency-routing-inbound": "latency-routing/latency-routing-inbound.xml",
+    "latency-routing-backend": "latency-routing/latency-routing-backend.xml",
+    "usage-tracking-inbound": "usage-tracking/usage-tracking-inbound.xml",
+    "usage-tracking-outbound": "usage-tracking/usage-tracking-outbound.xml",
+}
+# operations in infra/apim-genai/api-specs/openapi-spec.json and support-api-spec.json
+OPERATIONS = (
+    (
+        "POST",
+        re.compile(r"^/deployments/(?P<deployment_id>[^/]+)/completions$"),
+        "Completions_Create",
+    ),
+    (
+        "POST",
+        re.compile(r"^/deployments/(?P<deployment_id>[^/]+)/chat/completions$"),
+        "ChatCompletions_Create",
+    ),
+    (
+        "POST",
+        re.compile(r"^/deployments/(?P<deployment_id>[^/]+)/embeddings$"),
+        "embeddings_create",
+    ),
+    ("POST", re.compile(r"^/set-preferred-backends$"), "setPreferredBackends"),
+)
+# response headers that the APIM diagnostics log in ApiManagementGatewayLogs (see apiManagement.bicep)
+LOGGED_RESPONSE_HEADERS = (
+    "x-gw-ratelimit-reason",
+    "x-gw-ratelimit-value",
+    "x-gw-remaining-tokens",
+    "x-gw-remaining-requests",
+    "x-gw-priority",
+)
+# headers that apply to a single connection, and headers that the emulator sets itself
+HOP_BY_HOP_HEADERS = {
+    "connection",
+    "keep-alive",
+    "transfer-encoding",
+    "content-length",
+    "content-encoding",
+    "host",
+    "accept-encoding",
+}
+
+
+@dataclass
+class CircuitBreaker:
+    # trip after failure_count responses with a status code in the range within interval seconds
+    failure_count: int
+    interval: float
+    trip_duration: float
+    status_codes: range
+    # use the Retry-After header of the response that trips the breaker as the trip duration
+    accept_retry_after: bool
+    failures: deque = field(default_factory=deque)
+    open_until: float = 0
+
+    def is_open(self) -> bool:
+        return time.monotonic() < self.open_until
+
+    def record(self, response: Response):
+        if response.status_code not in self.status_codes:
+            return
+        now = time.monotonic()
+        self.failures.append(now)
+        while self.failures and self.failures[0] <= now - self.interval:
+            self.failures.popleft()
+        if len(self.failures) >= self.failure_count:
+            duration = self.trip_duration
+            retry_after = response.headers.get("Retry-After")
+            if self.accept_retry_after and retry_after and retry_after.isdigit():
+                duration = int(retry_after)
+            self.open_until = now + duration
+            self.failures.clear()
+
+
+@dataclass
+class Backend:
+    backend_id: str
+    url: str
+    api_key: str
+    circuit_breaker: CircuitBreaker | None = None
+
+
+@dataclass
+class BackendPool:
+    backend_id: str
+    # (backend ID, weight, priority) - the available backends with the lowest priority are used, in proportion to weight
+    services: list[tuple[str, int, int]]
+
+
+def create_backends(
+    ptu1_endpoint: str, payg1_endpoint: str, payg2_endpoint: str, api_key: str
+) -> dict[str, Backend | BackendPool]:
+    """
+    The backends and backend pools in apiManagement.bicep, for the simulator endpoints
+    """
+    return {
+        "ptu-backend-1": Backend("ptu-backend-1", f"{ptu1_endpoint}/openai", api_key),
+        "ptu-backend-1-with-circuit-breaker": Backend(
+            "ptu-backend-1-with-circuit-breaker",
+            f"{ptu1_endpoint}/openai",
+            api_key,
+            CircuitBreaker(
+                failure_count=3,
+                interval=10,
+                trip_duration=60,
+                status_codes=range(429, 430),
+                accept_retry_after=True,
+            ),
+        ),
+        "payg-backend-1": Backend(
+            "payg-backend-1", f"{payg1_endpoint}/openai", api_key
+        ),
+        "payg-backend-2": Backend(
+            "payg-backend-2", f"{payg2_endpoint}/openai", api_key
+        ),
+        "simple-round-robin-backend-pool": BackendPool(
+            "simple-round-robin-backend-pool",
+            [("payg-backend-1", 1, 1), ("payg-backend-2", 1, 1)],
+        ),
+        "weighted-round-robin-backend-pool": BackendPool(
+            "weighted-round-robin-backend-pool",
+            [("payg-backend-1", 2, 1), ("payg-backend-2", 1, 1)],
+        ),
+        "retry-with-payg-backend-pool": BackendPool(
+            "retry-with-payg-backend-pool",
+            [("ptu-backend-1-with-circuit-breaker", 1, 1), ("payg-backend-1", 1, 2)],
+        ),
+    }
+
+
+class GatewayEmulator(AsyncHttpServer, GatewayServices):
+    """
+    Serves the capability APIs over HTTP/1.1 with keep-alive on an asyncio event loop,
+    running each request through its API's policies and forwarding requests to the backends over kept-alive connections (see local/async_http.py).
+    Responses from the backends are streamed to the client when the policy forwards the request with buffer-response="false".
+    """
+
+    def __init__(
+        self,
+        backends: dict[str, Backend | BackendPool],
+        host: str = "127.0.0.1",
+        port: int = 0,
+        max_connections: int = 1000,
+        analytics_writer: LocalAnalyticsWriter | None = None,
+    ) -> None:
+        """
+        Constructor
+
+        Parameters:
+            backends (dict): Backends and backend pools by ID (see create_backends)
+            host (str): Address to listen on
+            port (int): Port to listen on (defaults to a free port)
+            max_connections (int): Maximum connections to the backends
+            analytics_writer (LocalAnalyticsWriter): Writer to record the gateway logs and emitted metrics
+                                                     to the local analytics database with
+        """
+        AsyncHttpServer.__init__(self, host=host, port=port)
+        GatewayServices.__init__(self)
+        self.backends = backends
+        self.policies = self.__load_policies()
+        self.__max_connections = max_connections
+        self.__analytics_writer = analytics_writer
+        self.__client = None
+
+    async def forward_request(
+        self, context: PolicyContext, timeout: float, buffer_response: bool
+    ) -> Response:
+        backend = self.__select_backend(context.backend_id)
+        if backend is None:
+            return Response(
+                status_code=503,
+                reason="Service Unavailable",
+                body=f"No backend available for '{context.backend_id}'".encode(),
+            )
+
+        request = context.request
+        headers = {
+            name: value
+            for name, value in request.headers.items()
+            if name.lower() not in HOP_BY_HOP_HEADERS
+        }
+        headers["api-key"] = backend.api_key
+        context.forwarded_backend_id = backend.backend_id
+        url = backend.url + request.path
+        if request.query:
+            url += "?" + urlencode(request.query)
+        backend_response = await self.__client.send(
+            request.method, url, headers, request.body, timeout
+        )
+        response = Response(
+            status_code=backend_response.status_code,
+            reason=backend_response.reason,
+            headers=CaseInsensitiveDict(
+                {
+                    name: value
+                    for name, value in backend_response.headers.items()
+                    if name.lower() not in HOP_BY_HOP_HEADERS
+                }
+            ),
+        )
+        if not buffer_response and response.headers.get("Content-Type", "").startswith(
+            "text/event-stream"
+        ):
+            response.stream = backend_response.aiter_bytes()
+            response.close = backend_response.aclose
+        else:
+            try:
+                async with asyncio.timeout(timeout):
+                    response.body = await backend_response.aread()
+            finally:
+                await backend_response.aclose()
+        context.backend_response_code = response.status_code
+        if backend.circuit_breaker is not None:
+            backend.circuit_breaker.record(response)
+        return response
+
+    def record_metric(self, namespace: str, name: str, dimensions: tuple, value: float):
+        super().record_metric(namespace, name, dimensions, value)
+        if self.__analytics_writer is not None:
+            self.__analytics_writer.write(
+                "AppMetrics",
+                TimeGenerated=time.time(),
+                Name=name,
+                Sum=value,
+                Count=1,
+                Min=value,
+                Max=value,
+                Properties=dict(dimensions),
+            )
+
+    def __select_backend(self, backend_id: str | None) -> Backend | None:
+        backend = self.backends.get(backend_id)
+        if not isinstance(backend, BackendPool):
+            return backend
+
+        available = [
+            service
+            for service in backend.services
+            if not self.__is_tripped(self.backends[service[0]])
+        ]
+        if not available:
+            return None
+        priority = min(service[2] for service in available)
+        services = [service for service in available if service[2] == priority]
+        service_id = random.choices(
+            [service[0] for service in services],
+            weights=[service[1] for service in services],
+        )[0]
+        return self.backends[service_id]
+
+    @staticmethod
+    def __is_tripped(backend: Backend) -> bool:
+        return backend.circuit_breaker is not None and backend.circuit_breaker.is_open()
+
+    def __load_policies(self) -> dict[str, Policy]:
+        compiler = PolicyCompiler(
+            CAPABILITY_EXPRESSIONS,
+            {
+                fragment_id: os.path.join(CAPABILITIES_ROOT, path)
+                for fragment_id, path in FRAGMENTS.items()
+            },
+        )
+        policies = {}
+        for api_path, path in APIS.items():
+            try:
+                policies[api_path] = compiler.compile_policy(
+                    os.path.join(CAPABILITIES_ROOT, path)
+                )
+            except PolicyError as error:
+                logging.warning("Skipping the /%s API: %s", api_path, error)
+        return policies
+
+    async def startup(self):
+        self.__client = HttpClient(self.__max_connections)
+
+    async def shutdown(self):
+        await self.__client.aclose()
+
+    async def handle_request(
+        self, method: str, target: str, headers: CaseInsensitiveDict, body: bytes
+    ) -> Response:
+        url = urlsplit(target)
+        if url.path == "/++/metrics" and method == "GET":
+            return json_response(200, self.__get_metrics())
+
+        for api_path, policy in self.policies.items():
+            prefix = f"/{api_path}"
+            if url.path == prefix or url.path.startswith(prefix + "/"):
+                break
+        else:
+            return json_response(
+                404, {"statusCode": 404, "message": "Resource not found"}
+            )
+
+        path = url.path[len(prefix) :]
+        for operation_method, pattern, operation_id in OPERATIONS:
+            match = pattern.match(path)
+            if match and method == operation_method:
+                break
+        else:
+            return json_response(
+                404, {"statusCode": 404, "message": "Operation not found"}
+            )
+
+        start_time = time.time()
+        matched_parameters = {
+            name.replace("_", "-"): value for name, value in match.groupdict().items()
+        }
+        context = PolicyContext(
+            request=Request(
+                method=method,
+                path=path,
+                query=dict(parse_qsl(url.query)),
+                headers=headers,
+                body=body,
+                matched_parameters=matched_parameters,
+            ),
+            api_id=api_path,
+            operation_id=operation_id,
+        )
+        response = await run_policy(policy, context, self)
+        if "last-error" in context.variables:
+            logging.warning(
+                "Error in the /%s API: %r", api_path, context.variables["last-error"]
+            )
+        if self.__analytics_writer is not None:
+            if response.stream is None:
+                self.__write_gateway_log(context, response, start_time)
+            else:
+                response.stream = self.__log_after_stream(
+                    response.stream, context, response, start_time
+                )
+        return response
+
+    async def __log_after_stream(
+        self,
+        stream,
+        context: PolicyContext,
+        response: Response,
+        start_time: float,
+    ):
+        # the total time of a streamed response includes sending the whole stream
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            self.__write_gateway_log(context, response, start_time)
+
+    def __write_gateway_log(
+        self, context: PolicyContext, response: Response, start_time: float
+    ):
+        self.__analytics_writer.write(
+            "ApiManagementGatewayLogs",
+            TimeGenerated=start_time,
+            CorrelationId=context.request_id,
+            ApiId=context.api_id,
+            OperationName="Microsoft.ApiManagement/GatewayLogs",
+            OperationId=context.operation_id,
+            BackendId=context.forwarded_backend_id or "",
+            ResponseCode=response.status_code,
+            BackendResponseCode=context.backend_response_code,
+            TotalTime=round((time.time() - start_time) * 1000),
+            ResponseHeaders={
+                name: response.headers[name]
+                for name in LOGGED_RESPONSE_HEADERS
+                if name in response.headers
+            },
+        )
+
+    def __get_metrics(self) -> list[dict]:
+        return [
+            {
+                "namespace": namespace,
+                "name": name,
+                "dimensions": dict(dimensions),
+                "count": count,
+                "sum": total,
+                "mean": total / count if count else math.nan,
+            }
+            for (namespace, name, dimensions), (count, total) in self.metrics.items()
+        ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--ptu1",
+        default=os.getenv("SIMULATOR_ENDPOINT_PTU1"),
+        help="PTU1 simulator endpoint (defaults to SIMULATOR_ENDPOINT_PTU1)",
+    )
+    parser.add_argument(
+        "--payg1",
+        default=os.getenv("SIMULATOR_ENDPOINT_PAYG1"),
+        help="PAYG1 simulator endpoint (defaults to SIMULATOR_ENDPOINT_PAYG1)",
+    )
+    parser.add_argument(
+        "--payg2",
+        default=os.getenv("SIMULATOR_ENDPOINT_PAYG2"),
+        help="PAYG2 simulator endpoint (defaults to SIMULATOR_ENDPOINT_PAYG2)",
+    )
+    parser.add_argument(
+        "--api-key",
+        default=os.getenv("SIMULATOR_API_KEY", "local"),
+        help="Simulator API key (defaults to SIMULATOR_API_KEY)",
+    )
+    parser.add_argument("--max-connections", type=int, default=1000)
+    parser.add_argument(
+        "--analytics-db",
+        help="Local analytics database to record the gateway logs and metrics to (see common/local_analytics.py)",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    analytics_writer = (
+        LocalAnalyticsWriter(args.analytics_db) if args.analytics_db else None
+    )
+    simulator = None
+    if not (args.ptu1 and args.payg1 and args.payg2):
+        # stand in for the missing simulators with a local one
+        simulator = FakeSimulatorServer(analytics_writer=analytics_writer)
+        simulator.start()
+        logging.info("Local simulator on %s", simulator.base_url)
+    backends = create_backends(
+        args.ptu1 or simulator.base_url,
+        args.payg1 or simulator.base_url,
+        args.payg2 or simulator.base_url,
+        args.api_key,
+    )
+
+    gateway = GatewayEmulator(
+        backends,
+        host=args.host,
+        port=args.port,
+        max_connections=args.max_connections,
+        analytics_writer=analytics_writer,
+    )
+    logging.info("Listening on %s", gateway.base_url)
+    for api_path in gateway.policies:
+        logging.info("    %s/%s", gateway.base_url, api_path)
+    try:
+        gateway.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if simulator is not None:
+            simulator.stop()
+        if analytics_writer is not None:
+            analytics_writer.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
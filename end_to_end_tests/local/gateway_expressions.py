@@ -0,0 +1,543 @@
+"""
+Python equivalents of the C# policy expressions in the capability policies, for the local gateway emulator (local/gateway.py).
+
+Each equivalent is registered with the text of the expression that it replaces (without the @(...) or @{...} wrapper),
+so when an expression in a policy changes, the emulator reports it as missing until the equivalent here is updated.
+Expressions that just read a variable or are literals don't need to be registered (see ExpressionRegistry).
+"""
+
+import random
+
+from common.token_estimation import estimate_policy_tokens
+from common.weighted_routing import select_backend_order
+
+from .gateway_policy import ExpressionRegistry
+
+CAPABILITY_EXPRESSIONS = ExpressionRegistry()
+register = CAPABILITY_EXPRESSIONS.register
+
+# operation IDs in infra/apim-genai/api-specs/openapi-spec.json
+OPERATIONS = {
+    "Completions_Create": "completions",
+    "ChatCompletions_Create": "chat",
+    "embeddings_create": "embeddings",
+}
+
+
+def _cache_key(suffix: str):
+    return lambda context: context.variables["selected-deployment-id"] + suffix
+
+
+def _response_header_int(name: str, default: str):
+    return lambda context: int(context.response.headers.get(name, default))
+
+
+def _deployment_value(name: str):
+    return lambda context: int(context.variables["selected-deployment"][name])
+
+
+# common to several policies
+
+register("context.Response.StatusCode == 200")(
+    lambda context: context.response.status_code == 200
+)
+register("context.Response.StatusCode == 429")(
+    lambda context: context.response.status_code == 429
+)
+register("context.Response.StatusCode != 429")(
+    lambda context: context.response.status_code != 429
+)
+
+
+# prioritization/prioritization-token-calculating.xml and prioritization-token-tracking.xml
+
+register('context.Variables.ContainsKey("list-deployments") == false')(
+    lambda context: "list-deployments" not in context.variables
+)
+register('context.Request.MatchedParameters["deployment-id"]')(
+    lambda context: context.request.matched_parameters["deployment-id"]
+)
+register('context.Variables["selected-deployment"] == null')(
+    lambda context: context.variables["selected-deployment"] is None
+)
+
+
+@register("""
+    JArray deployments = new JArray();
+    deployments.Add(new JObject()
+    {
+        { "deployment-id", "embedding" },
+        { "tpm-limit", 10000},
+        { "low-priority-tpm-threshold", 3000},
+        { "rp10s-limit", 10 },
+        { "low-priority-rp10s-threshold", 3},
+    });
+    deployments.Add(new JObject()
+    {
+        { "deployment-id", "embedding100k" },
+        { "tpm-limit", 100000},
+        { "low-priority-tpm-threshold", 30000},
+        { "rp10s-limit", 100 },
+        { "low-priority-rp10s-threshold", 30},
+    });
+    deployments.Add(new JObject()
+    {
+        { "deployment-id", "gpt-35-turbo-10k-token" },
+        { "tpm-limit", 10000},
+        { "low-priority-tpm-threshold", 3000},
+        { "rp10s-limit", 10 },
+        { "low-priority-rp10s-threshold", 3},
+    });
+    deployments.Add(new JObject()
+    {
+        { "deployment-id", "gpt-35-turbo-100k-token" },
+        { "tpm-limit", 100000},
+        { "low-priority-tpm-threshold", 30000},
+        { "rp10s-limit", 100 },
+        { "low-priority-rp10s-threshold", 30},
+    });
+    return deployments;
+    """)
+def _calculating_deployments(context):
+    return [
+        _deployment("embedding", 10000, 3000, 10, 3),
+        _deployment("embedding100k", 100000, 30000, 100, 30),
+        _deployment("gpt-35-turbo-10k-token", 10000, 3000, 10, 3),
+        _deployment("gpt-35-turbo-100k-token", 100000, 30000, 100, 30),
+    ]
+
+
+@register("""
+    JArray deployments = new JArray();
+    deployments.Add(new JObject()
+    {
+        { "deployment-id", "embedding100k" },
+        // embedding100k has a 100,000 TPM limit
+        // Set low-priority-tpm-threshold to 30,000 to reserve 30,000 TPM for high priority requests
+        // 100,000 TPM  = 6/1000 * 100,000 = 600 RPM
+        //              = 10 RP10S (requests per 10 seconds)
+        { "low-priority-tpm-threshold", 30000},
+        { "low-priority-rp10s-threshold", 3},
+    });
+    deployments.Add(new JObject()
+    {
+        { "deployment-id", "embedding" },
+        { "low-priority-tpm-threshold", 3000},
+        { "low-priority-rp10s-threshold", 3},
+    });
+    deployments.Add(new JObject()
+    {
+        { "deployment-id", "gpt-35-turbo-10k-token" },
+        { "low-priority-tpm-threshold", 3000},
+        { "low-priority-rp10s-threshold", 3},
+    });
+    deployments.Add(new JObject()
+    {
+        { "deployment-id", "gpt-35-turbo-100k-token" },
+        { "low-priority-tpm-threshold", 30000},
+        { "low-priority-rp10s-threshold", 30},
+    });
+    return deployments;
+    """)
+def _tracking_deployments(context):
+    thresholds = [
+        ("embedding100k", 30000, 3),
+        ("embedding", 3000, 3),
+        ("gpt-35-turbo-10k-token", 3000, 3),
+        ("gpt-35-turbo-100k-token", 30000, 30),
+    ]
+    return [
+        {
+            "deployment-id": deployment_id,
+            "low-priority-tpm-threshold": tpm_threshold,
+            "low-priority-rp10s-threshold": rp10s_threshold,
+        }
+        for deployment_id, tpm_threshold, rp10s_threshold in thresholds
+    ]
+
+
+def _deployment(
+    deployment_id: str,
+    tpm_limit: int,
+    tpm_threshold: int,
+    rp10s_limit: int,
+    rp10s_threshold: int,
+) -> dict:
+    return {
+        "deployment-id": deployment_id,
+        "tpm-limit": tpm_limit,
+        "low-priority-tpm-threshold": tpm_threshold,
+        "rp10s-limit": rp10s_limit,
+        "low-priority-rp10s-threshold": rp10s_threshold,
+    }
+
+
+@register("""
+    JArray deployments = (JArray)context.Variables["list-deployments"];
+    for (int i = 0; i < deployments.Count; i++)
+    {
+        JObject deployment = (JObject)deployments[i];
+        if (deployment.Value<string>("deployment-id") == (string)context.Variables["selected-deployment-id"])
+        {
+            return deployment;
+        }
+    }
+    // Deployment not found
+    return null;
+    """)
+def _selected_deployment(context):
+    for deployment in context.variables["list-deployments"]:
+        if deployment["deployment-id"] == context.variables["selected-deployment-id"]:
+            return deployment
+    return None
+
+
+for _name in (
+    "tpm-limit",
+    "rp10s-limit",
+    "low-priority-tpm-threshold",
+    "low-priority-rp10s-threshold",
+):
+    register(f"""
+        JObject selectedDeployment = (JObject)context.Variables["selected-deployment"];
+        return selectedDeployment.Value<int>("{_name}");
+        """)(_deployment_value(_name))
+
+
+@register("""
+    JObject requestBody = context.Request.Body.As<JObject>(preserveContent: true);
+    List<string> texts = new List<string>();
+    int promptTokens = 0;
+    // embeddings input and completions prompt: a string, an array of strings, or token IDs
+    JToken prompt = requestBody["input"] ?? requestBody["prompt"];
+    if (prompt != null)
+    {
+        JArray items = prompt.Type == JTokenType.Array ? (JArray)prompt : new JArray(prompt);
+        foreach (JToken item in items)
+        {
+            if (item.Type == JTokenType.String)
+            {
+                texts.Add((string)item);
+            }
+            else if (item.Type == JTokenType.Integer)
+            {
+                promptTokens += 1;
+            }
+            else if (item.Type == JTokenType.Array)
+            {
+                promptTokens += ((JArray)item).Count;
+            }
+        }
+    }
+    // chat messages: content is a string or an array of content parts
+    JArray messages = requestBody["messages"] as JArray;
+    if (messages != null)
+    {
+        foreach (JToken message in messages)
+        {
+            promptTokens += 4;
+            JToken content = message.Type == JTokenType.Object ? message["content"] : null;
+            if (content == null)
+            {
+                continue;
+            }
+            if (content.Type == JTokenType.String)
+            {
+                texts.Add((string)content);
+            }
+            else if (content.Type == JTokenType.Array)
+            {
+                foreach (JToken part in content)
+                {
+                    // only text parts are estimated (not e.g. image parts)
+                    JToken text = part.Type == JTokenType.Object ? part["text"] : null;
+                    if (text != null && text.Type == JTokenType.String)
+                    {
+                        texts.Add((string)text);
+                    }
+                }
+            }
+        }
+        // the reply is primed with an assistant message header
+        promptTokens += 3;
+    }
+    // English text and code average about 4 characters per token, while other characters
+    // (e.g. Chinese, Japanese and Korean) are usually at least a token each
+    int asciiCharacters = 0;
+    foreach (string text in texts)
+    {
+        foreach (char character in text)
+        {
+            if (character < 128)
+            {
+                asciiCharacters++;
+            }
+            else
+            {
+                promptTokens++;
+            }
+        }
+    }
+    promptTokens += (int)Math.Ceiling(asciiCharacters * 0.25);
+    if (context.Operation.Id == "embeddings_create" || requestBody.Value<string>("model") == "embedding")
+    {
+        return promptTokens;
+    }
+    // the service reserves max_tokens (16 if not set) for each of the best_of (or n) completions
+    int maxTokens = requestBody.Value<int?>("max_completion_tokens") ?? requestBody.Value<int?>("max_tokens") ?? 16;
+    int choices = requestBody.Value<int?>("best_of") ?? requestBody.Value<int?>("n") ?? 1;
+    return promptTokens + maxTokens * choices;
+    """)
+def _consumed_tokens(context):
+    return estimate_policy_tokens(
+        OPERATIONS.get(context.operation_id, ""), context.request.json()
+    )
+
+
+register('context.Variables["selected-deployment-id"] + "|tokens-limit"')(
+    _cache_key("|tokens-limit")
+)
+register('context.Variables["selected-deployment-id"] + "|requests-limit"')(
+    _cache_key("|requests-limit")
+)
+register('context.Variables["selected-deployment-id"] + "|remaining-tokens"')(
+    _cache_key("|remaining-tokens")
+)
+register('context.Variables["selected-deployment-id"] + "|remaining-requests"')(
+    _cache_key("|remaining-requests")
+)
+register(
+    'context.Variables["selected-deployment-id"] + "|allow-additional-lowpri-request"'
+)(_cache_key("|allow-additional-lowpri-request"))
+
+
+@register("""
+    if (context.Request.Url.Query.GetValueOrDefault("priority", "") == "low"){
+        return true;
+    }
+    if (context.Request.Headers.GetValueOrDefault("x-priority", "") == "low"){
+        return true;
+    }
+    return false;
+    """)
+def _low_priority(context):
+    return (
+        context.request.query.get("priority", "") == "low"
+        or context.request.headers.get("x-priority", "") == "low"
+    )
+
+
+register(
+    '(int)context.Variables["remaining-tokens"] < (int)context.Variables["low-priority-tpm-threshold"]'
+)(
+    lambda context: int(context.variables["remaining-tokens"])
+    < int(context.variables["low-priority-tpm-threshold"])
+)
+register(
+    '(int)context.Variables["remaining-requests"] < (int)context.Variables["low-priority-rp10s-threshold"]'
+)(
+    lambda context: int(context.variables["remaining-requests"])
+    < int(context.variables["low-priority-rp10s-threshold"])
+)
+register("""
+    ((int)context.Variables["remaining-tokens"] != -1)
+    && ((int)context.Variables["remaining-tokens"]) < ((int)context.Variables["low-priority-tpm-threshold"])
+    """)(
+    lambda context: int(context.variables["remaining-tokens"]) != -1
+    and int(context.variables["remaining-tokens"])
+    < int(context.variables["low-priority-tpm-threshold"])
+)
+register("""
+    ((int)context.Variables["remaining-requests"] != -1)
+    && ((int)context.Variables["remaining-requests"]) < ((int)context.Variables["low-priority-rp10s-threshold"])
+    """)(
+    lambda context: int(context.variables["remaining-requests"]) != -1
+    and int(context.variables["remaining-requests"])
+    < int(context.variables["low-priority-rp10s-threshold"])
+)
+register('((bool)context.Variables["low-priority"] == true) ? "low" : "high"')(
+    lambda context: "low" if context.variables["low-priority"] else "high"
+)
+register('((bool)context.Variables["allow-additional-lowpri-request"]) == true')(
+    lambda context: bool(context.variables["allow-additional-lowpri-request"])
+)
+register('((bool)context.Variables["allow-additional-lowpri-request"]) == false')(
+    lambda context: not context.variables["allow-additional-lowpri-request"]
+)
+register(
+    'int.Parse((string)context.Response.Headers.GetValueOrDefault("x-ratelimit-remaining-tokens","0"))'
+)(_response_header_int("x-ratelimit-remaining-tokens", "0"))
+register(
+    'int.Parse((string)context.Response.Headers.GetValueOrDefault("x-ratelimit-remaining-requests","0"))'
+)(_response_header_int("x-ratelimit-remaining-requests", "0"))
+register(
+    'int.Parse((string)context.Response.Headers.GetValueOrDefault("x-ratelimit-reset-tokens","-1337"))'
+)(_response_header_int("x-ratelimit-reset-tokens", "-1337"))
+register(
+    'int.Parse((string)context.Response.Headers.GetValueOrDefault("x-ratelimit-reset-requests","-1337"))'
+)(_response_header_int("x-ratelimit-reset-requests", "-1337"))
+register('(int)context.Variables["tokens-reset"]>0')(
+    lambda context: int(context.variables["tokens-reset"]) > 0
+)
+register('(int)context.Variables["requests-reset"]>0')(
+    lambda context: int(context.variables["requests-reset"]) > 0
+)
+register("""
+    "Unexpected response headers: Got tokens-reset=" + context.Variables["tokens-reset"]
+    + ", requests-reset=" + context.Variables["requests-reset"]
+    """)(
+    lambda context: f"Unexpected response headers: Got tokens-reset={context.variables['tokens-reset']}"
+    + f", requests-reset={context.variables['requests-reset']}"
+)
+
+
+# load-balancing/simple-round-robin.xml and weighted-round-robin.xml
+
+register('((int)context.Variables["backend-counter"])+1')(
+    lambda context: int(context.variables["backend-counter"]) + 1
+)
+register("""
+    JArray backends = new JArray();
+    backends.Add("payg-backend-1");
+    backends.Add("payg-backend-2");
+    return backends;
+    """)(lambda context: ["payg-backend-1", "payg-backend-2"])
+register('((JArray)context.Variables["backend-pool"]).Count')(
+    lambda context: len(context.variables["backend-pool"])
+)
+register(
+    '(int)context.Variables["backend-counter"]%(int)context.Variables["total-backend-count"]'
+)(
+    lambda context: int(context.variables["backend-counter"])
+    % int(context.variables["total-backend-count"])
+)
+register(
+    '((JArray)context.Variables["backend-pool"])[(int)context.Variables["chosen-index"]].ToString()'
+)(
+    lambda context: str(
+        context.variables["backend-pool"][int(context.variables["chosen-index"])]
+    )
+)
+register("""
+    JArray backends = new JArray();
+    backends.Add(new JObject()
+    {
+        { "id", "payg-backend-1" },
+        { "weight", 2 },
+    });
+
+    backends.Add(new JObject()
+    {
+        { "id", "payg-backend-2" },
+        { "weight", 1 },
+    });
+
+    return backends;
+    """)(
+    lambda context: [
+        {"id": "payg-backend-1", "weight": 2},
+        {"id": "payg-backend-2", "weight": 1},
+    ]
+)
+
+
+@register("""
+    var backends = (JArray)context.Variables["all-backends"];
+    var totalWeight = backends.Sum(e => (int)e["weight"]);
+    var randomNumber = new Random().Next(totalWeight);
+    var weightSum = 0;
+    foreach (var backend in backends)
+    {
+        weightSum += (int)backend["weight"];
+        if (randomNumber < weightSum)
+        {
+            return backend["id"].ToString();
+        }
+    }
+    return backends[0]["id"].ToString();
+    """)
+def _weighted_round_robin_backend(context):
+    backends = context.variables["all-backends"]
+    point = random.randrange(sum(int(backend["weight"]) for backend in backends))
+    for backend in backends:
+        point -= int(backend["weight"])
+        if point < 0:
+            return str(backend["id"])
+    return str(backends[0]["id"])
+
+
+# latency-routing/latency-routing-inbound.xml, latency-routing-backend.xml and set-latency-policy.xml
+
+
+@register("""
+    var backendIds = new List<string>();
+    var weights = new List<double>();
+    foreach (var backend in (JArray)context.Variables["preferredBackendsFromCache"])
+    {
+        if (backend.Type == JTokenType.Object)
+        {
+            backendIds.Add((string)backend["backendId"]);
+            weights.Add(Math.Max(0, (double?)backend["weight"] ?? 0));
+        }
+        else
+        {
+            backendIds.Add((string)backend);
+            weights.Add(0);
+        }
+    }
+    if (backendIds.Count == 0)
+    {
+        return new JArray();
+    }
+
+    var selected = 0;
+    var totalWeight = weights.Sum();
+    if (totalWeight > 0)
+    {
+        var point = new Random(context.RequestId.GetHashCode()).NextDouble() * totalWeight;
+        while (selected < backendIds.Count - 1 && point >= weights[selected])
+        {
+            point -= weights[selected];
+            selected++;
+        }
+    }
+
+    var order = new JArray(backendIds[selected]);
+    for (var i = 0; i < backendIds.Count; i++)
+    {
+        if (i != selected)
+        {
+            order.Add(backendIds[i]);
+        }
+    }
+    return order;
+    """)
+def _preferred_backend_order(context):
+    return select_backend_order(
+        context.variables["preferredBackendsFromCache"], random.random()
+    )
+
+
+register('(int)context.Variables["backendAttempt"] + 1')(
+    lambda context: int(context.variables["backendAttempt"]) + 1
+)
+
+
+@register("""
+    var order = (JArray)context.Variables["preferredBackendOrder"];
+    if (order.Count == 0)
+    {
+        return (string)context.Variables["default-backend-id"];
+    }
+    return (string)order[Math.Min((int)context.Variables["backendAttempt"], order.Count - 1)];
+    """)
+def _latency_routing_backend(context):
+    order = context.variables["preferredBackendOrder"]
+    if not order:
+        return context.variables["default-backend-id"]
+    return order[min(int(context.variables["backendAttempt"]), len(order) - 1)]
+
+
+register(
+    '(JArray)context.Request.Body.As<JObject>(preserveContent: true).SelectToken("preferredBackends")'
+)(lambda context: (context.request.json() or {}).get("preferredBackends"))
@@ -0,0 +1,698 @@
+"""
+Parses and runs APIM policy XML (the subset used by the capability policies) for the local gateway emulator (local/gateway.py).
+
+Policies are compiled once into steps, and policy expressions (@(...) and @{...}) are replaced with Python equivalents
+from an ExpressionRegistry (see local/gateway_expressions.py), so that an expression without an equivalent
+(e.g. after a policy is changed) is reported when the policy is loaded rather than when a request uses it.
+"""
+
+import asyncio
+import html
+import json
+import math
+import random
+import re
+import time
+import uuid
+import xml.etree.ElementTree as ElementTree
+from collections.abc import Callable
+from dataclasses import dataclass, field
+
+from requests.structures import CaseInsensitiveDict
+
+from .async_http import Response
+
+SECTIONS = ("inbound", "backend", "outbound", "on-error")
+# expressions reading a variable with optional casts, e.g. (double)(int)context.Variables["tpm-limit"],
+# or converting it to a string, e.g. ((int)context.Variables["tpm-limit"]).ToString()
+_TYPE = r"\((?P<type>string|int|bool|double|JArray|JObject)\)"
+_VARIABLE = r'(?:\((?:string|int|bool|double|JArray|JObject)\))?context\.Variables\["(?P<name>[^"]+)"\]'
+VARIABLE_EXPRESSION = re.compile(rf"^(?:{_TYPE})?{_VARIABLE}$")
+VARIABLE_STRING_EXPRESSION = re.compile(rf"^\((?:{_TYPE})?{_VARIABLE}\)\.ToString\(\)$")
+VARIABLE_CASTS = {"int": int, "double": float, "bool": bool}
+LITERAL_EXPRESSIONS = {
+    "true": True,
+    "false": False,
+    "new JArray()": [],
+    "new JObject()": {},
+}
+WHITESPACE = re.compile(r"\s+")
+EXPRESSION_OR_COMMENT = re.compile(r"<!--|@[({]")
+
+
+class PolicyError(Exception):
+    pass
+
+
+@dataclass
+class Request:
+    method: str
+    # path after the API path, e.g. /deployments/gpt-35-turbo/chat/completions
+    path: str
+    query: dict[str, str]
+    headers: CaseInsensitiveDict
+    body: bytes
+    # path parameters for the matched operation, e.g. {"deployment-id": "gpt-35-turbo"}
+    matched_parameters: dict[str, str] = field(default_factory=dict)
+
+    def json(self):
+        return json.loads(self.body) if self.body else None
+
+
+@dataclass
+class PolicyContext:
+    """
+    The state for a request passing through the policies (the equivalent of context in the policy expressions)
+    """
+
+    request: Request
+    api_id: str
+    operation_id: str
+    request_id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    variables: dict = field(default_factory=dict)
+    response: Response = field(default_factory=Response)
+    backend_id: str | None = None
+    # the backend that the request was last forwarded to (the selected backend for a backend pool)
+    # and the status code of its response, for the gateway logs
+    forwarded_backend_id: str | None = None
+    backend_response_code: int | None = None
+    # headers added to the response by rate-limit-by-key
+    rate_limit_headers: dict[str, str] = field(default_factory=dict)
+    # counters to decrement again if the increment-condition is false for the response (see RateLimitByKey)
+    rate_limit_increments: list = field(default_factory=list)
+
+
+class ReturnResponse(Exception):
+    """
+    Raised to end the pipeline and send a response (by return-response or rate-limit-by-key)
+    """
+
+    def __init__(self, response: Response) -> None:
+        super().__init__(response.status_code)
+        self.response = response
+
+
+class ExpressionRegistry:
+    """
+    Python equivalents of the C# policy expressions, looked up by the expression text.
+    The text is matched with whitespace collapsed (so indentation and line breaks don't matter)
+    and without the @(...) or @{...} wrapper.
+
+    Reading a variable with optional casts (e.g. (int)context.Variables["tpm-limit"]) or converting it with ToString(),
+    integer and boolean literals and new JArray()/new JObject() are handled without registering them.
+    """
+
+    def __init__(self) -> None:
+        self.__expressions = {}
+
+    def register(self, expression: str):
+        """
+        Decorator to register a function taking the PolicyContext as the equivalent of an expression
+        """
+
+        def decorator(function: Callable[[PolicyContext], object]):
+            key = _normalize(expression)
+            if key in self.__expressions:
+                raise ValueError(f"Expression already registered: {expression}")
+            self.__expressions[key] = function
+            return function
+
+        return decorator
+
+    def update(self, other: "ExpressionRegistry"):
+        """
+        Add the expressions registered in another registry
+        """
+        self.__expressions.update(other.__expressions)
+
+    def compile(
+        self, value: str | None, source: str
+    ) -> Callable[[PolicyContext], object]:
+        """
+        Returns a function returning the value of an attribute or element text for a PolicyContext:
+        the Python equivalent of an expression, or the text itself
+        """
+        if value is None:
+            return lambda context: None
+        text = value.strip()
+        if not (
+            (text.startswith("@(") and text.endswith(")"))
+            or (text.startswith("@{") and text.endswith("}"))
+        ):
+            return lambda context: value
+
+        key = _normalize(text[2:-1])
+        if key in self.__expressions:
+            return self.__expressions[key]
+        if key in LITERAL_EXPRESSIONS:
+            literal = LITERAL_EXPRESSIONS[key]
+            return lambda context: copy_value(literal)
+        if re.fullmatch(r"-?\d+", key):
+            number = int(key)
+            return lambda context: number
+        match = VARIABLE_EXPRESSION.match(key)
+        if match:
+            name = match.group("name")
+            cast = VARIABLE_CASTS.get(match.group("type"))
+            if cast is None:
+                return lambda context: context.variables[name]
+            return lambda context: cast(context.variables[name])
+        match = VARIABLE_STRING_EXPRESSION.match(key)
+        if match:
+            name = match.group("name")
+            cast = VARIABLE_CASTS.get(match.group("type"), lambda value: value)
+            return lambda context: str(cast(context.variables[name]))
+        raise PolicyError(
+            f"No Python equivalent registered for the expression in {source}: {text}"
+        )
+
+
+def copy_value(value):
+    # values stored in variables and the cache are copied so that changes aren't shared
+    if isinstance(value, (list, dict)):
+        return json.loads(json.dumps(value))
+    return value
+
+
+class Step:
+    """
+    A compiled policy statement
+    """
+
+    async def execute(self, context: PolicyContext, gateway: "GatewayServices"):
+        raise NotImplementedError()
+
+
+class GatewayServices:
+    """
+    The state shared by requests (cache, rate limit counters and metrics) and forwarding requests to backends,
+    provided by the gateway to the policy steps
+    """
+
+    def __init__(self) -> None:
+        # key -> (value, expiry time)
+        self.cache = {}
+        # counter key -> [window end time, count]
+        self.rate_limit_counters = {}
+        # (namespace, name, dimensions) -> [count, sum]
+        self.metrics = {}
+
+    async def forward_request(
+        self, context: PolicyContext, timeout: float, buffer_response: bool
+    ) -> Response:
+        raise NotImplementedError()
+
+    def cache_lookup(self, key: str, default):
+        entry = self.cache.get(key)
+        if entry is None or entry[1] <= time.monotonic():
+            return copy_value(default)
+        return copy_value(entry[0])
+
+    def cache_store(self, key: str, value, duration: float):
+        self.cache[key] = (copy_value(value), time.monotonic() + duration)
+
+    def record_metric(self, namespace: str, name: str, dimensions: tuple, value: float):
+        metric = self.metrics.setdefault((namespace, name, dimensions), [0, 0.0])
+        metric[0] += 1
+        metric[1] += value
+
+
+class Steps(Step):
+    def __init__(self, steps: list[Step]) -> None:
+        self.steps = steps
+
+    async def execute(self, context, gateway):
+        for step in self.steps:
+            await step.execute(context, gateway)
+
+
+class Base(Step):
+    # there is no global (all APIs) policy to run
+    async def execute(self, context, gateway):
+        pass
+
+
+class SetVariable(Step):
+    def __init__(self, element, compile_value) -> None:
+        self.name = element.get("name")
+        self.value = compile_value(element.get("value"))
+
+    async def execute(self, context, gateway):
+        context.variables[self.name] = self.value(context)
+
+
+class SetBackendService(Step):
+    def __init__(self, element, compile_value) -> None:
+        if element.get("backend-id") is None:
+            raise PolicyError("Only set-backend-service with backend-id is supported")
+        self.backend_id = compile_value(element.get("backend-id"))
+
+    async def execute(self, context, gateway):
+        context.backend_id = self.backend_id(context)
+
+
+class CacheLookupValue(Step):
+    def __init__(self, element, compile_value) -> None:
+        self.key = compile_value(element.get("key"))
+        self.variable_name = element.get("variable-name")
+        self.default_value = (
+            compile_value(element.get("default-value"))
+            if element.get("default-value") is not None
+            else None
+        )
+
+    async def execute(self, context, gateway):
+        missing = object()
+        value = gateway.cache_lookup(self.key(context), missing)
+        if value is missing:
+            if self.default_value is None:
+                # without a default the variable isn't set (so context.Variables.ContainsKey is false)
+                context.variables.pop(self.variable_name, None)
+                return
+            value = self.default_value(context)
+        context.variables[self.variable_name] = value
+
+
+class CacheStoreValue(Step):
+    def __init__(self, element, compile_value) -> None:
+        self.key = compile_value(element.get("key"))
+        self.value = compile_value(element.get("value"))
+        self.duration = compile_value(element.get("duration"))
+
+    async def execute(self, context, gateway):
+        gateway.cache_store(
+            self.key(context), self.value(context), float(self.duration(context))
+        )
+
+
+class Choose(Step):
+    def __init__(self, element, compile_value, compile_steps) -> None:
+        self.branches = []
+        self.otherwise = None
+        for child in element:
+            if child.tag == "when":
+                self.branches.append(
+                    (compile_value(child.get("condition")), compile_steps(child))
+                )
+            elif child.tag == "otherwise":
+                self.otherwise = compile_steps(child)
+            else:
+                raise PolicyError(f"Unexpected <{child.tag}> in <choose>")
+
+    async def execute(self, context, gateway):
+        for condition, steps in self.branches:
+            if condition(context):
+                await steps.execute(context, gateway)
+                return
+        if self.otherwise is not None:
+            await self.otherwise.execute(context, gateway)
+
+
+class Retry(Step):
+    def __init__(self, element, compile_value, compile_steps) -> None:
+        self.condition = compile_value(element.get("condition"))
+        self.count = int(element.get("count"))
+        self.interval = float(element.get("interval", 0))
+        self.max_interval = element.get("max-interval")
+        self.delta = element.get("delta")
+        self.first_fast_retry = element.get("first-fast-retry", "false") == "true"
+        self.steps = compile_steps(element)
+
+    def get_interval(self, retry: int) -> float:
+        """
+        Seconds to wait before the retry (1 for the first retry):
+        fixed, linear (with delta) or exponential (with delta and max-interval) as in APIM
+        """
+        if retry == 1 and self.first_fast_retry:
+            return 0
+        if self.delta is None:
+            return self.interval
+        delta = float(self.delta)
+        if self.max_interval is None:
+            return self.interval + (retry - 1) * delta
+        return min(
+            self.interval + (2**retry - 1) * random.uniform(delta * 0.8, delta * 1.2),
+            float(self.max_interval),
+        )
+
+    async def execute(self, context, gateway):
+        await self.steps.execute(context, gateway)
+        for retry in range(1, self.count + 1):
+            if not self.condition(context):
+                return
+            await asyncio.sleep(self.get_interval(retry))
+            await self.steps.execute(context, gateway)
+
+
+class ForwardRequest(Step):
+    def __init__(self, element, compile_value) -> None:
+        self.timeout = float(element.get("timeout", 300))
+        self.buffer_response = element.get("buffer-response", "true") == "true"
+
+    async def execute(self, context, gateway):
+        # a response from an earlier attempt (e.g. a 429 being retried) isn't sent to the client
+        await context.response.discard()
+        context.response = await gateway.forward_request(
+            context, self.timeout, self.buffer_response
+        )
+
+
+class SetHeader(Step):
+    def __init__(self, element, compile_value) -> None:
+        self.name = element.get("name")
+        self.exists_action = element.get("exists-action", "override")
+        self.values = [compile_value(value.text) for value in element.findall("value")]
+
+    def apply(self, headers: CaseInsensitiveDict, context: PolicyContext):
+        if self.exists_action == "delete":
+            headers.pop(self.name, None)
+            return
+        if self.exists_action == "skip" and self.name in headers:
+            return
+        values = [str(value(context)) for value in self.values]
+        if self.exists_action == "append" and self.name in headers:
+            values.insert(0, headers[self.name])
+        headers[self.name] = ",".join(values)
+
+    async def execute(self, context, gateway):
+        # before the response is received this sets a request header
+        if context.response.status_code:
+            self.apply(context.response.headers, context)
+        else:
+            self.apply(context.request.headers, context)
+
+
+class ReturnResponseStep(Step):
+    def __init__(self, element, compile_value) -> None:
+        self.status_code = None
+        self.reason = None
+        self.headers = []
+        self.body = None
+        for child in element:
+            if child.tag == "set-status":
+                self.status_code = compile_value(child.get("code"))
+                self.reason = compile_value(child.get("reason", ""))
+            elif child.tag == "set-header":
+                self.headers.append(SetHeader(child, compile_value))
+            elif child.tag == "set-body":
+                self.body = compile_value(child.text or "")
+            else:
+                raise PolicyError(f"Unsupported <{child.tag}> in <return-response>")
+
+    async def execute(self, context, gateway):
+        response = Response(status_code=200, reason="OK")
+        if self.status_code is not None:
+            response.status_code = int(self.status_code(context))
+            response.reason = str(self.reason(context))
+        for header in self.headers:
+            header.apply(response.headers, context)
+        if self.body is not None:
+            body = self.body(context)
+            response.body = (
+                body.encode("utf-8")
+                if isinstance(body, str)
+                else json.dumps(body).encode("utf-8")
+            )
+        raise ReturnResponse(response)
+
+
+class RateLimitByKey(Step):
+    """
+    Counts calls (or increment-count) per counter key in fixed windows of renewal-period seconds.
+    The increment is counted when the request is let through and taken off again if the increment-condition
+    is false for the response, so that concurrent requests see it straight away.
+    """
+
+    def __init__(self, element, compile_value) -> None:
+        self.counter_key = compile_value(element.get("counter-key"))
+        self.calls = compile_value(element.get("calls"))
+        self.renewal_period = float(element.get("renewal-period"))
+        self.increment_count = compile_value(element.get("increment-count", "1"))
+        self.increment_condition = (
+            compile_value(element.get("increment-condition"))
+            if element.get("increment-condition")
+            else None
+        )
+        self.retry_after_header_name = element.get("retry-after-header-name")
+        self.retry_after_variable_name = element.get("retry-after-variable-name")
+        self.remaining_calls_header_name = element.get("remaining-calls-header-name")
+        self.remaining_calls_variable_name = element.get(
+            "remaining-calls-variable-name"
+        )
+        self.total_calls_header_name = element.get("total-calls-header-name")
+
+    async def execute(self, context, gateway):
+        key = self.counter_key(context)
+        calls = int(self.calls(context))
+        increment = int(self.increment_count(context))
+        now = time.monotonic()
+        counter = gateway.rate_limit_counters.get(key)
+        if counter is None or counter[0] <= now:
+            counter = gateway.rate_limit_counters[key] = [now + self.renewal_period, 0]
+
+        if self.total_calls_header_name:
+            context.rate_limit_headers[self.total_calls_header_name] = str(calls)
+        if counter[1] + increment > calls:
+            retry_after = max(1, math.ceil(counter[0] - now))
+            if self.retry_after_variable_name:
+                context.variables[self.retry_after_variable_name] = retry_after
+            if self.remaining_calls_variable_name:
+                context.variables[self.remaining_calls_variable_name] = max(
+                    0, calls - counter[1]
+                )
+            response = Response(status_code=429, reason="Too Many Requests")
+            response.headers["Retry-After"] = str(retry_after)
+            if self.retry_after_header_name:
+                response.headers[self.retry_after_header_name] = str(retry_after)
+            response.headers["Content-Type"] = "application/json"
+            response.body = json.dumps(
+                {
+                    "statusCode": 429,
+                    "message": f"Rate limit is exceeded. Try again in {retry_after} seconds.",
+                }
+            ).encode("utf-8")
+            raise ReturnResponse(response)
+
+        counter[1] += increment
+        remaining = calls - counter[1]
+        if self.remaining_calls_variable_name:
+            context.variables[self.remaining_calls_variable_name] = remaining
+        if self.remaining_calls_header_name:
+            context.rate_limit_headers[self.remaining_calls_header_name] = str(
+                remaining
+            )
+        if self.increment_condition is not None:
+            context.rate_limit_increments.append(
+                (self.increment_condition, counter, increment)
+            )
+
+    @staticmethod
+    def settle(context: PolicyContext):
+        """
+        Take the increments off again where the increment-condition is false for the response
+        """
+        for condition, counter, increment in context.rate_limit_increments:
+            if not condition(context):
+                counter[1] -= increment
+        context.rate_limit_increments.clear()
+
+
+class EmitMetric(Step):
+    def __init__(self, element, compile_value) -> None:
+        self.name = element.get("name")
+        self.namespace = element.get("namespace", "API Management")
+        self.value = compile_value(element.get("value", "1"))
+        self.dimensions = [
+            (dimension.get("name"), compile_value(dimension.get("value")))
+            for dimension in element.findall("dimension")
+        ]
+
+    async def execute(self, context, gateway):
+        dimensions = tuple(
+            (name, str(value(context))) for name, value in self.dimensions
+        )
+        gateway.record_metric(
+            self.namespace, self.name, dimensions, float(self.value(context))
+        )
+
+
+SIMPLE_STEPS = {
+    "base": lambda element, compile_value: Base(),
+    "set-variable": SetVariable,
+    "set-backend-service": SetBackendService,
+    "cache-lookup-value": CacheLookupValue,
+    "cache-store-value": CacheStoreValue,
+    "forward-request": ForwardRequest,
+    "set-header": SetHeader,
+    "return-response": ReturnResponseStep,
+    "rate-limit-by-key": RateLimitByKey,
+    "emit-metric": EmitMetric,
+}
+BLOCK_STEPS = {"choose": Choose, "retry": Retry}
+DEFAULT_FORWARD_REQUEST = ForwardRequest(ElementTree.Element("forward-request"), None)
+
+
+@dataclass
+class Policy:
+    inbound: Steps
+    backend: Steps
+    outbound: Steps
+    on_error: Steps
+    # a backend section with only <base /> forwards the request
+    forwards_by_default: bool
+
+
+class PolicyCompiler:
+    """
+    Compiles policy XML into steps, replacing <include-fragment> with the fragment's policies
+    """
+
+    def __init__(
+        self, expressions: ExpressionRegistry, fragments: dict[str, str]
+    ) -> None:
+        """
+        Constructor
+
+        Parameters:
+            expressions (ExpressionRegistry): Python equivalents of the policy expressions
+            fragments (dict): Path of the XML file for each fragment ID
+        """
+        self.__expressions = expressions
+        self.__fragments = fragments
+
+    def compile_policy(self, path: str) -> Policy:
+        root = _parse(path)
+        sections = {}
+        for name in SECTIONS:
+            element = root.find(name)
+            sections[name] = (
+                self.__compile_steps(element, path)
+                if element is not None
+                else Steps([])
+            )
+        backend = root.find("backend")
+        forwards_by_default = backend is None or all(
+            child.tag == "base" for child in backend
+        )
+        return Policy(
+            inbound=sections["inbound"],
+            backend=sections["backend"],
+            outbound=sections["outbound"],
+            on_error=sections["on-error"],
+            forwards_by_default=forwards_by_default,
+        )
+
+    def __compile_steps(self, element, source: str) -> Steps:
+        def compile_value(value):
+            return self.__expressions.compile(value, source)
+
+        def compile_steps(child):
+            return self.__compile_steps(child, source)
+
+        steps = []
+        for child in element:
+            if child.tag == "include-fragment":
+                fragment_id = child.get("fragment-id")
+                if fragment_id not in self.__fragments:
+                    raise PolicyError(f"Unknown fragment '{fragment_id}' in {source}")
+                fragment_path = self.__fragments[fragment_id]
+                steps.append(self.__compile_steps(_parse(fragment_path), fragment_path))
+            elif child.tag in BLOCK_STEPS:
+                steps.append(
+                    BLOCK_STEPS[child.tag](child, compile_value, compile_steps)
+                )
+            elif child.tag in SIMPLE_STEPS:
+                steps.append(SIMPLE_STEPS[child.tag](child, compile_value))
+            else:
+                raise PolicyError(f"Unsupported policy <{child.tag}> in {source}")
+        return Steps(steps)
+
+
+async def run_policy(
+    policy: Policy, context: PolicyContext, gateway: GatewayServices
+) -> Response:
+    """
+    Run a request through the policy sections and return the response to send
+    """
+    try:
+        await policy.inbound.execute(context, gateway)
+        if policy.forwards_by_default:
+            await DEFAULT_FORWARD_REQUEST.execute(context, gateway)
+        else:
+            await policy.backend.execute(context, gateway)
+        await policy.outbound.execute(context, gateway)
+        response = context.response
+    except ReturnResponse as returned:
+        await context.response.discard()
+        response = returned.response
+    except Exception as error:
+        context.variables["last-error"] = error
+        await context.response.discard()
+        context.response = Response(status_code=500, reason="Internal Server Error")
+        context.response.body = str(error).encode("utf-8")
+        try:
+            await policy.on_error.execute(context, gateway)
+            response = context.response
+        except ReturnResponse as returned:
+            response = returned.response
+
+    context.response = response
+    RateLimitByKey.settle(context)
+    for name, value in context.rate_limit_headers.items():
+        response.headers.setdefault(name, value)
+    return response
+
+
+def _parse(path: str):
+    with open(path, encoding="utf-8") as file:
+        return ElementTree.fromstring(escape_expressions(file.read()))
+
+
+def escape_expressions(text: str) -> str:
+    """
+    Escape the policy expressions in policy XML so that it can be parsed as XML:
+    APIM accepts quotes and angle brackets in expressions in attributes (e.g. condition="@(context.Variables["x"] < 1)")
+    """
+    parts = []
+    position = 0
+    while match := EXPRESSION_OR_COMMENT.search(text, position):
+        parts.append(text[position : match.start()])
+        if match.group() == "<!--":
+            end = text.find("-->", match.end())
+            end = len(text) if end == -1 else end + 3
+            parts.append(text[match.start() : end])
+        else:
+            end = _find_closing(text, match.start() + 1)
+            expression = html.unescape(text[match.start() : end])
+            parts.append(html.escape(expression, quote=True))
+        position = end
+    parts.append(text[position:])
+    return "".join(parts)
+
+
+def _find_closing(text: str, start: int) -> int:
+    # index after the bracket closing the one at start, skipping C# string and character literals
+    opening = text[start]
+    closing = ")" if opening == "(" else "}"
+    depth = 0
+    index = start
+    while index < len(text):
+        character = text[index]
+        if character in "\"'":
+            index += 1
+            while index < len(text) and text[index] != character:
+                index += 2 if text[index] == "\\" else 1
+        elif character == opening:
+            depth += 1
+        elif character == closing:
+            depth -= 1
+            if depth == 0:
+                return index + 1
+        index += 1
+    raise PolicyError(
+        f"Unterminated policy expression: {text[start - 1 : start + 40]}..."
+    )
+
+
+def _normalize(expression: str) -> str:
+    return WHITESPACE.sub(" ", expression).strip()
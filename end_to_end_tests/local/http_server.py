@@ -0,0 +1,159 @@
+import gzip
+import json
+import sys
+import threading
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _QuietThreadingHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients closing kept-alive connections (e.g. when a load test stops) aren't errors
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+class LocalHttpServer:
+    """
+    Base class for the local HTTP stand-ins used to run and benchmark the tests offline.
+
+    Serves requests on a background thread with HTTP/1.1 keep-alive, and counts connections and requests.
+    Subclasses implement handle_request to return the response for each request.
+    JSON responses are gzipped when the client accepts gzip,
+    and iterators of bytes are streamed as server-sent events (one chunk per item, as they are generated).
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        """
+        Constructor
+
+        Parameters:
+            host (str): Address to listen on
+            port (int): Port to listen on (defaults to a free port)
+        """
+        self.__lock = threading.Lock()
+        self.request_count = 0
+        self.connection_count = 0
+        self.__server = _QuietThreadingHTTPServer(
+            (host, port), self.__create_handler_class()
+        )
+        self.__thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.__server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def handle_request(
+        self, method: str, path: str, headers, body: bytes
+    ) -> tuple[int, object]:
+        """
+        Returns the status code and body for a request.
+        The body can be bytes (sent as-is), an iterator of bytes (streamed as text/event-stream)
+        or an object to send as JSON.
+        """
+        raise NotImplementedError()
+
+    def start(self):
+        self.__thread = threading.Thread(
+            target=self.__server.serve_forever, daemon=True
+        )
+        self.__thread.start()
+
+    def serve_forever(self):
+        self.__server.serve_forever()
+
+    def stop(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+        if self.__thread:
+            self.__thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def __record_connection(self):
+        with self.__lock:
+            self.connection_count += 1
+
+    def __record_request(self):
+        with self.__lock:
+            self.request_count += 1
+
+    def __create_handler_class(self):
+        # bound here as private names would be mangled with the handler's class name inside the class
+        record_connection = self.__record_connection
+        record_request = self.__record_request
+        handle_request = self.handle_request
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # headers and body are written separately, so don't wait on delayed ACKs for kept-alive connections
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                record_connection()
+
+            def do_GET(self):
+                self.__handle()
+
+            def do_POST(self):
+                self.__handle()
+
+            def do_PATCH(self):
+                self.__handle()
+
+            def log_message(self, format, *args):
+                pass  # don't write a line to stderr for every request
+
+            def __handle(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                record_request()
+                status, response_body = handle_request(
+                    self.command, self.path, self.headers, body
+                )
+                self.__send(status, response_body)
+
+            def __send(self, status: int, body):
+                if isinstance(body, Iterator):
+                    self.__send_stream(status, body)
+                    return
+
+                content_type = "application/octet-stream"
+                if not isinstance(body, bytes):
+                    body = json.dumps(body).encode("utf-8")
+                    content_type = "application/json"
+                gzip_response = content_type == "application/json" and "gzip" in (
+                    self.headers.get("Accept-Encoding", "")
+                )
+                if gzip_response:
+                    body = gzip.compress(body)
+
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                if gzip_response:
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def __send_stream(self, status: int, chunks: Iterator[bytes]):
+                self.send_response(status)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for chunk in chunks:
+                    if chunk:
+                        self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                        self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+
+        return Handler
@@ -0,0 +1,166 @@
+import threading
+import time
+from datetime import datetime
+
+from azure.core.exceptions import HttpResponseError
+from azure.monitor.query import (
+    LogsBatchQuery,
+    LogsQueryError,
+    LogsQueryPartialResult,
+    LogsQueryResult,
+    LogsTable,
+)
+from typing import Any
+
+from common.log_analytics import MAX_QUERIES_PER_BATCH, MAX_ROWS_PER_QUERY
+
+
+def _create_table(columns: list[str], rows: list[list[Any]]) -> LogsTable:
+    # values are passed through as-is (the "dynamic" column type isn't converted by LogsTable)
+    return LogsTable(
+        columns=columns, columns_types=["dynamic"] * len(columns), rows=rows
+    )
+
+
+class FakeLogsQueryClient:
+    """
+    An in-memory stand-in for LogsQueryClient so that QueryProcessor can be run offline.
+
+    Results are registered against a fragment of query text and returned for any query
+    containing that fragment (the first matching registration wins). Queries that don't
+    match a registration return a LogsQueryError.
+
+    If a result is registered with a time_column, only the rows within the query's (start, end) timespan
+    are returned and results with more than max_rows rows are truncated (as Log Analytics does)
+    so that time-sliced queries can be run offline.
+
+    Example:
+        client = FakeLogsQueryClient()
+        client.add_result("summarize request_count", ["TimeGenerated", "request_count"], rows)
+        client.add_error("AppMetrics", "BadArgumentError", "Table not found")
+        query_processor = QueryProcessor(workspace_id="offline", token_credential=None, logs_query_client=client)
+    """
+
+    def __init__(
+        self, latency_seconds: float = 0.0, max_rows: int = MAX_ROWS_PER_QUERY
+    ) -> None:
+        """
+        Constructor
+
+        Parameters:
+            latency_seconds (float): Time to sleep for each request to simulate the round trip to Log Analytics
+            max_rows (int): Maximum number of rows to return for results registered with a time_column
+        """
+        self.__latency_seconds = latency_seconds
+        self.__max_rows = max_rows
+        self.__responses = []
+        self.__lock = threading.Lock()
+        self.request_count = 0
+        self.query_count = 0
+
+    def add_result(
+        self,
+        query_match: str,
+        columns: list[str],
+        rows: list[list[Any]],
+        time_column: str | None = None,
+    ):
+        """
+        Registers a successful result for queries containing query_match.
+        If time_column is set then only the rows in the query's timespan are returned (truncated to max_rows).
+        """
+        time_index = columns.index(time_column) if time_column else None
+
+        def create_response(timespan):
+            if time_index is None:
+                return LogsQueryResult(tables=[_create_table(columns, rows)])
+            return self.__create_time_filtered_response(
+                columns, rows, time_index, timespan
+            )
+
+        self.__responses.append((query_match, create_response))
+
+    def add_partial_result(
+        self,
+        query_match: str,
+        columns: list[str],
+        rows: list[list[Any]],
+        code: str,
+        message: str,
+    ):
+        """
+        Registers a partial result (e.g. a truncated result set) for queries containing query_match
+        """
+        self.__responses.append(
+            (
+                query_match,
+                lambda timespan: LogsQueryPartialResult(
+                    partial_data=[_create_table(columns, rows)],
+                    partial_error=LogsQueryError(code=code, message=message),
+                ),
+            )
+        )
+
+    def add_error(self, query_match: str, code: str, message: str):
+        """
+        Registers a failure for queries containing query_match
+        """
+        self.__responses.append(
+            (
+                query_match,
+                lambda timespan: LogsQueryError(code=code, message=message),
+            )
+        )
+
+    def query_workspace(self, workspace_id: str, query: str, timespan=None, **kwargs):
+        self.__record_request(query_count=1)
+        response = self.__get_response(query, timespan)
+        if isinstance(response, LogsQueryError):
+            # query_workspace raises for a failed query rather than returning the error
+            raise HttpResponseError(message=response.message)
+        return response
+
+    def query_batch(self, queries: list[LogsBatchQuery], **kwargs):
+        if len(queries) > MAX_QUERIES_PER_BATCH:
+            raise HttpResponseError(
+                message=f"Batch contains {len(queries)} queries, the maximum is {MAX_QUERIES_PER_BATCH}"
+            )
+        self.__record_request(query_count=len(queries))
+        return [
+            self.__get_response(query.body["query"], query.body.get("timespan"))
+            for query in queries
+        ]
+
+    def __record_request(self, query_count: int):
+        with self.__lock:
+            self.request_count += 1
+            self.query_count += query_count
+        if self.__latency_seconds > 0:
+            time.sleep(self.__latency_seconds)
+
+    def __get_response(self, query: str, timespan):
+        for query_match, create_response in self.__responses:
+            if query_match in query:
+                return create_response(timespan)
+        return LogsQueryError(
+            code="FakeNotFound", message="No fake result registered for query"
+        )
+
+    def __create_time_filtered_response(
+        self, columns: list[str], rows: list[list[Any]], time_index: int, timespan
+    ):
+        if isinstance(timespan, str) and "/" in timespan:
+            # batch queries have the timespan serialized as "<start>/<end>"
+            timespan = tuple(map(datetime.fromisoformat, timespan.split("/")))
+        if isinstance(timespan, tuple):
+            start, end = timespan
+            rows = [row for row in rows if start <= row[time_index] < end]
+        if len(rows) > self.__max_rows:
+            return LogsQueryPartialResult(
+                partial_data=[_create_table(columns, rows[: self.__max_rows])],
+                partial_error=LogsQueryError(
+                    code="E_QUERY_RESULT_SET_TOO_LARGE",
+                    message=f"The results of this query exceed the set limit of {self.__max_rows} records",
+                ),
+            )
+        return LogsQueryResult(tables=[_create_table(columns, rows)])
@@ -0,0 +1,427 @@
+"""
+A local stand-in for the OpenAI API simulator (completions, chat completions and embeddings)
+so that the scenario users, and the policies in the gateway emulator (local/gateway.py),
+can be run and benchmarked without deploying the simulator.
+
+Usage:
+    python -m local.simulator --port 8000
+    python -m local.simulator --port 8000 --no-rate-limits
+    python -m local.simulator --port 8000 --analytics-db local-analytics.db
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import math
+import os
+import random
+import re
+import sys
+import time
+from collections import deque
+
+from requests.structures import CaseInsensitiveDict
+
+from common.local_analytics import LocalAnalyticsWriter
+from common.token_estimation import estimate_prompt_tokens
+
+from .async_http import AsyncHttpServer, Response, json_response
+
+DEPLOYMENT_PATH = re.compile(
+    r"^/(?:openai/)?deployments/(?P<deployment>[^/]+)/(?P<operation>completions|chat/completions|embeddings)$"
+)
+# the deployments (and their token limits) of the deployed simulators
+DEPLOYMENT_CONFIG_PATH = os.path.normpath(
+    os.path.join(
+        os.path.dirname(__file__),
+        "..",
+        "..",
+        "infra",
+        "simulators",
+        "simulator_file_content",
+        "simulator_deployment_config.json",
+    )
+)
+# latency config names (as used by the simulator /++/config endpoint) for each operation
+LATENCY_CONFIG_NAMES = {
+    "completions": "open_ai_completions",
+    "chat/completions": "open_ai_chat_completions",
+    "embeddings": "open_ai_embeddings",
+}
+DEFAULT_COMPLETION_TOKENS = 10
+EMBEDDING_SIZE = 16
+# like Azure OpenAI, the simulator allows 6 requests per minute for each 1000 tokens per minute,
+# and counts tokens over a minute and requests over 10 seconds
+REQUESTS_PER_MINUTE_PER_1000_TOKENS = 6
+TOKEN_WINDOW_SECONDS = 60
+REQUEST_WINDOW_SECONDS = 10
+# the simulator's metric for the tokens counted against a deployment's rate limit
+RATE_LIMIT_TOKENS_METRIC = "aoai-api-simulator.tokens.rate-limit"
+
+
+class DeploymentRateLimit:
+    """
+    The simulator's rate limits for a deployment: tokens per minute and requests per 10 seconds, over sliding windows.
+    Requests count their prompt tokens plus max_tokens when they arrive, and rejected requests aren't counted.
+    """
+
+    def __init__(self, tokens_per_minute: int) -> None:
+        """
+        Constructor
+
+        Parameters:
+            tokens_per_minute (int): Token limit (tokensPerMinute in the deployment config)
+        """
+        self.tokens_per_minute = tokens_per_minute
+        self.requests_per_window = max(
+            1,
+            tokens_per_minute
+            * REQUESTS_PER_MINUTE_PER_1000_TOKENS
+            * REQUEST_WINDOW_SECONDS
+            // (1000 * 60),
+        )
+        # (time, tokens) for each request in the token window, and the time of each request in the request window
+        self.__tokens = deque()
+        self.__used_tokens = 0
+        self.__requests = deque()
+
+    def try_acquire(self, tokens: int, now: float) -> float | None:
+        """
+        Count a request if it is within the limits, otherwise return the seconds until it would be
+
+        Parameters:
+            tokens (int): Tokens that the request counts against the limit
+            now (float): Current time.monotonic()
+        """
+        self.__expire(now)
+        if len(self.__requests) >= self.requests_per_window:
+            return self.__requests[0] + REQUEST_WINDOW_SECONDS - now
+        if self.__used_tokens + tokens > self.tokens_per_minute:
+            if tokens > self.tokens_per_minute:
+                return TOKEN_WINDOW_SECONDS  # never allowed, but retry after the window like the simulator
+            # wait for enough of the earlier requests to leave the window
+            excess = self.__used_tokens + tokens - self.tokens_per_minute
+            for request_time, request_tokens in self.__tokens:
+                excess -= request_tokens
+                if excess <= 0:
+                    return request_time + TOKEN_WINDOW_SECONDS - now
+
+        self.__tokens.append((now, tokens))
+        self.__used_tokens += tokens
+        self.__requests.append(now)
+        return None
+
+    def remaining(self, now: float) -> tuple[int, int]:
+        """
+        Returns the tokens and requests left within the limits
+        """
+        self.__expire(now)
+        return (
+            self.tokens_per_minute - self.__used_tokens,
+            self.requests_per_window - len(self.__requests),
+        )
+
+    def __expire(self, now: float):
+        while self.__tokens and self.__tokens[0][0] <= now - TOKEN_WINDOW_SECONDS:
+            self.__used_tokens -= self.__tokens.popleft()[1]
+        while self.__requests and self.__requests[0] <= now - REQUEST_WINDOW_SECONDS:
+            self.__requests.popleft()
+
+
+def load_rate_limits(
+    path: str = DEPLOYMENT_CONFIG_PATH,
+) -> dict[str, DeploymentRateLimit]:
+    """
+    The rate limits for the deployments in a simulator deployment config file (simulator_deployment_config.json)
+    """
+    with open(path, encoding="utf-8") as file:
+        deployments = json.load(file)
+    return {
+        name: DeploymentRateLimit(int(deployment["tokensPerMinute"]))
+        for name, deployment in deployments.items()
+        if "tokensPerMinute" in deployment
+    }
+
+
+class FakeSimulatorServer(AsyncHttpServer):
+    """
+    A local HTTP stand-in for the OpenAI API simulator.
+
+    Returns canned responses (with token usage) for the completions, chat completions and embeddings endpoints
+    (streamed as server-sent events with one token per event for requests with "stream": true), and supports setting the latency
+    (mean and std_dev milliseconds per completion token, or per request for embeddings) with PATCH /++/config like the simulator
+    (config_update_count counts these calls, e.g. to check that test setup only runs once in a distributed run).
+    Latencies default to zero so that benchmarks measure the load generator rather than the server.
+
+    Requests to the deployments in the rate limits are limited like the simulator (see DeploymentRateLimit):
+    responses include the x-ratelimit-remaining-tokens and x-ratelimit-remaining-requests headers,
+    and requests over the limits get a 429 response with Retry-After. Other deployments aren't limited.
+    The tokens counted against the limits are recorded in the local analytics database as the simulator's
+    aoai-api-simulator.tokens.rate-limit metric if an analytics_writer is set (see common/local_analytics.py).
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        rate_limits: dict[str, DeploymentRateLimit] | None = None,
+        analytics_writer: LocalAnalyticsWriter | None = None,
+    ) -> None:
+        """
+        Constructor
+
+        Parameters:
+            host (str): Address to listen on
+            port (int): Port to listen on (defaults to a free port)
+            rate_limits (dict): Rate limits by deployment name (defaults to the deployed simulators' config, see load_rate_limits)
+            analytics_writer (LocalAnalyticsWriter): Writer to record metrics to the local analytics database with
+        """
+        super().__init__(host=host, port=port)
+        self.rate_limits = load_rate_limits() if rate_limits is None else rate_limits
+        self.__analytics_writer = analytics_writer
+        # (mean, std_dev) milliseconds by latency config name
+        self.__latencies = {}
+        self.config_update_count = 0
+
+    async def handle_request(
+        self, method: str, target: str, headers: CaseInsensitiveDict, body: bytes
+    ) -> Response:
+        path = target.split("?")[0]
+        if path == "/++/config" and method == "PATCH":
+            return self.__update_config(json.loads(body))
+
+        match = DEPLOYMENT_PATH.match(path)
+        if method != "POST" or match is None:
+            return json_response(404, {"error": {"message": "Not found"}})
+
+        operation = match.group("operation")
+        deployment = match.group("deployment")
+        request = json.loads(body) if body else {}
+        # count the prompt tokens like the gateway's prioritization policies (text, token IDs and message framing)
+        prompt_tokens = estimate_prompt_tokens(request)
+        if operation == "embeddings":
+            completion_tokens = 0
+        else:
+            completion_tokens = request.get("max_tokens") or DEFAULT_COMPLETION_TOKENS
+
+        rate_limit_headers = {}
+        rate_limit = self.rate_limits.get(deployment)
+        if rate_limit is not None:
+            now = time.monotonic()
+            retry_after = rate_limit.try_acquire(prompt_tokens + completion_tokens, now)
+            remaining_tokens, remaining_requests = rate_limit.remaining(now)
+            rate_limit_headers = {
+                "x-ratelimit-remaining-tokens": str(remaining_tokens),
+                "x-ratelimit-remaining-requests": str(remaining_requests),
+            }
+            if retry_after is not None:
+                return self.__rate_limited_response(retry_after, rate_limit_headers)
+            if self.__analytics_writer is not None:
+                tokens = prompt_tokens + completion_tokens
+                self.__analytics_writer.write(
+                    "AppMetrics",
+                    TimeGenerated=time.time(),
+                    Name=RATE_LIMIT_TOKENS_METRIC,
+                    Sum=tokens,
+                    Count=1,
+                    Min=tokens,
+                    Max=tokens,
+                    Properties={"deployment": deployment},
+                )
+
+        if request.get("stream"):
+            return Response(
+                status_code=200,
+                headers=CaseInsensitiveDict(
+                    {"Content-Type": "text/event-stream", **rate_limit_headers}
+                ),
+                stream=self.__stream_completion(
+                    operation, deployment, completion_tokens
+                ),
+            )
+
+        if operation == "embeddings":
+            await self.__sleep(operation, 1)
+            response_body = {
+                "object": "list",
+                "model": deployment,
+                "data": [
+                    {
+                        "object": "embedding",
+                        "index": 0,
+                        "embedding": [0.0] * EMBEDDING_SIZE,
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "total_tokens": prompt_tokens,
+                },
+            }
+            return self.__json_response(headers, response_body, rate_limit_headers)
+
+        await self.__sleep(operation, completion_tokens)
+        text = " ".join(["lorem"] * completion_tokens)
+        if operation == "completions":
+            choice = {"index": 0, "text": text, "finish_reason": "length"}
+            object_type = "text_completion"
+        else:
+            choice = {
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "length",
+            }
+            object_type = "chat.completion"
+        response_body = {
+            "id": f"cmpl-{self.request_count}",
+            "object": object_type,
+            "created": int(time.time()),
+            "model": deployment,
+            "choices": [choice],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+        return self.__json_response(headers, response_body, rate_limit_headers)
+
+    async def __stream_completion(
+        self, operation: str, deployment: str, completion_tokens: int
+    ):
+        chunk = {
+            "id": f"cmpl-{self.request_count}",
+            "object": (
+                "text_completion"
+                if operation == "completions"
+                else "chat.completion.chunk"
+            ),
+            "created": int(time.time()),
+            "model": deployment,
+        }
+        if operation != "completions":
+            # chat streams start with the role
+            yield _encode_event(
+                {
+                    **chunk,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "delta": {"role": "assistant", "content": ""},
+                            "finish_reason": None,
+                        }
+                    ],
+                }
+            )
+        for index in range(completion_tokens):
+            await self.__sleep(operation, 1)
+            text = "lorem" if index == 0 else " lorem"
+            finish_reason = "length" if index == completion_tokens - 1 else None
+            if operation == "completions":
+                choice = {"index": 0, "text": text, "finish_reason": finish_reason}
+            else:
+                choice = {
+                    "index": 0,
+                    "delta": {"content": text},
+                    "finish_reason": finish_reason,
+                }
+            yield _encode_event({**chunk, "choices": [choice]})
+        yield b"data: [DONE]\n\n"
+
+    def __update_config(self, config: dict) -> Response:
+        self.config_update_count += 1
+        for name, latency in config.get("latency", {}).items():
+            self.__latencies[name] = (
+                float(latency.get("mean", 0)),
+                float(latency.get("std_dev", 0)),
+            )
+        return json_response(200, {})
+
+    async def __sleep(self, operation: str, count: int):
+        """
+        Wait for the configured latency for count completion tokens (or embeddings requests)
+        """
+        mean, std_dev = self.__latencies.get(LATENCY_CONFIG_NAMES[operation], (0, 0))
+        latency_ms = random.gauss(mean, std_dev) if std_dev > 0 else mean
+        if latency_ms > 0:
+            await asyncio.sleep(latency_ms * count / 1000)
+
+    @staticmethod
+    def __rate_limited_response(retry_after: float, headers: dict) -> Response:
+        retry_after_seconds = max(math.ceil(retry_after), 1)
+        return json_response(
+            429,
+            {
+                "error": {
+                    "code": "429",
+                    "message": "Requests to the OpenAI API Simulator have exceeded call rate limit. "
+                    + f"Please retry after {retry_after_seconds} seconds.",
+                }
+            },
+            {
+                **headers,
+                "Retry-After": str(retry_after_seconds),
+                "retry-after-ms": str(max(int(retry_after * 1000), 0)),
+            },
+        )
+
+    @staticmethod
+    def __json_response(
+        request_headers: CaseInsensitiveDict, body: dict, headers: dict
+    ) -> Response:
+        response = json_response(200, body, headers)
+        if "gzip" in request_headers.get("Accept-Encoding", ""):
+            response.body = gzip.compress(response.body)
+            response.headers["Content-Encoding"] = "gzip"
+        return response
+
+
+def _encode_event(data: dict) -> bytes:
+    return b"data: " + json.dumps(data).encode("utf-8") + b"\n\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--deployment-config",
+        default=DEPLOYMENT_CONFIG_PATH,
+        help="Simulator deployment config file with the token limits for each deployment",
+    )
+    parser.add_argument(
+        "--no-rate-limits",
+        action="store_true",
+        help="Don't limit the tokens and requests for any deployment",
+    )
+    parser.add_argument(
+        "--analytics-db",
+        help="Local analytics database to record metrics to (see common/local_analytics.py)",
+    )
+    args = parser.parse_args()
+
+    rate_limits = (
+        {} if args.no_rate_limits else load_rate_limits(args.deployment_config)
+    )
+    analytics_writer = (
+        LocalAnalyticsWriter(args.analytics_db) if args.analytics_db else None
+    )
+    server = FakeSimulatorServer(
+        host=args.host,
+        port=args.port,
+        rate_limits=rate_limits,
+        analytics_writer=analytics_writer,
+    )
+    print(f"Listening on {server.base_url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if analytics_writer is not None:
+            analytics_writer.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
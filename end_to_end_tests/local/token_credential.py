@@ -0,0 +1,32 @@
+import threading
+import time
+
+from azure.core.credentials import AccessToken
+
+
+class FakeTokenCredential:
+    """
+    A stand-in for a TokenCredential that issues fake tokens so that query processors can be run offline.
+    """
+
+    def __init__(
+        self, latency_seconds: float = 0.0, expires_in_seconds: float = 3600
+    ) -> None:
+        """
+        Constructor
+
+        Parameters:
+            latency_seconds (float): Time to sleep for each token request to simulate the round trip to Entra ID
+            expires_in_seconds (float): Lifetime of the issued tokens
+        """
+        self.__latency_seconds = latency_seconds
+        self.__expires_in_seconds = expires_in_seconds
+        self.__lock = threading.Lock()
+        self.token_request_count = 0
+
+    def get_token(self, *scopes: str, **kwargs) -> AccessToken:
+        with self.__lock:
+            self.token_request_count += 1
+        if self.__latency_seconds > 0:
+            time.sleep(self.__latency_seconds)
+        return AccessToken("fake-token", int(time.time() + self.__expires_in_seconds))
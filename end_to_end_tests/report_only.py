@@ -0,0 +1,72 @@
+"""
+Re-render the results of the last run of a scenario from the query cache, without re-running the test
+or querying Log Analytics. This is useful when tweaking how the results are output (chart colours, columns etc.)
+
+Usage:
+    python end_to_end_tests/report_only.py end_to_end_tests/scenario_prioritization.py
+
+Set the same environment variables as for the test run (e.g. ENDPOINT_PATH) so that the scenario builds the same queries.
+Queries that have been added or changed since the run aren't in the cache and are reported as failed.
+"""
+
+# locust monkey patches the standard library so needs importing before the scenario's other dependencies
+import locust  # noqa: F401
+
+import argparse
+import importlib.util
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common.reporting import (  # noqa: E402
+    create_query_processor,
+    get_query_cache,
+    get_scenario_name,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Re-render the results of the last run of a scenario from the query cache"
+    )
+    parser.add_argument("scenario_file", help="Path to the scenario_*.py file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    query_cache = get_query_cache()
+    if not query_cache:
+        print("Query cache is disabled (QUERY_CACHE_DIR is empty)")
+        return 1
+
+    scenario_name = get_scenario_name(args.scenario_file)
+    try:
+        workspace_id, test_start_time, test_stop_time = query_cache.load_run(
+            scenario_name
+        )
+    except FileNotFoundError:
+        print(f"No cached run found for {scenario_name}")
+        return 1
+
+    spec = importlib.util.spec_from_file_location(scenario_name, args.scenario_file)
+    scenario = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(scenario)
+
+    logging.info(
+        "Rendering results for %s run from %s to %s",
+        scenario_name,
+        test_start_time,
+        test_stop_time,
+    )
+    start = time.perf_counter()
+    query_processor = create_query_processor(cache_only=True, workspace_id=workspace_id)
+    scenario.output_results(query_processor, test_start_time, test_stop_time)
+    logging.info("Rendered results in %.3fs", time.perf_counter() - start)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
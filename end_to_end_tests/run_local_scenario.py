@@ -0,0 +1,152 @@
+"""
+Run a scenario against a local simulator stand-in (local/simulator.py) to check it without deploying anything,
+e.g. that a distributed run (a master and several workers) only runs the test setup once.
+
+The stand-in takes the place of both APIM and the simulator deployments, and the Log Analytics report is skipped.
+With --gateway, the gateway emulator (local/gateway.py) takes the place of APIM and runs the capability policies
+for the API at --endpoint-path in front of the stand-in.
+With --report, the gateway logs and metrics are written to a local analytics database and the scenario report
+is run against it when the test stops (see common/local_analytics.py).
+
+Usage:
+    python end_to_end_tests/run_local_scenario.py scenario_prioritization.py --workers 4 --run-time 30
+    python end_to_end_tests/run_local_scenario.py scenario_prioritization.py --gateway \
+        --endpoint-path prioritization-token-calculating --run-time 60
+    python end_to_end_tests/run_local_scenario.py scenario_round_robin.py --gateway --report \
+        --endpoint-path round-robin-simple --users 2 --run-time 30
+"""
+
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+from contextlib import nullcontext
+
+from common.local_analytics import LocalAnalyticsWriter
+from local.gateway import GatewayEmulator, create_backends
+from local.simulator import FakeSimulatorServer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("test_file", help="Scenario file, e.g. scenario_round_robin.py")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="Number of worker processes (-1 for one per core, 0 to run in a single process)",
+    )
+    parser.add_argument(
+        "--users",
+        type=int,
+        default=-1,
+        help="Number of users (-1 for scenarios with a custom load shape)",
+    )
+    parser.add_argument("--run-time", type=int, default=30, help="Run time in seconds")
+    parser.add_argument(
+        "--endpoint-path",
+        default="local",
+        help="API path, e.g. round-robin-simple (required with --gateway)",
+    )
+    parser.add_argument(
+        "--gateway",
+        action="store_true",
+        help="Run the capability policies in the gateway emulator in front of the stand-in",
+    )
+    parser.add_argument(
+        "--report",
+        action="store_true",
+        help="Show the scenario report from a local analytics database (use with --gateway for the gateway logs)",
+    )
+    args = parser.parse_args()
+
+    test_root = os.path.dirname(os.path.abspath(__file__))
+    analytics_dir = tempfile.TemporaryDirectory() if args.report else None
+    analytics_writer = (
+        LocalAnalyticsWriter(os.path.join(analytics_dir.name, "local-analytics.db"))
+        if args.report
+        else None
+    )
+    with FakeSimulatorServer(analytics_writer=analytics_writer) as server, (
+        GatewayEmulator(
+            create_backends(*[server.base_url] * 3, "local"),
+            analytics_writer=analytics_writer,
+        )
+        if args.gateway
+        else nullcontext()
+    ) as gateway:
+        apim_url = gateway.base_url if gateway else server.base_url
+        host = f"{apim_url}/{args.endpoint_path}/" if gateway else f"{apim_url}/"
+        env = {
+            **os.environ,
+            "APIM_SUBSCRIPTION_ONE_KEY": "local",
+            "APIM_SUBSCRIPTION_TWO_KEY": "local",
+            "APIM_SUBSCRIPTION_THREE_KEY": "local",
+            "APIM_ENDPOINT": apim_url,
+            "SIMULATOR_ENDPOINT_PTU1": server.base_url,
+            "SIMULATOR_ENDPOINT_PAYG1": server.base_url,
+            "SIMULATOR_ENDPOINT_PAYG2": server.base_url,
+            "SIMULATOR_API_KEY": "local",
+            "ENDPOINT_PATH": args.endpoint_path,
+            "REPORT_RESULTS": "false",
+        }
+        if analytics_writer is not None:
+            env.update(
+                {
+                    "REPORT_RESULTS": "true",
+                    "ANALYTICS_BACKEND": "local",
+                    "LOCAL_ANALYTICS_DB": analytics_writer.path,
+                }
+            )
+        env.pop("APP_INSIGHTS_CONNECTION_STRING", None)
+
+        command = [
+            sys.executable,
+            "-m",
+            "locust",
+            "-f",
+            os.path.join(test_root, args.test_file),
+            "-H",
+            host,
+            "--headless",
+            "--only-summary",
+        ]
+        if args.users >= 0:
+            command += [
+                "--users",
+                str(args.users),
+                "--spawn-rate",
+                str(args.users),
+                "--run-time",
+                f"{args.run_time}s",
+            ]
+        if args.workers:
+            command += ["--processes", str(args.workers)]
+        process = subprocess.Popen(command, cwd=test_root, env=env)
+        try:
+            process.wait(timeout=args.run_time if args.users < 0 else None)
+        except subprocess.TimeoutExpired:
+            # load shapes ignore --run-time, so stop the test (this still fires test_stop)
+            process.send_signal(signal.SIGINT)
+            process.wait()
+
+        print(
+            f"\nStand-in received {server.request_count} requests "
+            + f"over {server.connection_count} connections, "
+            + f"{server.config_update_count} simulator config update(s)"
+        )
+        if gateway:
+            print(
+                f"Gateway emulator received {gateway.request_count} requests "
+                + f"over {gateway.connection_count} connections"
+            )
+    if analytics_writer is not None:
+        analytics_writer.close()
+        analytics_dir.cleanup()
+    return process.returncode
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,52 +3,71 @@ import logging
 import time
 
 import asciichartpy as asciichart
-from azure.identity import DefaultAzureCredential
+import gevent
 from locust import HttpUser, task, constant, events
 
 from common.log_analytics import (
     GroupDefinition,
     QueryProcessor,
 )
+from common.reporting import (
+    create_query_processor,
+    create_result_exporter,
+    export_raw_gateway_logs,
+    save_test_run,
+)
 from common.latency import (
+    get_latency_probe,
     measure_latency_and_update_apim,
     set_simulator_completions_latency,
     report_request_metric,
 )
+from common.latency_controller import (
+    LatencyRoutingController,
+    create_latency_routing_controller,
+)
+from common.open_loop import OpenLoopUser, open_loop_task
+from common.payload_corpus import TokenSize, get_payload_sampler
+from common.runners import master_only
+from common.users import post_json
 from common.config import (
     apim_subscription_one_key,
     app_insights_connection_string,
+    latency_controller_interval_seconds,
     simulator_endpoint_payg1,
     simulator_endpoint_payg2,
-    tenant_id,
-    subscription_id,
-    resource_group_name,
-    log_analytics_workspace_id,
-    log_analytics_workspace_name,
+    query_parallelism,
+    query_batch,
+    report_results,
 )
 
 test_start_time = None
+latency_controller: LatencyRoutingController | None = None
+latency_controller_greenlet = None
 deployment_name = "gpt-35-turbo-100m-token"
+completion_payloads = get_payload_sampler(
+    "completions",
+    "gpt-5-turbo-1",
+    default_records=[{"prompt": "Once upon a time"}],
+    default_token_mix=[TokenSize(None, 100)],
+)
 
 
-class CompletionUser(HttpUser):
+class CompletionUser(OpenLoopUser):
     """
     CompletionUser makes calls to the OpenAI Completions endpoint to show traffic via APIM
     """
 
-    wait_time = constant(1)  # wait 1 second between requests
+    closed_loop_wait_time = constant(1)  # wait 1 second between requests
 
     @task
+    @open_loop_task
     def get_completion(self):
         url = f"openai/deployments/{deployment_name}/completions?api-version=2023-05-15"
-        payload = {
-            "model": "gpt-5-turbo-1",
-            "prompt": "Once upon a time",
-            "max_tokens": 100,
-        }
-        self.client.post(
+        post_json(
+            self.client,
             url,
-            json=payload,
+            completion_payloads.sample().body,
             headers={"api-key": apim_subscription_one_key},
         )
 
@@ -67,15 +86,13 @@ class TestCoordinationUser(HttpUser):
 
         # Measure the latencies and update APIM
         # The load test repeatedly does this to simulate the scheduled task that would run in production
-        logging.info("⌚ Measuring latencies and updating APIM")
-        measure_latency_and_update_apim()
+        measure_latencies()
 
         # Run for 1 minute
         time.sleep(60)
 
         # Measure the latencies and update APIM
-        logging.info("⌚ Measuring latencies and updating APIM")
-        measure_latency_and_update_apim()
+        measure_latencies()
 
         # Reverse the latencies
         # Note that this happening _after_ the latency measurement
@@ -89,19 +106,45 @@ class TestCoordinationUser(HttpUser):
         time.sleep(60)
 
         # Measure the latencies and update APIM
-        logging.info("⌚ Measuring latencies and updating APIM")
-        measure_latency_and_update_apim()
+        measure_latencies()
 
         # Run for 1 minute
         time.sleep(60)
 
         # Measure the latencies and update APIM
-        logging.info("⌚ Measuring latencies and updating APIM")
-        measure_latency_and_update_apim()
+        measure_latencies()
 
         time.sleep(60)  # sleep for 2 minutes
 
 
+def measure_latencies():
+    if latency_controller_interval_seconds:
+        # the latency routing controller updates APIM on its own schedule
+        return
+    logging.info("⌚ Measuring latencies and updating APIM")
+    measure_latency_and_update_apim()
+
+
+def run_latency_controller():
+    """
+    Run the latency routing controller (see common/latency_controller.py) in place of the scheduled task
+    that would run in production: probe the backends every LATENCY_CONTROLLER_INTERVAL_SECONDS
+    and update APIM only when the order of the backends changes
+    """
+    while True:
+        try:
+            if latency_controller.step():
+                state = latency_controller.state
+                logging.info(
+                    "⌚ Latency routing controller updated the preferred backends: %s (weights %s)",
+                    state.preferred_backends,
+                    state.weights,
+                )
+        except Exception:
+            logging.exception("Failed to update the preferred backends")
+        gevent.sleep(latency_controller_interval_seconds)
+
+
 @events.init.add_listener
 def on_locust_init(environment, **kwargs):
     """
@@ -120,6 +163,7 @@ def on_locust_init(environment, **kwargs):
 
 
 @events.test_start.add_listener
+@master_only
 def on_test_start(environment, **kwargs):
     """
     Initialize simulator/APIM
@@ -133,28 +177,43 @@ def on_test_start(environment, **kwargs):
     set_simulator_completions_latency(simulator_endpoint_payg2, 100)
 
     time.sleep(1)
-    logging.info("⌚ Measuring API latencies and updating APIM")
-    measure_latency_and_update_apim()
+    if latency_controller_interval_seconds:
+        global latency_controller, latency_controller_greenlet
+        logging.info(
+            "⌚ Starting the latency routing controller (every %ss)",
+            latency_controller_interval_seconds,
+        )
+        latency_controller = create_latency_routing_controller(get_latency_probe())
+        latency_controller_greenlet = gevent.spawn(run_latency_controller)
+    else:
+        logging.info("⌚ Measuring API latencies and updating APIM")
+        measure_latency_and_update_apim()
 
     logging.info("👟 Test setup done")
     logging.info("🚀 Running test...")
 
 
 @events.test_stop.add_listener
+@master_only
 def on_test_stop(environment, **kwargs):
     """
     Collect metrics and show results
     """
     test_stop_time = datetime.now(UTC)
     logging.info("✔️ Test finished")
+    if latency_controller_greenlet is not None:
+        latency_controller_greenlet.kill()
+        state = latency_controller.state
+        logging.info(
+            "⌚ Latency routing controller made %s updates from %s probes",
+            state.update_count,
+            state.probe_count,
+        )
+    if not report_results:
+        return
 
-    query_processor = QueryProcessor(
-        workspace_id=log_analytics_workspace_id,
-        token_credential=DefaultAzureCredential(),
-        tenant_id=tenant_id,
-        subscription_id=subscription_id,
-        resource_group_name=resource_group_name,
-        workspace_name=log_analytics_workspace_name,
+    query_processor = create_query_processor(
+        exporter=create_result_exporter(__file__, test_start_time)
     )
 
     metric_check_time = test_stop_time - timedelta(seconds=10)
@@ -165,6 +224,17 @@ def on_test_stop(environment, **kwargs):
     """
     query_processor.wait_for_non_zero_count(check_results_query)
 
+    save_test_run(__file__, test_start_time, test_stop_time)
+    output_results(query_processor, test_start_time, test_stop_time)
+    export_raw_gateway_logs(query_processor, test_start_time, test_stop_time)
+
+
+def output_results(
+    query_processor: QueryProcessor, test_start_time: datetime, test_stop_time: datetime
+):
+    """
+    Show the test results (also used by report_only.py to re-render the results from the query cache)
+    """
     time_range = f"TimeGenerated > datetime({test_start_time.strftime('%Y-%m-%dT%H:%M:%SZ')}) and TimeGenerated < datetime({test_stop_time.strftime('%Y-%m-%dT%H:%M:%SZ')})"
 
     query_processor.add_query(
@@ -192,6 +262,14 @@ ApiManagementGatewayLogs
             value_column="latency_s",
             missing_value=float("nan"),
         ),
+        local_query="""
+SELECT bin(TimeGenerated, 10) AS TimeGenerated, BackendId, AVG(TotalTime) AS latency_s
+FROM ApiManagementGatewayLogs
+WHERE OperationName != '' AND TimeGenerated > :start AND TimeGenerated < :end
+AND BackendId != ''
+GROUP BY 1, 2
+ORDER BY TimeGenerated
+        """.strip(),
         timespan=(test_start_time, test_stop_time),
         show_query=True,
         include_link=True,
@@ -222,11 +300,21 @@ ApiManagementGatewayLogs
             value_column="request_count",
             missing_value=float("nan"),
         ),
+        local_query="""
+SELECT bin(TimeGenerated, 10) AS TimeGenerated, BackendId, COUNT(*) AS request_count
+FROM ApiManagementGatewayLogs
+WHERE OperationName != '' AND TimeGenerated > :start AND TimeGenerated < :end
+AND BackendId != ''
+GROUP BY 1, 2
+ORDER BY TimeGenerated
+        """.strip(),
         timespan=(test_start_time, test_stop_time),
         show_query=True,
         include_link=True,
     )
 
     query_processor.run_queries(
-        all_queries_link_text="Show all queries in Log Analytics"
+        all_queries_link_text="Show all queries in Log Analytics",
+        parallelism=query_parallelism,
+        batch=query_batch,
     )
@@ -2,65 +2,45 @@ from datetime import datetime, timedelta, UTC
 import logging
 
 import asciichartpy as asciichart
-from azure.identity import DefaultAzureCredential
-from locust import HttpUser, LoadTestShape, task, constant, events
+from locust import LoadTestShape, task, constant, events
 
 from common.log_analytics import (
     GroupDefinition,
     QueryProcessor,
 )
+from common.reporting import (
+    create_query_processor,
+    create_result_exporter,
+    export_raw_gateway_logs,
+    save_test_run,
+)
 from common.latency import (
     set_simulator_chat_completions_latency,
     report_request_metric,
 )
+from common.open_loop import OpenLoopUser, open_loop_task
+from common.payload_corpus import TokenSize, get_payload_sampler
+from common.runners import master_only
+from common.streaming import post_json_stream
+from common.users import post_json
 from common.config import (
     apim_subscription_one_key,
+    chat_streaming,
     simulator_endpoint_ptu1,
     simulator_endpoint_payg1,
-    tenant_id,
-    subscription_id,
-    resource_group_name,
     app_insights_connection_string,
-    log_analytics_workspace_id,
-    log_analytics_workspace_name,
+    query_parallelism,
+    query_batch,
+    report_results,
 )
 
 test_start_time = None
 deployment_name = "gpt-35-turbo-100k-token"
-
-
-class StagesShape(LoadTestShape):
-    """
-    Custom LoadTestShape to simulate a spike in traffic part way through the test
-    """
-
-    # See https://docs.locust.io/en/stable/custom-load-shape.html
-    stages = [
-        {"duration": 180, "users": 2, "spawn_rate": 0.1},
-        {"duration": 360, "users": 6, "spawn_rate": 1},
-    ]
-
-    def tick(self):
-        run_time = self.get_run_time()
-
-        for stage in self.stages:
-            if run_time < stage["duration"]:
-                return (stage["users"], stage["spawn_rate"])
-
-        return None
-
-
-class ChatCompletionUser(HttpUser):
-    """
-    CompletionUser makes calls to the OpenAI Chat Completions endpoint to show traffic via APIM
-    """
-
-    wait_time = constant(1)  # wait 1 second between requests
-
-    @task
-    def get_completion(self):
-        url = f"openai/deployments/{deployment_name}/chat/completions?api-version=2023-05-15"
-        payload = {
+chat_completion_payloads = get_payload_sampler(
+    "chat",
+    "gpt-5-turbo-1",
+    default_records=[
+        {
             "messages": [
                 {"role": "user", "content": "Lorem ipsum dolor sit amet?"},
                 {
@@ -103,16 +83,53 @@ class ChatCompletionUser(HttpUser):
                     "content": "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut labore et dolore magna aliqua. Ut enim ad minim veniam, quis nostrud exercitation ullamco laboris nisi ut aliquip ex ea commodo consequat. Duis aute irure dolor in reprehenderit in voluptate velit esse cillum dolore eu fugiat nulla pariatur. Excepteur sint occaecat cupidatat non proident, sunt in culpa qui officia deserunt mollit anim id est laborum.",
                 },
                 {"role": "user", "content": "Duis aute irure dolor in reprehenderit?"},
-            ],
-            "model": "gpt-5-turbo-1",
-            "max_tokens": 1000,
+            ]
         }
+    ],
+    default_token_mix=[TokenSize(None, 1000)],
+    stream=chat_streaming,
+)
+
+
+class StagesShape(LoadTestShape):
+    """
+    Custom LoadTestShape to simulate a spike in traffic part way through the test
+    """
+
+    # See https://docs.locust.io/en/stable/custom-load-shape.html
+    stages = [
+        {"duration": 180, "users": 2, "spawn_rate": 0.1},
+        {"duration": 360, "users": 6, "spawn_rate": 1},
+    ]
+
+    def tick(self):
+        run_time = self.get_run_time()
+
+        for stage in self.stages:
+            if run_time < stage["duration"]:
+                return (stage["users"], stage["spawn_rate"])
+
+        return None
+
+
+class ChatCompletionUser(OpenLoopUser):
+    """
+    CompletionUser makes calls to the OpenAI Chat Completions endpoint to show traffic via APIM
+    """
+
+    closed_loop_wait_time = constant(1)  # wait 1 second between requests
+
+    @task
+    @open_loop_task
+    def get_completion(self):
+        url = f"openai/deployments/{deployment_name}/chat/completions?api-version=2023-05-15"
+        body = chat_completion_payloads.sample().body
+        headers = {"api-key": apim_subscription_one_key}
         try:
-            self.client.post(
-                url,
-                json=payload,
-                headers={"api-key": apim_subscription_one_key},
-            )
+            if chat_streaming:
+                post_json_stream(self.client, url, body, headers)
+            else:
+                post_json(self.client, url, body, headers)
         except Exception as e:
             print()
             logging.error(e)
@@ -137,6 +154,7 @@ def on_locust_init(environment, **kwargs):
 
 
 @events.test_start.add_listener
+@master_only
 def on_test_start(environment, **kwargs):
     """
     Initialize simulator/APIM
@@ -154,20 +172,18 @@ def on_test_start(environment, **kwargs):
 
 
 @events.test_stop.add_listener
+@master_only
 def on_test_stop(environment, **kwargs):
     """
     Collect metrics and show results
     """
     test_stop_time = datetime.now(UTC)
     logging.info("✔️ Test finished")
+    if not report_results:
+        return
 
-    query_processor = QueryProcessor(
-        workspace_id=log_analytics_workspace_id,
-        token_credential=DefaultAzureCredential(),
-        tenant_id=tenant_id,
-        subscription_id=subscription_id,
-        resource_group_name=resource_group_name,
-        workspace_name=log_analytics_workspace_name,
+    query_processor = create_query_processor(
+        exporter=create_result_exporter(__file__, test_start_time)
     )
 
     metric_check_time = test_stop_time - timedelta(seconds=10)
@@ -178,6 +194,17 @@ def on_test_stop(environment, **kwargs):
     """
     query_processor.wait_for_non_zero_count(check_results_query)
 
+    save_test_run(__file__, test_start_time, test_stop_time)
+    output_results(query_processor, test_start_time, test_stop_time)
+    export_raw_gateway_logs(query_processor, test_start_time, test_stop_time)
+
+
+def output_results(
+    query_processor: QueryProcessor, test_start_time: datetime, test_stop_time: datetime
+):
+    """
+    Show the test results (also used by report_only.py to re-render the results from the query cache)
+    """
     time_range = f"TimeGenerated > datetime({test_start_time.strftime('%Y-%m-%dT%H:%M:%SZ')}) and TimeGenerated < datetime({test_stop_time.strftime('%Y-%m-%dT%H:%M:%SZ')})"
 
     query_processor.add_query(
@@ -200,6 +227,14 @@ ApiManagementGatewayLogs
                 asciichart.blue,
             ],
         },
+        local_query="""
+SELECT bin(TimeGenerated, 10) AS TimeGenerated, COUNT(*) AS request_count
+FROM ApiManagementGatewayLogs
+WHERE OperationName != '' AND TimeGenerated > :start AND TimeGenerated < :end
+AND BackendId != ''
+GROUP BY 1
+ORDER BY TimeGenerated
+        """.strip(),
         timespan=(test_start_time, test_stop_time),
         show_query=True,
         include_link=True,
@@ -230,11 +265,21 @@ ApiManagementGatewayLogs
             value_column="request_count",
             missing_value=float("nan"),
         ),
+        local_query="""
+SELECT bin(TimeGenerated, 10) AS TimeGenerated, BackendId, COUNT(*) AS request_count
+FROM ApiManagementGatewayLogs
+WHERE OperationName != '' AND TimeGenerated > :start AND TimeGenerated < :end
+AND BackendId != ''
+GROUP BY 1, 2
+ORDER BY TimeGenerated
+        """.strip(),
         timespan=(test_start_time, test_stop_time),
         show_query=True,
         include_link=True,
     )
 
     query_processor.run_queries(
-        all_queries_link_text="Show all queries in Log Analytics"
+        all_queries_link_text="Show all queries in Log Analytics",
+        parallelism=query_parallelism,
+        batch=query_batch,
     )
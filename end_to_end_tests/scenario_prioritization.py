@@ -3,28 +3,46 @@ import logging
 import os
 
 import asciichartpy as asciichart
-from azure.identity import DefaultAzureCredential
-from locust import HttpUser, LoadTestShape, task, constant, events
+import gevent
+from locust import task, constant, events
 from locust.clients import HttpSession
+from locust.contrib.fasthttp import FastHttpSession
 from opentelemetry import metrics
 
 from common.log_analytics import (
     GroupDefinition,
     QueryProcessor,
 )
+from common.reporting import (
+    create_query_processor,
+    create_result_exporter,
+    export_raw_gateway_logs,
+    save_test_run,
+)
 from common.latency import (
     set_simulator_chat_completions_latency,
     report_request_metric,
 )
+from common.load_shapes import Stage, UserMix, UserMixShape
+from common.metric_aggregation import CounterAggregator
+from common.open_loop import OpenLoopUser, open_loop_task
+from common.payload_corpus import (
+    Payload,
+    PayloadSampler,
+    TokenSize,
+    get_payload_sampler,
+)
+from common.runners import master_only
+from common.streaming import post_json_stream
+from common.users import get_reason, post_json
 from common.config import (
     apim_subscription_one_key,
+    chat_streaming,
     simulator_endpoint_payg1,
-    tenant_id,
-    subscription_id,
-    resource_group_name,
     app_insights_connection_string,
-    log_analytics_workspace_id,
-    log_analytics_workspace_name,
+    query_parallelism,
+    query_batch,
+    report_results,
 )
 
 load_pattern = os.getenv("LOAD_PATTERN", "cycle")
@@ -38,6 +56,23 @@ test_start_time = None
 embedding_deployment_name = "embedding100k"
 chat_deployment_name = "gpt-35-turbo-100k-token"
 
+input_text = "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut labore et dolore magna aliqua. Habitant morbi tristique senectus et netus et malesuada. Bibendum neque egestas congue quisque egestas diam. Rutrum quisque non tellus orci ac auctor augue. Diam in arcu cursus euismod quis. Euismod elementum nisi quis eleifend quam adipiscing. Posuere lorem ipsum dolor sit amet consectetur adipiscing elit duis. Pretium vulputate sapien nec sagittis aliquam malesuada bibendum arcu. Adipiscing diam donec adipiscing tristique risus nec. Nec ultrices dui sapien eget mi proin. Odio facilisis mauris sit amet. Eget aliquet nibh praesent tristique magna. Malesuada nunc vel risus commodo viverra maecenas accumsan lacus vel. Maecenas volutpat blandit aliquam etiam erat velit scelerisque in dictum. Venenatis tellus in metus vulputate. Aliquet enim tortor at auctor urna nunc id cursus metus. Sed velit dignissim sodales ut eu sem integer vitae justo."
+embedding_payloads = get_payload_sampler(
+    "embeddings",
+    "embedding",
+    default_records=[{"prompt": input_text}],
+    default_token_mix=[TokenSize(None, 0)],
+)
+chat_prompts = [
+    {
+        "messages": [
+            {"role": "user", "content": "Lorem ipsum dolor sit amet?"},
+        ]
+    }
+]
+# the chat users send a fixed max_tokens, so there's a sampler for each value
+chat_payloads = {}
+
 
 print(f"Load pattern: {load_pattern}")
 print(f"Ramp rate: {ramp_rate}")
@@ -47,11 +82,15 @@ print(f"Request type: {request_type}")
 print(f"Endpoint path: {endpoint_path}")
 if request_type == "chat":
     print(f"Max tokens: {max_tokens}")
+    print(f"Streaming: {chat_streaming}")
 elif max_tokens > 0:
     raise ValueError("Max tokens should not be set for non-chat requests")
 
-histogram_request_result = metrics.get_meter(__name__).create_histogram(
-    "locust.request_result", "Request Response", "count"
+request_result = CounterAggregator(
+    metrics.get_meter(__name__).create_counter(
+        "locust.request_result", "Request Response", "count"
+    ),
+    attribute_names=("status_code", "priority", "request_type", "reason"),
 )
 
 # TODO - this file is getting large - consider splitting
@@ -63,22 +102,34 @@ histogram_request_result = metrics.get_meter(__name__).create_histogram(
 #  - 600 RPM (10 RPS)
 
 
-def make_request(client: HttpSession, low_priority: bool):
+def get_request_payloads() -> PayloadSampler:
     if request_type == "embeddings":
-        make_embedding_request(client, low_priority)
+        return embedding_payloads
     elif request_type == "chat":
-        make_chat_request(client, low_priority, max_tokens)
+        return get_chat_payloads(max_tokens)
     else:
         raise ValueError(f"Unhandled request type: {request_type}")
 
 
-def make_embedding_request(client: HttpSession, low_priority: bool):
+def make_request(
+    client: HttpSession | FastHttpSession,
+    low_priority: bool,
+    payload: Payload | None = None,
+):
+    if request_type == "embeddings":
+        make_embedding_request(client, low_priority, payload)
+    elif request_type == "chat":
+        make_chat_request(client, low_priority, max_tokens, payload)
+    else:
+        raise ValueError(f"Unhandled request type: {request_type}")
+
+
+def make_embedding_request(
+    client: HttpSession | FastHttpSession,
+    low_priority: bool,
+    payload: Payload | None = None,
+):
     url = f"openai/deployments/{embedding_deployment_name}/embeddings?api-version=2023-05-15"
-    input_text = "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut labore et dolore magna aliqua. Habitant morbi tristique senectus et netus et malesuada. Bibendum neque egestas congue quisque egestas diam. Rutrum quisque non tellus orci ac auctor augue. Diam in arcu cursus euismod quis. Euismod elementum nisi quis eleifend quam adipiscing. Posuere lorem ipsum dolor sit amet consectetur adipiscing elit duis. Pretium vulputate sapien nec sagittis aliquam malesuada bibendum arcu. Adipiscing diam donec adipiscing tristique risus nec. Nec ultrices dui sapien eget mi proin. Odio facilisis mauris sit amet. Eget aliquet nibh praesent tristique magna. Malesuada nunc vel risus commodo viverra maecenas accumsan lacus vel. Maecenas volutpat blandit aliquam etiam erat velit scelerisque in dictum. Venenatis tellus in metus vulputate. Aliquet enim tortor at auctor urna nunc id cursus metus. Sed velit dignissim sodales ut eu sem integer vitae justo."
-    payload = {
-        "input": input_text,
-        "model": "embedding",
-    }
     try:
         headers = {
             "api-key": apim_subscription_one_key,
@@ -86,31 +137,43 @@ def make_embedding_request(client: HttpSession, low_priority: bool):
         if low_priority:
             headers["x-priority"] = "low"
 
-        r = client.post(url, json=payload, headers=headers)
-        histogram_request_result.record(
+        payload = payload or embedding_payloads.sample()
+        r = post_json(client, url, payload.body, headers)
+        request_result.add(
             1,
-            {
-                "status_code": str(r.status_code),
-                "priority": "low" if low_priority else "high",
-                "request_type": "embeddings",
-                "reason": r.reason,
-            },
+            (
+                str(r.status_code),
+                "low" if low_priority else "high",
+                "embeddings",
+                get_reason(r),
+            ),
         )
     except Exception as e:
         logging.error(e)
         raise
 
 
-def make_chat_request(client: HttpSession, low_priority: bool, max_tokens: int = 0):
+def get_chat_payloads(max_tokens: int):
+    payloads = chat_payloads.get(max_tokens)
+    if payloads is None:
+        payloads = chat_payloads[max_tokens] = get_payload_sampler(
+            "chat",
+            "gpt-35-turbo",
+            default_records=chat_prompts,
+            default_token_mix=[TokenSize(None, max_tokens)],
+            max_tokens=max_tokens,
+            stream=chat_streaming,
+        )
+    return payloads
+
+
+def make_chat_request(
+    client: HttpSession | FastHttpSession,
+    low_priority: bool,
+    max_tokens: int = 0,
+    payload: Payload | None = None,
+):
     url = f"openai/deployments/{chat_deployment_name}/chat/completions?api-version=2023-05-15"
-    payload = {
-        "messages": [
-            {"role": "user", "content": "Lorem ipsum dolor sit amet?"},
-        ],
-        "model": "gpt-35-turbo",
-    }
-    if max_tokens > 0:
-        payload["max_tokens"] = max_tokens
     try:
         headers = {
             "api-key": apim_subscription_one_key,
@@ -119,172 +182,225 @@ def make_chat_request(client: HttpSession, low_priority: bool, max_tokens: int =
         if low_priority:
             headers["x-priority"] = "low"
 
-        r = client.post(url, json=payload, headers=headers)
-        histogram_request_result.record(
+        payload = payload or get_chat_payloads(max_tokens).sample()
+        if chat_streaming:
+            r = post_json_stream(client, url, payload.body, headers).response
+        else:
+            r = post_json(client, url, payload.body, headers)
+        request_result.add(
             1,
-            {
-                "status_code": str(r.status_code),
-                "priority": "low" if low_priority else "high",
-                "request_type": "chat",
-                "reason": r.reason,
-            },
+            (
+                str(r.status_code),
+                "low" if low_priority else "high",
+                "chat",
+                get_reason(r),
+            ),
         )
     except Exception as e:
         logging.error(e)
         raise
 
 
-class HighPriorityUser(HttpUser):
+class HighPriorityUser(OpenLoopUser):
     """
     HighPriorityUser makes calls to the OpenAI endpoint to show traffic via APIM
     """
 
-    wait_time = constant(1)  # wait 1 second between requests
+    closed_loop_wait_time = constant(1)  # wait 1 second between requests
 
     @task
+    @open_loop_task
     def make_request_high_priority(self):
         make_request(self.client, False)
 
 
-class LowPriorityUser(HttpUser):
+class LowPriorityUser(OpenLoopUser):
     """
     LowPriorityUser makes calls to the OpenAI endpoint to show traffic via APIM and sets the x-priority header to "low"
     """
 
-    wait_time = constant(1)  # wait 1 second between requests
+    closed_loop_wait_time = constant(1)  # wait 1 second between requests
 
     @task
+    @open_loop_task
     def make_request_low_priority(self):
         make_request(self.client, True)
 
 
-class MixedUser_1_1(HttpUser):
+class MixedUser_1_1(OpenLoopUser):
     """
     MixedUser_1_1 makes calls to the OpenAI endpoint to show traffic via APIM.
     It has a 1:1 ratio of high to low priority requests.
     """
 
-    wait_time = constant(1)  # wait 1 second between requests
+    closed_loop_wait_time = constant(1)  # wait 1 second between requests
 
     @task
+    @open_loop_task
     def make_request_high_priority(self):
         make_request(self.client, False)
 
     @task
+    @open_loop_task
     def make_request_low_priority(self):
         make_request(self.client, True)
 
 
-class HighPriorityLowTokenChatUser(HttpUser):
-    wait_time = constant(1)  # wait 1 second between requests
+class HighPriorityLowTokenChatUser(OpenLoopUser):
+    closed_loop_wait_time = constant(1)  # wait 1 second between requests
 
     @task
+    @open_loop_task
     def get_completion_high_priority(self):
         make_chat_request(self.client, False, 200)
 
 
-class HighPriorityHighTokenChatUser(HttpUser):
-    wait_time = constant(1)  # wait 1 second between requests
+class HighPriorityHighTokenChatUser(OpenLoopUser):
+    closed_loop_wait_time = constant(1)  # wait 1 second between requests
 
     @task
+    @open_loop_task
     def get_completion_high_priority(self):
         make_chat_request(self.client, False, 1000)
 
 
-class LowPriorityLowTokenChatUser(HttpUser):
-    wait_time = constant(1)  # wait 1 second between requests
+class LowPriorityLowTokenChatUser(OpenLoopUser):
+    closed_loop_wait_time = constant(1)  # wait 1 second between requests
 
     @task
+    @open_loop_task
     def get_completion_low_priority(self):
         make_chat_request(self.client, True, 200)
 
 
-class MixedPriorityLowTokenChatUser(HttpUser):
-    wait_time = constant(1)  # wait 1 second between requests
+class MixedPriorityLowTokenChatUser(OpenLoopUser):
+    closed_loop_wait_time = constant(1)  # wait 1 second between requests
 
     @task
+    @open_loop_task
     def get_completion_high_priority(self):
         make_chat_request(self.client, False, 200)
 
     @task
+    @open_loop_task
     def get_completion_low_priority(self):
         make_chat_request(self.client, True, 200)
 
 
-class MixedPriorityHighTokenChatUser(HttpUser):
-    wait_time = constant(1)  # wait 1 second between requests
+class MixedPriorityHighTokenChatUser(OpenLoopUser):
+    closed_loop_wait_time = constant(1)  # wait 1 second between requests
 
     @task
+    @open_loop_task
     def get_completion_high_priority(self):
         make_chat_request(self.client, False, 1000)
 
     @task
+    @open_loop_task
     def get_completion_low_priority(self):
         make_chat_request(self.client, True, 1000)
 
 
+# number of users with each priority in each stage (see common/load_shapes.py)
+# users switch priority rather than being stopped and restarted, so the load is continuous between stages
+priority_mix = UserMix()
+
+
+class PriorityMixUser(OpenLoopUser):
+    """
+    PriorityMixUser makes calls to the OpenAI endpoint to show traffic via APIM.
+    Its priority is set by StagesShape (via priority_mix) and can change between requests.
+    When the stage targets tokens per minute for its priority, its requests are paced to that rate.
+    """
+
+    def closed_loop_wait_time(self):
+        if priority_mix.is_paced(priority_mix.get_profile(self)):
+            # the requests are paced by priority_mix instead
+            return 0
+        return 1  # wait 1 second between requests
+
+    @task
+    @open_loop_task
+    def make_request_for_priority(self):
+        priority = priority_mix.get_profile(self)
+        if priority is None:
+            # StagesShape hasn't sent this process its user counts yet (workers get them by message after they start),
+            # so skip the request rather than send it with the wrong priority
+            return
+        payload = get_request_payloads().sample()
+        gevent.sleep(priority_mix.pace(priority, payload.policy_tokens))
+        make_request(self.client, priority == "low", payload)
+
+    def on_stop(self):
+        super().on_stop()
+        priority_mix.remove(self)
+
+
 cycle_stages = [
     # Start with low priority
-    {
-        "duration": 120,
-        "users": 9,
-        "spawn_rate": ramp_rate,
-        "user_classes": [LowPriorityUser],
-    },
+    Stage(duration=120, users={"low": 9}, spawn_rate=ramp_rate),
     # Add high priority
-    {
-        "duration": 240,
-        "users": 18,
-        "spawn_rate": ramp_rate,
-        "user_classes": [MixedUser_1_1],
-    },
+    Stage(duration=240, users={"low": 9, "high": 9}, spawn_rate=ramp_rate),
     # Stop low priority
-    {
-        "duration": 360,
-        "users": 9,
-        "spawn_rate": ramp_rate,
-        "user_classes": [HighPriorityUser],
-    },
+    Stage(duration=360, users={"high": 9}, spawn_rate=ramp_rate),
     # Add low priority back in
-    {
-        "duration": 480,
-        "users": 18,
-        "spawn_rate": ramp_rate,
-        "user_classes": [MixedUser_1_1],
-    },
+    Stage(duration=480, users={"low": 9, "high": 9}, spawn_rate=ramp_rate),
     # Switch to only low priority
-    {
-        "duration": 600,
-        "users": 9,
-        "spawn_rate": ramp_rate,
-        "user_classes": [LowPriorityUser],
-    },
+    Stage(duration=600, users={"low": 9}, spawn_rate=ramp_rate),
 ]
 low_priority_stages = [
     # low priority only
-    {
-        "duration": 300,
-        "users": 9,
-        "spawn_rate": ramp_rate,
-        "user_classes": [LowPriorityUser],
-    }
+    Stage(duration=300, users={"low": 9}, spawn_rate=ramp_rate),
 ]
 high_priority_stages = [
     # high priority only
-    {
-        "duration": 300,
-        "users": 9,
-        "spawn_rate": ramp_rate,
-        "user_classes": [HighPriorityUser],
-    }
+    Stage(duration=300, users={"high": 9}, spawn_rate=ramp_rate),
+]
+
+# limits for the deployments under test (see list-deployments in prioritization-token-calculating.xml)
+tpm_limit = 100000
+low_priority_tpm_threshold = 30000
+# low priority requests are rejected once fewer than low_priority_tpm_threshold tokens remain in the minute
+low_priority_tpm_cutoff = tpm_limit - low_priority_tpm_threshold
+high_priority_tpm = int(os.getenv("HIGH_PRIORITY_TPM", "40000"))
+
+
+def get_tpm_stage(duration: float, total_tpm: float) -> Stage:
+    """
+    A stage that sends high priority requests at HIGH_PRIORITY_TPM
+    and low priority requests at the rest of total_tpm
+    """
+    return Stage(
+        duration=duration,
+        users={"low": 9, "high": 9},
+        spawn_rate=ramp_rate,
+        tokens_per_minute={
+            "low": total_tpm - high_priority_tpm,
+            "high": high_priority_tpm,
+        },
+    )
+
+
+tpm_threshold_stages = [
+    # just below the low priority cutoff
+    get_tpm_stage(duration=180, total_tpm=low_priority_tpm_cutoff * 0.9),
+    # at the low priority cutoff
+    get_tpm_stage(duration=360, total_tpm=low_priority_tpm_cutoff),
+    # just above the low priority cutoff
+    get_tpm_stage(duration=540, total_tpm=low_priority_tpm_cutoff * 1.1),
+    # just above the deployment limit
+    get_tpm_stage(duration=720, total_tpm=tpm_limit * 1.1),
 ]
 
 
-class StagesShape(LoadTestShape):
+class StagesShape(UserMixShape):
     """
     Custom LoadTestShape to simulate variations in high and low priority processing
     """
 
+    user_class = PriorityMixUser
+    user_mix = priority_mix
+
     def __init__(self):
         super().__init__()
 
@@ -295,47 +411,11 @@ class StagesShape(LoadTestShape):
             self.stages = low_priority_stages
         elif load_pattern == "high-priority":
             self.stages = high_priority_stages
+        elif load_pattern == "tpm-thresholds":
+            self.stages = tpm_threshold_stages
         else:
             raise ValueError(f"Unhandled load pattern: {load_pattern}")
 
-        self._current_stage = self.stages[0]
-
-    def user_classes_match(stage1, stage2):
-        users1 = stage1.get("user_classes", [])
-        users2 = stage2.get("user_classes", [])
-        if len(users1) != len(users2):
-            return False
-        for i in range(len(users1)):
-            if users1[i] != users2[i]:
-                return False
-        return True
-
-    def tick(self):
-        run_time = self.get_run_time()
-
-        for stage in self.stages:
-            if run_time < stage["duration"]:
-                if self._current_stage and self._current_stage != stage:
-                    if not StagesShape.user_classes_match(self._current_stage, stage):
-                        logging.info(
-                            f"User classes changed from {self._current_stage.get('user_classes', [])} to {stage.get('user_classes', [])} - scaling down to reset"
-                        )
-                        # temp scale down as existing users that don't match the user_classes aren't removed
-                        # https://github.com/locustio/locust/issues/2714
-                        self._current_stage = stage
-                        return (0, 100)
-
-                try:
-                    tick_data = (
-                        stage["users"],
-                        stage["spawn_rate"],
-                        stage["user_classes"],
-                    )
-                except:
-                    tick_data = (stage["users"], stage["spawn_rate"])
-                return tick_data
-        return None
-
 
 @events.init.add_listener
 def on_locust_init(environment, **kwargs):
@@ -352,6 +432,7 @@ def on_locust_init(environment, **kwargs):
 
 
 @events.test_start.add_listener
+@master_only
 def on_test_start(environment, **kwargs):
     """
     Initialize simulator/APIM
@@ -368,33 +449,52 @@ def on_test_start(environment, **kwargs):
 
 
 @events.test_stop.add_listener
+@master_only
 def on_test_stop(environment, **kwargs):
     """
     Collect metrics and show results
     """
     test_stop_time = datetime.now(UTC)
     logging.info("✔️ Test finished")
+    if not report_results:
+        return
 
-    query_processor = QueryProcessor(
-        workspace_id=log_analytics_workspace_id,
-        token_credential=DefaultAzureCredential(),
-        tenant_id=tenant_id,
-        subscription_id=subscription_id,
-        resource_group_name=resource_group_name,
-        workspace_name=log_analytics_workspace_name,
+    query_processor = create_query_processor(
+        exporter=create_result_exporter(__file__, test_start_time)
     )
 
-    time_range = f"TimeGenerated > datetime({test_start_time.strftime('%Y-%m-%dT%H:%M:%SZ')}) and TimeGenerated < datetime({test_stop_time.strftime('%Y-%m-%dT%H:%M:%SZ')})"
-    time_vars = f"let startTime = datetime({test_start_time.strftime('%Y-%m-%dT%H:%M:%SZ')});\nlet endTime = datetime({test_stop_time.strftime('%Y-%m-%dT%H:%M:%SZ')});"
-    logging.info(f"Query time range: {time_range}")
-
     metric_check_time = test_stop_time - timedelta(seconds=10)
-    check_results_query = f"""
+    check_gateway_logs_query = f"""
     ApiManagementGatewayLogs
     | where TimeGenerated >= datetime({metric_check_time.strftime('%Y-%m-%dT%H:%M:%SZ')})
     | count
     """
-    query_processor.wait_for_non_zero_count(check_results_query)
+    check_queries = [check_gateway_logs_query]
+    # the request metrics are only sent with an App Insights connection string (see on_locust_init)
+    if app_insights_connection_string:
+        check_app_metrics_query = f"""
+        AppMetrics
+        | where TimeGenerated >= datetime({metric_check_time.strftime('%Y-%m-%dT%H:%M:%SZ')}) and Name == "locust.request_result"
+        | count
+        """
+        check_queries.append(check_app_metrics_query)
+    # the gateway logs and metrics are ingested independently, so wait for both together
+    query_processor.wait_for_non_zero_counts(check_queries)
+
+    save_test_run(__file__, test_start_time, test_stop_time)
+    output_results(query_processor, test_start_time, test_stop_time)
+    export_raw_gateway_logs(query_processor, test_start_time, test_stop_time)
+
+
+def output_results(
+    query_processor: QueryProcessor, test_start_time: datetime, test_stop_time: datetime
+):
+    """
+    Show the test results (also used by report_only.py to re-render the results from the query cache)
+    """
+    time_range = f"TimeGenerated > datetime({test_start_time.strftime('%Y-%m-%dT%H:%M:%SZ')}) and TimeGenerated < datetime({test_stop_time.strftime('%Y-%m-%dT%H:%M:%SZ')})"
+    time_vars = f"let startTime = datetime({test_start_time.strftime('%Y-%m-%dT%H:%M:%SZ')});\nlet endTime = datetime({test_stop_time.strftime('%Y-%m-%dT%H:%M:%SZ')});"
+    logging.info(f"Query time range: {time_range}")
 
     query_processor.add_query(
         title="Overall request count",
@@ -417,6 +517,14 @@ ApiManagementGatewayLogs
                 asciichart.blue,
             ],
         },
+        local_query="""
+SELECT bin(TimeGenerated, 10) AS TimeGenerated, COUNT(*) AS request_count
+FROM ApiManagementGatewayLogs
+WHERE OperationName != '' AND TimeGenerated > :start AND TimeGenerated < :end
+AND BackendId != ''
+GROUP BY 1
+ORDER BY TimeGenerated
+        """.strip(),
         timespan=(test_start_time, test_stop_time),
         show_query=True,
         include_link=True,
@@ -450,6 +558,15 @@ ApiManagementGatewayLogs
             value_column="request_count",
             missing_value=float("nan"),
         ),
+        local_query="""
+SELECT bin(TimeGenerated, 10) AS TimeGenerated, COALESCE(json_extract(ResponseHeaders, '$."x-gw-priority"'), '') || '-priority' AS label, COUNT(*) AS request_count
+FROM ApiManagementGatewayLogs
+WHERE OperationName != '' AND TimeGenerated > :start AND TimeGenerated < :end
+AND BackendId != ''
+AND ResponseCode = 200
+GROUP BY 1, 2
+ORDER BY TimeGenerated
+        """.strip(),
         timespan=(test_start_time, test_stop_time),
         show_query=True,
         include_link=True,
@@ -485,6 +602,14 @@ ApiManagementGatewayLogs
             value_column="request_count",
             missing_value=float("nan"),
         ),
+        local_query="""
+SELECT bin(TimeGenerated, 10) AS TimeGenerated, COUNT(*) AS request_count, COALESCE(json_extract(ResponseHeaders, '$."x-gw-priority"'), '') || '-priority-' || ResponseCode AS label
+FROM ApiManagementGatewayLogs
+WHERE OperationName != '' AND TimeGenerated > :start AND TimeGenerated < :end
+AND BackendId != ''
+GROUP BY 1, 3
+ORDER BY TimeGenerated
+        """.strip(),
         timespan=(test_start_time, test_stop_time),
         show_query=True,
         include_link=True,
@@ -517,6 +642,17 @@ ApiManagementGatewayLogs
                 asciichart.green,
             ],
         },
+        local_query="""
+WITH remaining AS (
+    SELECT TimeGenerated, CAST(json_extract(ResponseHeaders, '$."x-gw-remaining-tokens"') AS INTEGER) AS remaining_tokens
+    FROM ApiManagementGatewayLogs
+    WHERE TimeGenerated > :start AND TimeGenerated < :end
+)
+SELECT bin(TimeGenerated, 10) AS TimeGenerated, MAX(remaining_tokens) AS max_remaining_tokens, MIN(remaining_tokens) AS min_remaining_tokens, SUM(remaining_tokens) / COUNT(remaining_tokens) AS avg_remaining_tokens
+FROM remaining
+GROUP BY 1
+ORDER BY TimeGenerated
+        """.strip(),
         timespan=(test_start_time, test_stop_time),
         show_query=True,
         include_link=True,
@@ -563,6 +699,39 @@ timeRange
             ],
             "format": "{:9.1f}",  # adjust formatting to avoid graph skew for large y-axis values
         },
+        local_query="""
+WITH RECURSIVE time_steps(TimeStamp) AS (
+    SELECT :start
+    UNION ALL
+    SELECT TimeStamp + 10 FROM time_steps WHERE TimeStamp + 10 <= :end
+),
+-- align values to interval boundaries
+time_range AS (
+    SELECT DISTINCT bin(TimeStamp, 10) AS TimeStamp FROM time_steps
+),
+metrics AS (
+    SELECT bin(TimeGenerated, 10) AS TimeGenerated, json_extract(Properties, '$.deployment') AS deployment, SUM(Sum) AS number
+    FROM AppMetrics
+    WHERE TimeGenerated > :start AND TimeGenerated < :end
+    AND Name = 'aoai-api-simulator.tokens.rate-limit'
+    GROUP BY 1, 2
+),
+series AS (
+    SELECT time_range.TimeStamp AS TimeGenerated, COALESCE(metrics.number, 0.0) AS number
+    FROM time_range LEFT JOIN metrics ON time_range.TimeStamp = metrics.TimeGenerated
+)
+SELECT TimeGenerated,
+    number
+        + COALESCE(LAG(number, 1) OVER previous, 0.0)
+        + COALESCE(LAG(number, 2) OVER previous, 0.0)
+        + COALESCE(LAG(number, 3) OVER previous, 0.0)
+        + COALESCE(LAG(number, 5) OVER previous, 0.0)
+        + COALESCE(LAG(number, 6) OVER previous, 0.0) AS sliding_average,
+    number
+FROM series
+WINDOW previous AS (ORDER BY TimeGenerated)
+ORDER BY TimeGenerated
+        """.strip(),
         timespan=(test_start_time, test_stop_time),
         show_query=True,
         include_link=True,
@@ -591,11 +760,20 @@ AppMetrics
                 ],
                 "format": "{:9.1f}",  # adjust formatting to avoid graph skew for large y-axis values
             },
+            local_query="""
+SELECT bin(TimeGenerated, 10) AS TimeGenerated, SUM(Sum) AS tokens
+FROM AppMetrics
+WHERE Name = 'ConsumedTokens' AND TimeGenerated > :start AND TimeGenerated < :end
+GROUP BY 1
+ORDER BY TimeGenerated
+            """.strip(),
             timespan=(test_start_time, test_stop_time),
             show_query=True,
             include_link=True,
         )
 
     query_processor.run_queries(
-        all_queries_link_text="Show all queries in Log Analytics"
+        all_queries_link_text="Show all queries in Log Analytics",
+        parallelism=query_parallelism,
+        batch=query_batch,
     )
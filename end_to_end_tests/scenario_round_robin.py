@@ -2,51 +2,61 @@ from datetime import datetime, timedelta, UTC
 import logging
 
 import asciichartpy as asciichart
-from azure.identity import DefaultAzureCredential
-from locust import HttpUser, task, constant, events
+from locust import task, constant, events
 
 from common.log_analytics import (
     GroupDefinition,
     QueryProcessor,
 )
+from common.reporting import (
+    create_query_processor,
+    create_result_exporter,
+    export_raw_gateway_logs,
+    save_test_run,
+)
 from common.latency import (
     set_simulator_completions_latency,
     report_request_metric,
 )
+from common.open_loop import OpenLoopUser, open_loop_task
+from common.payload_corpus import TokenSize, get_payload_sampler
+from common.runners import master_only
+from common.users import post_json
 from common.config import (
     apim_subscription_one_key,
     simulator_endpoint_payg1,
     simulator_endpoint_payg2,
-    tenant_id,
-    subscription_id,
-    resource_group_name,
     app_insights_connection_string,
-    log_analytics_workspace_id,
-    log_analytics_workspace_name,
+    query_parallelism,
+    query_batch,
+    report_results,
 )
 
 test_start_time = None
 deployment_name = "gpt-35-turbo-100m-token"
+completion_payloads = get_payload_sampler(
+    "completions",
+    "gpt-5-turbo-1",
+    default_records=[{"prompt": "Once upon a time"}],
+    default_token_mix=[TokenSize(None, 10)],
+)
 
 
-class CompletionUser(HttpUser):
+class CompletionUser(OpenLoopUser):
     """
     CompletionUser makes calls to the OpenAI Completions endpoint to show traffic via APIM
     """
 
-    wait_time = constant(1)  # wait 1 second between requests
+    closed_loop_wait_time = constant(1)  # wait 1 second between requests
 
     @task
+    @open_loop_task
     def get_completion(self):
         url = f"openai/deployments/{deployment_name}/completions?api-version=2023-05-15"
-        payload = {
-            "model": "gpt-5-turbo-1",
-            "prompt": "Once upon a time",
-            "max_tokens": 10,
-        }
-        self.client.post(
+        post_json(
+            self.client,
             url,
-            json=payload,
+            completion_payloads.sample().body,
             headers={"api-key": apim_subscription_one_key},
         )
 
@@ -69,6 +79,7 @@ def on_locust_init(environment, **kwargs):
 
 
 @events.test_start.add_listener
+@master_only
 def on_test_start(environment, **kwargs):
     """
     Initialize simulator/APIM
@@ -86,20 +97,18 @@ def on_test_start(environment, **kwargs):
 
 
 @events.test_stop.add_listener
+@master_only
 def on_test_stop(environment, **kwargs):
     """
     Collect metrics and show results
     """
     test_stop_time = datetime.now(UTC)
     logging.info("✔️ Test finished")
+    if not report_results:
+        return
 
-    query_processor = QueryProcessor(
-        workspace_id=log_analytics_workspace_id,
-        token_credential=DefaultAzureCredential(),
-        tenant_id=tenant_id,
-        subscription_id=subscription_id,
-        resource_group_name=resource_group_name,
-        workspace_name=log_analytics_workspace_name,
+    query_processor = create_query_processor(
+        exporter=create_result_exporter(__file__, test_start_time)
     )
 
     metric_check_time = test_stop_time - timedelta(seconds=10)
@@ -110,6 +119,17 @@ def on_test_stop(environment, **kwargs):
     """
     query_processor.wait_for_non_zero_count(check_results_query)
 
+    save_test_run(__file__, test_start_time, test_stop_time)
+    output_results(query_processor, test_start_time, test_stop_time)
+    export_raw_gateway_logs(query_processor, test_start_time, test_stop_time)
+
+
+def output_results(
+    query_processor: QueryProcessor, test_start_time: datetime, test_stop_time: datetime
+):
+    """
+    Show the test results (also used by report_only.py to re-render the results from the query cache)
+    """
     time_range = f"TimeGenerated > datetime({test_start_time.strftime('%Y-%m-%dT%H:%M:%SZ')}) and TimeGenerated < datetime({test_stop_time.strftime('%Y-%m-%dT%H:%M:%SZ')})"
 
     query_processor.add_query(
@@ -137,6 +157,14 @@ ApiManagementGatewayLogs
             value_column="request_count",
             missing_value=float("nan"),
         ),
+        local_query="""
+SELECT bin(TimeGenerated, 10) AS TimeGenerated, BackendId, COUNT(*) AS request_count
+FROM ApiManagementGatewayLogs
+WHERE OperationName != '' AND TimeGenerated > :start AND TimeGenerated < :end
+AND BackendId != ''
+GROUP BY 1, 2
+ORDER BY TimeGenerated
+        """.strip(),
         timespan=(test_start_time, test_stop_time),
         show_query=True,
         include_link=True,
@@ -151,10 +179,19 @@ ApiManagementGatewayLogs
 | summarize request_count = count() by BackendId
 | evaluate pivot(BackendId, sum(request_count))
         """.strip(),  # When clicking on the link, Log Analytics runs the query automatically if there's no preceding whitespace,
+        local_query="""
+-- SQLite has no pivot, so there is a column for each of the round robin backends
+SELECT SUM(BackendId = 'payg-backend-1') AS "payg-backend-1", SUM(BackendId = 'payg-backend-2') AS "payg-backend-2"
+FROM ApiManagementGatewayLogs
+WHERE OperationName != '' AND TimeGenerated > :start AND TimeGenerated < :end
+AND BackendId != ''
+        """.strip(),
         timespan=(test_start_time, test_stop_time),
         show_query=True,
         include_link=True,
     )
     query_processor.run_queries(
-        all_queries_link_text="Show all queries in Log Analytics"
+        all_queries_link_text="Show all queries in Log Analytics",
+        parallelism=query_parallelism,
+        batch=query_batch,
     )
@@ -0,0 +1,239 @@
+"""
+Replay the latency routing policy's backend selection (see common/weighted_routing.py) against simulated backends
+to check how the traffic is split across the backends and the effect on the tail latency.
+
+Requests arrive at random (Poisson arrivals) and each backend serves a fixed number of requests at a time, queueing
+the rest. When a backend's queue is full it responds with a 429, and the request is retried on the next backend
+in the order, as the policy does (after the retry policy's 1, 3 and 7 second delays, without the jitter).
+
+The backends are ranked and weighted by their latencies with no load (what the latency probes measure),
+and the simulation is run with the routing both unweighted (all traffic to the fastest backend) and weighted.
+The check fails if the weighted traffic split differs from the weights by more than the tolerance,
+or if the weighted p99 latency is above --max-p99-ms.
+
+Usage:
+    python end_to_end_tests/simulate_latency_routing.py --rate 60 \\
+        --backend payg-backend-1=200:10 --backend payg-backend-2=260:10
+"""
+
+import argparse
+import heapq
+import math
+import random
+import statistics
+import sys
+from collections import Counter, deque
+from dataclasses import dataclass, field
+
+from common.weighted_routing import (
+    latency_weights,
+    select_backend,
+    select_backend_order,
+    weighted_preferred_backends,
+)
+
+# delays before each retry in latency-routing-backend.xml (interval 1s, delta 2s, max-interval 10s)
+RETRY_DELAYS = (1, 3, 7)
+# spread of the simulated service times (sigma of the log-normal distribution)
+SERVICE_TIME_SIGMA = 0.25
+
+
+@dataclass
+class SimulatedBackend:
+    backend_id: str
+    # mean seconds to serve a request with no load
+    latency: float
+    # number of requests served at a time
+    concurrency: int
+    busy: int = 0
+    queue: deque = field(default_factory=deque)
+
+
+@dataclass
+class SimulationResult:
+    # number of requests first sent to each backend, and served by each backend
+    first_attempts: Counter
+    served: Counter
+    # seconds from arrival to response for each successful request
+    latencies: list[float]
+    throttled: int
+
+    def percentile(self, percent: float) -> float:
+        if not self.latencies:
+            return math.nan
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def parse_backend(value: str) -> tuple[str, float, int]:
+    """
+    Parse a backend_id=latency_ms:concurrency entry, e.g. "payg-backend-1=200:10"
+    """
+    backend_id, separator, spec = value.partition("=")
+    latency_ms, _, concurrency = spec.partition(":")
+    if not separator or not latency_ms or not concurrency:
+        raise argparse.ArgumentTypeError(
+            f"Invalid backend '{value}', expected backend_id=latency_ms:concurrency"
+        )
+    return backend_id, float(latency_ms) / 1000, int(concurrency)
+
+
+def simulate(
+    backends: list[tuple[str, float, int]],
+    preferred_backends: list,
+    rate: float,
+    request_count: int,
+    max_queue: int,
+    seed: int,
+) -> SimulationResult:
+    """
+    Simulate request_count requests arriving at rate requests per second, routed by the policy
+    with preferred_backends (the value passed to set-preferred-backends)
+    """
+    rng = random.Random(seed)
+    simulated = {
+        backend_id: SimulatedBackend(backend_id, latency, concurrency)
+        for backend_id, latency, concurrency in backends
+    }
+    result = SimulationResult(Counter(), Counter(), [], 0)
+    # (time, sequence, event, request) - the sequence keeps events at the same time in order
+    events = []
+    sequence = 0
+
+    def schedule(time, event, request):
+        nonlocal sequence
+        heapq.heappush(events, (time, sequence, event, request))
+        sequence += 1
+
+    def start(now, backend, request):
+        backend.busy += 1
+        # log-normal service time with the backend's mean latency
+        mu = math.log(backend.latency) - SERVICE_TIME_SIGMA**2 / 2
+        schedule(now + rng.lognormvariate(mu, SERVICE_TIME_SIGMA), "done", request)
+
+    arrival_time = 0
+    for _ in range(request_count):
+        arrival_time += rng.expovariate(rate)
+        order = select_backend_order(preferred_backends, rng.random())
+        result.first_attempts[select_backend(order, 0)] += 1
+        schedule(arrival_time, "attempt", {"arrival": arrival_time, "order": order})
+
+    while events:
+        now, _, event, request = heapq.heappop(events)
+        if event == "attempt":
+            attempt = request.get("attempt", 0)
+            backend = simulated[select_backend(request["order"], attempt)]
+            request["backend"] = backend
+            if backend.busy < backend.concurrency:
+                start(now, backend, request)
+            elif len(backend.queue) < max_queue:
+                backend.queue.append(request)
+            elif attempt < len(RETRY_DELAYS):
+                request["attempt"] = attempt + 1
+                schedule(now + RETRY_DELAYS[attempt], "attempt", request)
+            else:
+                result.throttled += 1
+        else:
+            backend = request["backend"]
+            backend.busy -= 1
+            result.served[backend.backend_id] += 1
+            result.latencies.append(now - request["arrival"])
+            if backend.queue:
+                start(now, backend, backend.queue.popleft())
+    return result
+
+
+def print_result(title: str, result: SimulationResult, backend_ids: list[str]):
+    total = sum(result.first_attempts.values())
+    print(title)
+    for backend_id in backend_ids:
+        print(
+            f"    {backend_id}: {result.first_attempts[backend_id] / total:.1%} of requests sent, "
+            + f"{result.served[backend_id]} served"
+        )
+    print(
+        f"    latency p50 {result.percentile(50) * 1000:.0f} ms, "
+        + f"p95 {result.percentile(95) * 1000:.0f} ms, "
+        + f"p99 {result.percentile(99) * 1000:.0f} ms, "
+        + f"mean {statistics.fmean(result.latencies) * 1000:.0f} ms, "
+        + f"{result.throttled} throttled"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--backend",
+        type=parse_backend,
+        action="append",
+        help="Simulated backend as backend_id=latency_ms:concurrency (repeat for each backend)",
+    )
+    parser.add_argument("--rate", type=float, default=60, help="Requests per second")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument(
+        "--max-queue",
+        type=int,
+        default=20,
+        help="Requests a backend queues before responding with a 429",
+    )
+    parser.add_argument(
+        "--exponent",
+        type=float,
+        default=2,
+        help="Weight exponent (see LATENCY_ROUTING_WEIGHT_EXPONENT)",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.02,
+        help="Largest allowed difference between each backend's share of the requests and its weight",
+    )
+    parser.add_argument(
+        "--max-p99-ms", type=float, help="Largest allowed weighted p99 latency"
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    backends = args.backend or [
+        ("payg-backend-1", 0.2, 10),
+        ("payg-backend-2", 0.26, 10),
+    ]
+    # rank and weight the backends as the latency probes would see them
+    backends = sorted(backends, key=lambda backend: backend[1])
+    backend_ids = [backend_id for backend_id, _, _ in backends]
+    weights = latency_weights([latency for _, latency, _ in backends], args.exponent)
+
+    unweighted = simulate(
+        backends, backend_ids, args.rate, args.requests, args.max_queue, args.seed
+    )
+    print_result(
+        "Unweighted (all traffic to the fastest backend)", unweighted, backend_ids
+    )
+    weighted = simulate(
+        backends,
+        weighted_preferred_backends(backend_ids, weights),
+        args.rate,
+        args.requests,
+        args.max_queue,
+        args.seed,
+    )
+    print_result(f"Weighted {dict(zip(backend_ids, weights))}", weighted, backend_ids)
+
+    failures = []
+    for backend_id, weight in zip(backend_ids, weights):
+        share = weighted.first_attempts[backend_id] / args.requests
+        if abs(share - weight) > args.tolerance:
+            failures.append(
+                f"{backend_id} was sent {share:.1%} of the requests for a weight of {weight:.1%}"
+            )
+    p99 = weighted.percentile(99) * 1000
+    if args.max_p99_ms is not None and not p99 <= args.max_p99_ms:
+        failures.append(f"p99 latency {p99:.0f} ms is above {args.max_p99_ms:.0f} ms")
+
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+import pytest
+
+from common.export import ResultExporter
+from common.table import Table
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+
+def _export(tmp_path, tables, **kwargs):
+    exporter = ResultExporter(str(tmp_path), **kwargs)
+    return pq.read_table(exporter.export_chunks("result", tables))
+
+
+def test_export_writes_kusto_types(tmp_path):
+    table = Table(
+        ["count", "latency", "name", "properties"],
+        [[1, 0.5, "a", {"x": 1}], [2, 1.5, "b", None]],
+        ["long", "real", "string", "dynamic"],
+    )
+
+    result = _export(tmp_path, [table])
+
+    assert result.schema.types == [pa.int64(), pa.float64(), pa.string(), pa.string()]
+    assert result.column("properties").to_pylist() == ['{"x": 1}', None]
+
+
+def test_a_dynamic_column_that_is_null_in_the_first_chunk_is_exported(tmp_path):
+    tables = [
+        Table(["a", "err"], [[1, None]], ["long", "dynamic"]),
+        Table(["a", "err"], [[2, "boom"]], ["long", "dynamic"]),
+    ]
+
+    result = _export(tmp_path, tables)
+
+    assert result.column("a").to_pylist() == [1, 2]
+    assert result.column("err").to_pylist() == [None, "boom"]
+
+
+def test_an_empty_first_chunk_from_the_local_backend_takes_later_types(tmp_path):
+    # the local analytics backend reports the columns of an empty result as dynamic
+    tables = [
+        Table(["a", "b"], [], ["dynamic", "dynamic"]),
+        Table(["a", "b"], [[1, "x"]], ["long", "string"]),
+    ]
+
+    result = _export(tmp_path, tables)
+
+    assert result.schema.types == [pa.int64(), pa.string()]
+    assert result.to_pylist() == [{"a": 1, "b": "x"}]
+
+
+def test_an_untyped_null_column_takes_the_type_of_a_later_chunk(tmp_path):
+    tables = [
+        Table(["a", "b"], [[1, None]]),
+        Table(["a", "b"], [[2, None]]),
+        Table(["a", "b"], [[3, 4.5]]),
+    ]
+
+    result = _export(tmp_path, tables)
+
+    assert result.schema.types == [pa.int64(), pa.float64()]
+    assert result.column("b").to_pylist() == [None, None, 4.5]
+
+
+def test_an_untyped_null_column_is_written_as_text_once_rows_are_written(tmp_path):
+    tables = [
+        Table(["a", "b"], [[1, None], [2, None]]),
+        Table(["a", "b"], [[3, {"x": 1}]]),
+    ]
+
+    result = _export(tmp_path, tables, row_group_size=2)
+
+    assert result.schema.types == [pa.int64(), pa.string()]
+    assert result.column("b").to_pylist() == [None, None, '{"x": 1}']
+
+
+def test_a_result_of_only_null_columns_is_exported(tmp_path):
+    result = _export(tmp_path, [Table(["a"], [[None]]), Table(["a"], [])])
+
+    assert result.column("a").to_pylist() == [None]
+
+
+def test_arrow_ipc_export(tmp_path):
+    exporter = ResultExporter(str(tmp_path), format="arrow")
+    path = exporter.export("Overall request count", Table(["a"], [[1]], ["long"]))
+
+    assert path.endswith("overall-request-count.arrow")
+    with pa.memory_map(path) as source:
+        assert pa.ipc.open_file(source).read_all().column("a").to_pylist() == [1]
@@ -0,0 +1,57 @@
+import math
+
+import pytest
+
+from common.latency_probe import LatencyProbe, ProbeBackend
+from local.http_server import LocalHttpServer
+
+RESPONSES = {
+    "fast": {"usage": {"completion_tokens": 10}, "choices": [{"text": "Once"}]},
+    "no-usage": {"choices": [{"text": "Once"}]},
+    "not-json": b"<html>Service unavailable</html>",
+}
+
+
+class _BackendsServer(LocalHttpServer):
+    """
+    Serves the completions endpoint for a backend per path prefix (e.g. /fast/deployments/...)
+    """
+
+    def handle_request(self, method, path, headers, body):
+        return 200, RESPONSES[path.split("/")[1]]
+
+
+@pytest.fixture
+def server():
+    with _BackendsServer() as server:
+        yield server
+
+
+def _probe(server, backend_ids: list[str]):
+    probe = LatencyProbe(
+        [
+            ProbeBackend(backend_id, f"{server.base_url}/{backend_id}")
+            for backend_id in backend_ids
+        ],
+        deployment_name="gpt-35-turbo-100k-token",
+        api_key="key",
+        samples=3,
+        timeout=5,
+    )
+    return {result.backend.backend_id: result for result in probe.probe()}
+
+
+def test_probe_measures_each_sample(server):
+    result = _probe(server, ["fast"])["fast"]
+
+    assert len(result.samples) == 3
+    assert 0 < result.latency < math.inf
+
+
+@pytest.mark.parametrize("backend_id", ["no-usage", "not-json"])
+def test_a_backend_with_an_unexpected_body_is_ranked_last(server, backend_id):
+    results = _probe(server, [backend_id, "fast"])
+
+    assert results[backend_id].latency == math.inf
+    assert results[backend_id].samples == []
+    assert results["fast"].latency < math.inf
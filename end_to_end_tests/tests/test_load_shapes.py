@@ -0,0 +1,210 @@
+import pytest
+
+from common.load_shapes import (
+    Stage,
+    TokenPacer,
+    UserMix,
+    _get_process_messages,
+    _get_process_targets,
+)
+
+
+def _profile_totals(targets: list[dict[str, int]]) -> dict[str, int]:
+    totals = {}
+    for process_targets in targets:
+        for profile, count in process_targets.items():
+            totals[profile] = totals.get(profile, 0) + count
+    return totals
+
+
+@pytest.mark.parametrize(
+    "process_user_counts",
+    [[18], [5, 5, 4, 4], [4, 5, 4, 5], [10, 0, 8], [1] * 18],
+)
+def test_process_targets_add_up_to_the_stage_and_each_process_users(
+    process_user_counts,
+):
+    users = {"low": 9, "high": 9}
+
+    targets = _get_process_targets(users, process_user_counts)
+
+    assert _profile_totals(targets) == users
+    assert [sum(process_targets.values()) for process_targets in targets] == (
+        process_user_counts
+    )
+
+
+def test_process_targets_give_each_process_a_similar_mix():
+    targets = _get_process_targets({"low": 12, "high": 4}, [8, 8])
+
+    assert targets == [{"low": 6, "high": 2}, {"low": 6, "high": 2}]
+
+
+def test_process_targets_follow_the_users_dispatched_to_each_process():
+    # Locust doesn't give the extra users to the workers in order
+    targets = _get_process_targets({"low": 3, "high": 2}, [1, 1, 3])
+
+    assert [sum(process_targets.values()) for process_targets in targets] == [1, 1, 3]
+    assert _profile_totals(targets) == {"low": 3, "high": 2}
+
+
+def test_process_targets_while_the_users_are_ramping_up_keep_the_mix():
+    targets = _get_process_targets({"low": 9, "high": 9}, [3, 3])
+
+    assert _profile_totals(targets) == {"low": 3, "high": 3}
+
+
+def test_process_targets_with_more_users_than_the_stage():
+    # e.g. while Locust stops users after a stage with fewer users starts
+    targets = _get_process_targets({"low": 2}, [2, 2])
+
+    assert targets == [{"low": 2}, {"low": 0}]
+
+
+def test_process_messages_share_the_tokens_per_minute_by_users():
+    stage = Stage(
+        duration=60,
+        users={"low": 9, "high": 9},
+        tokens_per_minute={"low": 6000, "high": 12000},
+    )
+
+    messages = _get_process_messages(stage, [12, 6])
+
+    assert [message["tokens_per_minute"] for message in messages] == [
+        {"low": 4000, "high": 8000},
+        {"low": 2000, "high": 4000},
+    ]
+
+
+def test_process_messages_share_the_tokens_per_minute_equally_without_users():
+    stage = Stage(duration=60, users={"low": 2}, tokens_per_minute={"low": 6000})
+
+    messages = _get_process_messages(stage, [0, 0])
+
+    assert [message["tokens_per_minute"] for message in messages] == [
+        {"low": 3000},
+        {"low": 3000},
+    ]
+
+
+def _get_profiles(user_mix: UserMix, users: list) -> list[str]:
+    return [user_mix.get_profile(user) for user in users]
+
+
+def test_get_profile_assigns_users_to_the_targets():
+    user_mix = UserMix()
+    user_mix.set_users({"low": 2, "high": 1})
+
+    profiles = _get_profiles(user_mix, [object() for _ in range(3)])
+
+    assert sorted(profiles) == ["high", "low", "low"]
+
+
+def test_get_profile_returns_none_before_the_targets_are_set():
+    assert UserMix().get_profile(object()) is None
+
+
+def test_get_profile_keeps_profiles_that_are_still_needed():
+    user_mix = UserMix()
+    users = [object() for _ in range(4)]
+    user_mix.set_users({"low": 4})
+    _get_profiles(user_mix, users)
+
+    user_mix.set_users({"low": 2, "high": 2})
+    profiles = _get_profiles(user_mix, users)
+
+    # only the users over the low target switch
+    assert sorted(profiles) == ["high", "high", "low", "low"]
+    assert _get_profiles(user_mix, users) == profiles
+
+
+def test_get_profile_keeps_the_profile_of_users_over_the_targets():
+    user_mix = UserMix()
+    users = [object() for _ in range(3)]
+    user_mix.set_users({"low": 3})
+    _get_profiles(user_mix, users)
+
+    # e.g. before Locust has stopped the users that aren't needed
+    user_mix.set_users({"low": 1, "high": 1})
+
+    # one user switches to high, the others stay low until they are stopped
+    assert _get_profiles(user_mix, users) == ["high", "low", "low"]
+
+
+def test_removed_users_free_their_profile():
+    user_mix = UserMix()
+    users = [object() for _ in range(2)]
+    user_mix.set_users({"low": 1, "high": 1})
+    profiles = _get_profiles(user_mix, users)
+
+    user_mix.remove(users[0])
+
+    assert user_mix.get_profile(object()) == profiles[0]
+
+
+class _FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _FakeClock()
+    monkeypatch.setattr("common.load_shapes.time", clock)
+    return clock
+
+
+def test_token_pacer_spaces_requests_by_their_tokens(clock):
+    pacer = TokenPacer(tokens_per_minute=600)  # 10 tokens per second
+
+    assert pacer.reserve(20) == 0
+    assert pacer.reserve(10) == pytest.approx(2)
+    assert pacer.reserve(10) == pytest.approx(3)
+
+
+def test_token_pacer_doesnt_save_up_idle_time(clock):
+    pacer = TokenPacer(tokens_per_minute=600)
+    pacer.reserve(10)
+
+    clock.now += 60
+
+    assert pacer.reserve(10) == 0
+    assert pacer.reserve(10) == pytest.approx(1)
+
+
+def test_token_pacer_rate_changes_keep_the_reserved_send_time(clock):
+    pacer = TokenPacer(tokens_per_minute=600)
+    pacer.reserve(10)
+
+    pacer.set_rate(1200)
+
+    assert pacer.reserve(10) == pytest.approx(1)
+    assert pacer.reserve(10) == pytest.approx(1.5)
+
+
+def test_token_pacer_rejects_a_rate_that_isnt_positive():
+    with pytest.raises(ValueError):
+        TokenPacer(tokens_per_minute=0)
+
+
+def test_user_mix_paces_profiles_with_a_rate(clock):
+    user_mix = UserMix()
+    user_mix.set_users({"low": 1, "high": 1}, tokens_per_minute={"low": 600})
+
+    assert user_mix.is_paced("low")
+    assert not user_mix.is_paced("high")
+    assert [user_mix.pace("low", 10) for _ in range(2)] == [0, pytest.approx(1)]
+    assert user_mix.pace("high", 10) == 0
+
+
+def test_user_mix_keeps_pacing_when_the_counts_are_resent(clock):
+    user_mix = UserMix()
+    user_mix.set_users({"low": 1}, tokens_per_minute={"low": 600})
+    user_mix.pace("low", 10)
+
+    user_mix.set_users({"low": 1}, tokens_per_minute={"low": 600})
+
+    assert user_mix.pace("low", 10) == pytest.approx(1)
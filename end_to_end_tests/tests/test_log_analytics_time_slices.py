@@ -0,0 +1,87 @@
+from datetime import UTC, datetime, timedelta
+
+from common.log_analytics import QueryProcessor
+from local.logs_query_client import FakeLogsQueryClient
+
+# an unaligned test start time, like the scenarios' test_start_time
+START = datetime(2024, 5, 1, 12, 0, 7, 250000, tzinfo=UTC)
+END = START + timedelta(minutes=12)
+EPOCH = datetime(1970, 1, 1, tzinfo=UTC)
+
+
+def _create_query_processor(max_rows: int) -> QueryProcessor:
+    client = FakeLogsQueryClient(max_rows=max_rows)
+    # a request every second
+    rows = [
+        [START + timedelta(seconds=second), second]
+        for second in range(int((END - START).total_seconds()))
+    ]
+    client.add_result("Requests", ["TimeGenerated", "id"], rows, "TimeGenerated")
+    return QueryProcessor(
+        workspace_id="offline", token_credential=None, logs_query_client=client
+    )
+
+
+def _is_multiple(value: datetime, size: timedelta) -> bool:
+    return (value - EPOCH) % size == timedelta(0)
+
+
+def test_windows_are_aligned_to_the_time_slice():
+    query_processor = _create_query_processor(max_rows=1000)
+
+    windows = [
+        window
+        for window, _, _ in query_processor.iter_time_slices(
+            "Requests", (START, END), timedelta(minutes=5), use_cache=False
+        )
+    ]
+
+    assert windows[0][0] == START
+    assert windows[-1][1] == END
+    for (_, window_end), (next_start, _) in zip(windows, windows[1:]):
+        assert window_end == next_start
+        assert _is_multiple(window_end, timedelta(minutes=5))
+    assert [end - start for start, end in windows[1:-1]] == [timedelta(minutes=5)]
+
+
+def test_truncated_windows_are_split_on_multiples_of_min_time_slice():
+    query_processor = _create_query_processor(max_rows=45)
+
+    results = list(
+        query_processor.iter_time_slices(
+            "Requests", (START, END), timedelta(minutes=5), use_cache=False
+        )
+    )
+
+    for _, table, error_message in results:
+        assert error_message is None
+        assert len(table) < 45
+    for (_, window_end), _, _ in results[:-1]:
+        assert _is_multiple(window_end, timedelta(seconds=10))
+    # every row is returned once, in time order
+    ids = [row[1] for _, table, _ in results for row in table.rows]
+    assert ids == list(range(12 * 60))
+
+
+def test_a_window_that_cant_be_split_is_reported_as_truncated():
+    query_processor = _create_query_processor(max_rows=5)
+
+    results = list(
+        query_processor.iter_time_slices(
+            "Requests",
+            (START, START + timedelta(seconds=30)),
+            timedelta(minutes=5),
+            use_cache=False,
+        )
+    )
+
+    # the first window (up to 12:00:10) has 3 rows, the 10 second windows after it have more than 5
+    assert [window for window, _, _ in results] == [
+        (START, START + timedelta(seconds=2.75)),
+        (START + timedelta(seconds=2.75), START + timedelta(seconds=12.75)),
+        (START + timedelta(seconds=12.75), START + timedelta(seconds=22.75)),
+        (START + timedelta(seconds=22.75), START + timedelta(seconds=30)),
+    ]
+    assert results[0][2] is None
+    for _, _, error_message in results[1:]:
+        assert error_message.startswith("Partial result returned")
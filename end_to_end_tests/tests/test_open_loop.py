@@ -0,0 +1,65 @@
+import gevent
+
+from common.open_loop import ArrivalScheduler
+
+
+class FakeStats:
+    def __init__(self) -> None:
+        self.errors = 0
+
+    def log_error(self, method, name, error):
+        self.errors += 1
+
+
+class FakeEnvironment:
+    def __init__(self) -> None:
+        self.stats = FakeStats()
+
+
+class FakeUser:
+    def __init__(self) -> None:
+        self.finished = 0
+        self.environment = FakeEnvironment()
+
+
+def _slow_task(user):
+    gevent.sleep(0.05)
+    user.finished += 1
+
+
+def test_stop_user_kills_only_that_users_running_requests():
+    scheduler = ArrivalScheduler(1, {})
+    stopped_user, running_user = FakeUser(), FakeUser()
+    for user in (stopped_user, running_user, stopped_user):
+        scheduler.dispatch(user, _slow_task)
+    gevent.sleep(0)
+
+    scheduler.stop_user(stopped_user)
+    gevent.sleep(0.1)
+
+    assert stopped_user.finished == 0
+    assert running_user.finished == 1
+    assert scheduler.in_flight == 0
+
+
+def test_stop_user_ignores_completed_requests():
+    scheduler = ArrivalScheduler(1, {})
+    user = FakeUser()
+    scheduler.dispatch(user, _slow_task)
+    gevent.sleep(0.1)
+
+    scheduler.stop_user(user)
+
+    assert user.finished == 1
+
+
+def test_dispatch_drops_requests_beyond_max_in_flight():
+    scheduler = ArrivalScheduler(1, {}, max_in_flight=1)
+    user = FakeUser()
+    scheduler.dispatch(user, _slow_task)
+    scheduler.dispatch(user, _slow_task)
+    gevent.sleep(0.1)
+
+    assert user.finished == 1
+    assert scheduler.dropped_counts == {"FakeUser": 1}
+    assert user.environment.stats.errors == 1
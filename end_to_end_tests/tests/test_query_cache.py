@@ -0,0 +1,171 @@
+import glob
+import os
+from datetime import UTC, datetime, timedelta
+
+import pytest
+
+from common.query_cache import QueryCache
+from common.table import Table
+
+SOURCE = "workspace-id"
+START = datetime(2024, 5, 1, 12, 0, tzinfo=UTC)
+END = datetime(2024, 5, 1, 12, 30, tzinfo=UTC)
+
+
+def _table(count: int = 1) -> Table:
+    return Table(
+        ["TimeGenerated", "count"],
+        [[START + timedelta(seconds=10 * index), index] for index in range(count)],
+        ["datetime", "long"],
+    )
+
+
+def _result_paths(directory) -> list[str]:
+    return glob.glob(os.path.join(directory, "results", "*", "*.json"))
+
+
+def test_get_returns_the_cached_table_with_datetimes(tmp_path):
+    cache = QueryCache(str(tmp_path))
+    cache.put(SOURCE, "Logs | count", (START, END), _table(3))
+
+    table = cache.get(SOURCE, "Logs | count", (START, END))
+
+    assert table == _table(3)
+    assert table.column_types == ["datetime", "long"]
+
+
+def test_get_ignores_whitespace_in_the_query(tmp_path):
+    cache = QueryCache(str(tmp_path))
+    cache.put(SOURCE, "Logs\n| count", (START, END), _table())
+
+    assert cache.get(SOURCE, "  Logs | count  ", (START, END)) == _table()
+
+
+def test_get_misses_for_a_different_source_query_or_timespan(tmp_path):
+    cache = QueryCache(str(tmp_path))
+    cache.put(SOURCE, "Logs | count", (START, END), _table())
+
+    assert cache.get("other-workspace", "Logs | count", (START, END)) is None
+    assert cache.get(SOURCE, "Logs | take 1", (START, END)) is None
+    assert cache.get(SOURCE, "Logs | count", (START, END + timedelta(1))) is None
+
+
+def test_a_start_and_duration_timespan_matches_the_same_start_and_end(tmp_path):
+    cache = QueryCache(str(tmp_path))
+    cache.put(SOURCE, "Logs | count", (START, END - START), _table())
+
+    assert cache.get(SOURCE, "Logs | count", (START, END)) == _table()
+
+
+def test_results_for_a_timespan_that_has_ended_dont_expire(tmp_path):
+    cache = QueryCache(str(tmp_path), ttl_seconds=-1)
+    cache.put(SOURCE, "Logs | count", (START, END), _table())
+
+    assert cache.get(SOURCE, "Logs | count", (START, END)) == _table()
+
+
+def test_results_for_a_relative_timespan_expire(tmp_path):
+    cache = QueryCache(str(tmp_path), ttl_seconds=-1)
+    cache.put(SOURCE, "Logs | count", timedelta(hours=12), _table())
+
+    assert cache.get(SOURCE, "Logs | count", timedelta(hours=12)) is None
+
+
+def test_results_for_a_timespan_that_hasnt_ended_expire(tmp_path):
+    cache = QueryCache(str(tmp_path), ttl_seconds=-1)
+    now = datetime.now(UTC)
+    timespan = (now - timedelta(hours=1), now + timedelta(hours=1))
+    cache.put(SOURCE, "Logs | count", timespan, _table())
+
+    assert cache.get(SOURCE, "Logs | count", timespan) is None
+
+
+def test_results_for_a_timespan_that_has_just_ended_expire(tmp_path):
+    # the last logs of the timespan may not have been ingested yet
+    cache = QueryCache(str(tmp_path), ttl_seconds=-1, ingestion_grace_seconds=900)
+    now = datetime.now(UTC)
+    timespan = (now - timedelta(hours=1), now - timedelta(minutes=1))
+    cache.put(SOURCE, "Logs | count", timespan, _table())
+
+    assert cache.get(SOURCE, "Logs | count", timespan) is None
+
+
+def test_results_for_a_timespan_that_ended_before_the_ingestion_grace_dont_expire(
+    tmp_path,
+):
+    cache = QueryCache(str(tmp_path), ttl_seconds=-1, ingestion_grace_seconds=900)
+    now = datetime.now(UTC)
+    timespan = (now - timedelta(hours=1), now - timedelta(minutes=16))
+    cache.put(SOURCE, "Logs | count", timespan, _table())
+
+    assert cache.get(SOURCE, "Logs | count", timespan) == _table()
+
+
+def test_get_returns_the_same_values_as_put(tmp_path):
+    cache = QueryCache(str(tmp_path))
+    table = Table(
+        ["TimeGenerated", "name", "count", "rate", "ok", "details", "missing"],
+        [[START, "a", 1, 0.5, True, {"tags": ["x"]}, None]],
+        ["datetime", "string", "long", "real", "bool", "dynamic", "string"],
+    )
+    cache.put(SOURCE, "Logs", (START, END), table)
+
+    (row,) = cache.get(SOURCE, "Logs", (START, END)).rows
+
+    assert row == [START, "a", 1, 0.5, True, {"tags": ["x"]}, None]
+    assert [type(value) for value in row] == [
+        datetime,
+        str,
+        int,
+        float,
+        bool,
+        dict,
+        type(None),
+    ]
+
+
+def test_put_raises_for_a_value_that_cant_be_cached(tmp_path):
+    cache = QueryCache(str(tmp_path))
+    table = Table(["duration"], [[timedelta(seconds=1)]], ["timespan"])
+
+    with pytest.raises(TypeError):
+        cache.put(SOURCE, "Logs", (START, END), table)
+
+    assert _result_paths(tmp_path) == []
+    assert cache.get(SOURCE, "Logs", (START, END)) is None
+
+
+def test_an_unreadable_entry_is_a_miss(tmp_path):
+    cache = QueryCache(str(tmp_path))
+    cache.put(SOURCE, "Logs | count", (START, END), _table())
+    (path,) = _result_paths(tmp_path)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("{not json")
+
+    assert cache.get(SOURCE, "Logs | count", (START, END)) is None
+
+
+def test_put_evicts_the_least_recently_used_results(tmp_path):
+    cache = QueryCache(str(tmp_path))
+    cache.put(SOURCE, "query 1", (START, END), _table(50))
+    entry_size = os.path.getsize(_result_paths(tmp_path)[0])
+
+    cache = QueryCache(str(tmp_path), max_size_bytes=int(entry_size * 2.5))
+    cache.put(SOURCE, "query 2", (START, END), _table(50))
+    # make query 1 the least recently used, then use query 2
+    for path in _result_paths(tmp_path):
+        os.utime(path, (0, 0))
+    assert cache.get(SOURCE, "query 2", (START, END)) is not None
+    cache.put(SOURCE, "query 3", (START, END), _table(50))
+
+    assert cache.get(SOURCE, "query 1", (START, END)) is None
+    assert cache.get(SOURCE, "query 2", (START, END)) is not None
+    assert cache.get(SOURCE, "query 3", (START, END)) is not None
+
+
+def test_load_run_returns_the_last_saved_run(tmp_path):
+    cache = QueryCache(str(tmp_path))
+    cache.save_run("scenario", "old-workspace", START - timedelta(1), END)
+    cache.save_run("scenario", SOURCE, START, END)
+
+    assert cache.load_run("scenario") == (SOURCE, START, END)
@@ -0,0 +1,61 @@
+import pytest
+import requests
+
+from common.token_estimation import estimate_prompt_tokens
+from local.simulator import DeploymentRateLimit, FakeSimulatorServer
+
+
+@pytest.fixture(scope="module")
+def simulator():
+    with FakeSimulatorServer(rate_limits={}) as server:
+        yield server
+
+
+@pytest.mark.parametrize(
+    "operation, body",
+    [
+        ("embeddings", {"input": ["abcd", "abcdefgh"]}),
+        ("embeddings", {"input": [[1, 2], [3, 4, 5]]}),
+        ("completions", {"prompt": "你好, world"}),
+        (
+            "chat/completions",
+            {
+                "messages": [
+                    {"role": "system", "content": "abcd"},
+                    {
+                        "role": "user",
+                        "content": [
+                            {"type": "text", "text": "abcdefgh"},
+                            {"type": "image_url", "image_url": {"url": "x"}},
+                        ],
+                    },
+                ]
+            },
+        ),
+    ],
+)
+def test_prompt_tokens_are_counted_like_the_policy(simulator, operation, body):
+    response = requests.post(
+        f"{simulator.base_url}/openai/deployments/test/{operation}", json=body
+    )
+
+    assert response.status_code == 200
+    assert response.json()["usage"]["prompt_tokens"] == estimate_prompt_tokens(body)
+
+
+def test_rate_limits_count_the_prompt_and_completion_tokens():
+    body = {
+        "messages": [
+            {"role": "user", "content": [{"type": "text", "text": "a" * 400}]}
+        ],
+        "max_tokens": 50,
+    }
+    rate_limits = {"limited": DeploymentRateLimit(1000)}
+    with FakeSimulatorServer(rate_limits=rate_limits) as server:
+        response = requests.post(
+            f"{server.base_url}/openai/deployments/limited/chat/completions",
+            json=body,
+        )
+
+    # 4 tokens for the message, 100 for its text and 3 for the reply, plus max_tokens
+    assert response.headers["x-ratelimit-remaining-tokens"] == str(1000 - 107 - 50)
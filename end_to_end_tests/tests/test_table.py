@@ -0,0 +1,72 @@
+import pytest
+
+from common.table import Table
+
+
+def test_group_by_pivots_values_into_a_column_per_group():
+    table = Table(
+        ["time", "backend", "count"],
+        [
+            [2, "b", 20],
+            [1, "a", 1],
+            [2, "a", 2],
+            [1, "b", 10],
+        ],
+    )
+
+    grouped = table.group_by("time", "backend", "count")
+
+    assert grouped.columns == ["time", "count_a", "count_b"]
+    assert grouped.rows == [[1, 1, 10], [2, 2, 20]]
+
+
+def test_group_by_fills_missing_groups_with_missing_value():
+    table = Table(["time", "backend", "count"], [[1, "a", 1], [2, "b", 2]])
+
+    grouped = table.group_by("time", "backend", "count", missing_value=0)
+
+    assert grouped.rows == [[1, 1, 0], [2, 0, 2]]
+
+
+def test_group_by_promotes_int_values_to_float_with_a_float_missing_value():
+    table = Table(["time", "backend", "count"], [[1, "a", 1], [2, "b", 2]])
+
+    grouped = table.group_by("time", "backend", "count", missing_value=0.0)
+
+    assert grouped.column("count_a").typecode == "d"
+    assert grouped.rows == [[1, 1.0, 0.0], [2, 0.0, 2.0]]
+
+
+def test_group_by_keeps_the_order_of_ids_that_cant_be_sorted():
+    table = Table(
+        ["id", "group", "value"],
+        [[None, "a", 1], ["x", "a", 2], [None, "b", 3]],
+    )
+
+    grouped = table.group_by("id", "group", "value")
+
+    assert grouped.rows == [[None, 1, 3], ["x", 2, None]]
+
+
+def test_group_by_the_last_value_wins_for_a_duplicate_id_and_group():
+    table = Table(["id", "group", "value"], [[1, "a", 1], [1, "a", 2]])
+
+    assert table.group_by("id", "group", "value").rows == [[1, 2]]
+
+
+def test_group_by_an_unknown_column_raises():
+    table = Table(["id", "group", "value"], [[1, "a", 1]])
+
+    with pytest.raises(ValueError, match="Column 'missing' not found"):
+        table.group_by("missing", "group", "value")
+
+
+def test_concat_appends_the_rows_of_each_table():
+    tables = (Table(["a", "b"], [[index, str(index)]]) for index in range(3))
+
+    assert Table.concat(tables).rows == [[0, "0"], [1, "1"], [2, "2"]]
+
+
+def test_concat_of_tables_with_different_columns_raises():
+    with pytest.raises(ValueError, match="different columns"):
+        Table.concat([Table(["a"], [[1]]), Table(["b"], [[1]])])
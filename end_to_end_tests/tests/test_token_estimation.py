@@ -0,0 +1,112 @@
+import os
+
+import pytest
+
+from common.token_estimation import (
+    DEFAULT_MAX_TOKENS,
+    estimate_policy_tokens,
+    estimate_prompt_tokens,
+    estimate_tokens,
+)
+from local.gateway_expressions import CAPABILITY_EXPRESSIONS
+from local.gateway_policy import PolicyCompiler
+
+TOKEN_CALCULATING_POLICY = os.path.join(
+    os.path.dirname(__file__),
+    "../../capabilities/prioritization/prioritization-token-calculating.xml",
+)
+
+
+def test_estimate_tokens_counts_4_characters_per_token():
+    assert estimate_tokens("a" * 40) == 10
+    assert estimate_tokens("") == 1
+
+
+@pytest.mark.parametrize("operation", ["completions", "chat"])
+def test_completions_reserve_max_tokens(operation):
+    body = {"prompt": "", "max_tokens": 100}
+
+    assert estimate_policy_tokens(operation, body) == 100
+
+
+def test_completions_without_max_tokens_reserve_the_default():
+    assert estimate_policy_tokens("completions", {"prompt": ""}) == DEFAULT_MAX_TOKENS
+
+
+def test_max_completion_tokens_takes_precedence_over_max_tokens():
+    body = {"prompt": "", "max_completion_tokens": 50, "max_tokens": 100}
+
+    assert estimate_policy_tokens("completions", body) == 50
+
+
+@pytest.mark.parametrize(
+    "choices, expected",
+    [({"best_of": 3}, 300), ({"n": 2}, 200), ({"best_of": 3, "n": 2}, 300)],
+)
+def test_max_tokens_are_reserved_for_each_choice(choices, expected):
+    body = {"prompt": "", "max_tokens": 100, **choices}
+
+    assert estimate_policy_tokens("completions", body) == expected
+
+
+def test_null_values_are_skipped_like_missing_values():
+    body = {"prompt": "", "max_completion_tokens": None, "max_tokens": 100, "n": None}
+
+    assert estimate_policy_tokens("completions", body) == 100
+
+
+@pytest.mark.parametrize(
+    "operation, body",
+    [
+        ("embeddings", {"input": "", "max_tokens": 100}),
+        ("completions", {"model": "embedding", "prompt": "", "max_tokens": 100}),
+    ],
+)
+def test_embeddings_dont_reserve_completion_tokens(operation, body):
+    assert estimate_policy_tokens(operation, body) == 0
+
+
+# the cases described in capabilities/prioritization/prioritization-token-calculating.md
+@pytest.mark.parametrize(
+    "body, expected",
+    [
+        # ASCII text counts 4 characters per token, rounded up
+        ({"input": "Hello, world"}, 3),
+        ({"input": "abcde"}, 2),
+        ({"prompt": ["abcd", "abcdefgh"]}, 3),
+        # token IDs count a token each
+        ({"input": [1, 2, 3]}, 3),
+        ({"input": [[1, 2], [3, 4, 5]]}, 5),
+        # each chat message adds 4 tokens, and the reply 3
+        ({"messages": [{"content": "abcd"}, {"content": "abcdefgh"}]}, 14),
+        ({"messages": [{"role": "assistant", "content": None}]}, 7),
+        ({"messages": ["not a message", {"content": "abcd"}]}, 12),
+        # only the text parts of content arrays count
+        (
+            {
+                "messages": [
+                    {
+                        "content": [
+                            {"type": "text", "text": "abcd"},
+                            {"type": "image_url", "image_url": {"url": "x"}},
+                            "not a part",
+                            5,
+                        ]
+                    }
+                ]
+            },
+            8,
+        ),
+        # other characters count a token each, and characters outside the BMP two (UTF-16 code units)
+        ({"input": "你好"}, 2),
+        ({"input": "héllo"}, 2),
+        ({"input": "😀"}, 2),
+    ],
+)
+def test_estimate_prompt_tokens(body, expected):
+    assert estimate_prompt_tokens(body) == expected
+
+
+def test_policy_expression_matches_the_registered_equivalent():
+    # fails with "No Python equivalent" if the consumed-tokens expression changes without estimate_policy_tokens
+    PolicyCompiler(CAPABILITY_EXPRESSIONS, {}).compile_policy(TOKEN_CALCULATING_POLICY)
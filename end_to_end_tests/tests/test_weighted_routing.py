@@ -0,0 +1,113 @@
+import math
+
+import pytest
+
+from common.weighted_routing import (
+    DEFAULT_BACKEND_ID,
+    latency_weights,
+    select_backend,
+    select_backend_order,
+    weighted_preferred_backends,
+)
+
+WEIGHTED_BACKENDS = [
+    {"backendId": "a", "weight": 0.5},
+    {"backendId": "b", "weight": 0.3},
+    {"backendId": "c", "weight": 0.2},
+]
+
+
+@pytest.mark.parametrize(
+    "point, expected",
+    [
+        (0, ["a", "b", "c"]),
+        (0.49, ["a", "b", "c"]),
+        (0.5, ["b", "a", "c"]),
+        (0.79, ["b", "a", "c"]),
+        (0.8, ["c", "a", "b"]),
+        (0.999, ["c", "a", "b"]),
+    ],
+)
+def test_select_backend_order_picks_a_backend_by_weight(point, expected):
+    assert select_backend_order(WEIGHTED_BACKENDS, point) == expected
+
+
+def test_select_backend_order_without_weights_keeps_the_ranked_order():
+    assert select_backend_order(["b", "a"], 0.9) == ["b", "a"]
+
+
+def test_select_backend_order_with_zero_weights_keeps_the_ranked_order():
+    backends = [{"backendId": "a", "weight": 0}, {"backendId": "b", "weight": 0}]
+
+    assert select_backend_order(backends, 0.9) == ["a", "b"]
+
+
+def test_select_backend_order_never_picks_a_backend_without_weight():
+    backends = [
+        {"backendId": "a", "weight": 1},
+        {"backendId": "failed", "weight": 0},
+        {"backendId": "missing"},
+    ]
+
+    assert select_backend_order(backends, 0.999) == ["a", "failed", "missing"]
+
+
+def test_select_backend_order_treats_negative_weights_as_zero():
+    backends = [{"backendId": "a", "weight": -1}, {"backendId": "b", "weight": 1}]
+
+    assert select_backend_order(backends, 0) == ["b", "a"]
+
+
+def test_select_backend_order_of_no_backends():
+    assert select_backend_order([], 0.5) == []
+
+
+def test_select_backend_order_matches_the_weights_over_many_requests():
+    requests = 10000
+    picks = [
+        select_backend_order(WEIGHTED_BACKENDS, (index + 0.5) / requests)[0]
+        for index in range(requests)
+    ]
+
+    assert [picks.count(backend_id) / requests for backend_id in "abc"] == [
+        pytest.approx(0.5),
+        pytest.approx(0.3),
+        pytest.approx(0.2),
+    ]
+
+
+def test_latency_weights_favour_faster_backends():
+    assert latency_weights([0.1, 0.2], exponent=1) == [0.667, 0.333]
+    assert latency_weights([0.1, 0.2], exponent=2) == [0.8, 0.2]
+
+
+def test_latency_weights_give_failed_backends_no_weight():
+    assert latency_weights([0.1, math.inf]) == [1.0, 0]
+
+
+def test_latency_weights_spread_evenly_if_every_backend_failed():
+    assert latency_weights([math.inf, math.inf]) == [0.5, 0.5]
+
+
+def test_weighted_preferred_backends():
+    assert weighted_preferred_backends(["a", "b"], None) == ["a", "b"]
+    assert weighted_preferred_backends(["a", "b"], [0.8, 0.2]) == [
+        {"backendId": "a", "weight": 0.8},
+        {"backendId": "b", "weight": 0.2},
+    ]
+
+
+def test_select_backend_moves_down_the_order_on_each_retry():
+    order = ["b", "a", "c"]
+
+    assert [select_backend(order, attempt) for attempt in range(5)] == [
+        "b",
+        "a",
+        "c",
+        "c",
+        "c",
+    ]
+
+
+def test_select_backend_without_an_order_uses_the_default_backend():
+    assert select_backend([], 0) == DEFAULT_BACKEND_ID
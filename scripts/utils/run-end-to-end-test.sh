@@ -127,6 +127,13 @@ tenant_id=$(az account show --output tsv --query tenantId)
 
 load_test_root="$script_dir/../../end_to_end_tests"
 
+# WORKER_COUNT runs a Locust master plus that many worker processes (-1 for one per core)
+# the scenarios only run their setup and reporting on the master
+process_args=()
+if [[ -n "${WORKER_COUNT}" ]]; then
+	process_args=(--processes "$WORKER_COUNT")
+fi
+
 if [[ $USER_COUNT == "-1" ]]; then
 	APIM_SUBSCRIPTION_ONE_KEY=$apim_subscription_one_key \
 	APIM_SUBSCRIPTION_TWO_KEY=$apim_subscription_two_key \
@@ -150,7 +157,8 @@ if [[ $USER_COUNT == "-1" ]]; then
 		-f "$load_test_root/$TEST_FILE" \
 		-H "$apim_base_url/$ENDPOINT_PATH/" \
 		--autostart \
-		--autoquit 0
+		--autoquit 0 \
+		"${process_args[@]}"
 else
 	APIM_SUBSCRIPTION_ONE_KEY=$apim_subscription_one_key \
 	APIM_SUBSCRIPTION_TWO_KEY=$apim_subscription_two_key \
@@ -176,5 +184,6 @@ else
 		--users "$USER_COUNT" \
 		--run-time "$RUN_TIME" \
 		--autostart \
-		--autoquit 0
+		--autoquit 0 \
+		"${process_args[@]}"
 fi
\ No newline at end of file